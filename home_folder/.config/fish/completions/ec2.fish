@@ -16,7 +16,18 @@ complete -c ec2 -n __fish_ec2_needs_command -f -a list -d 'List all instance con
 complete -c ec2 -n __fish_ec2_needs_command -f -a ls -d 'List all instance configurations.'
 complete -c ec2 -n __fish_ec2_needs_command -f -a destroy -d 'Destroy an instance configuration.'
 complete -c ec2 -n __fish_ec2_needs_command -f -a vscode -d 'Open vscode to an instance.'
+complete -c ec2 -n __fish_ec2_needs_command -f -a bake -d 'Bake a provisioned instance into an image.'
+complete -c ec2 -n __fish_ec2_needs_command -f -a exec -d 'Run a command on several instances at once.'
+complete -c ec2 -n __fish_ec2_needs_command -f -a push -d 'Copy files to an instance, sending only what changed.'
+complete -c ec2 -n __fish_ec2_needs_command -f -a pull -d 'Copy files from an instance, fetching only what changed.'
+complete -c ec2 -n __fish_ec2_needs_command -f -a gc -d 'Find and delete resources left behind by deleted instances.'
+complete -c ec2 -n __fish_ec2_needs_command -f -a pool -d 'Manage the warm pool of stopped instances.'
+complete -c ec2 -n __fish_ec2_needs_command -f -a providers -d 'Download the terraform providers into the local mirror.'
 
 complete -c ec2 -n '__fish_seen_subcommand_from connect' -f -a '(__fish_ec2_get_instances)'
 complete -c ec2 -n '__fish_seen_subcommand_from ssh' -f -a '(__fish_ec2_get_instances)'
 complete -c ec2 -n '__fish_seen_subcommand_from destroy' -f -a '(__fish_ec2_get_instances)'
+complete -c ec2 -n '__fish_seen_subcommand_from exec' -f -a '(__fish_ec2_get_instances)'
+complete -c ec2 -n '__fish_seen_subcommand_from bake' -f -a '(__fish_ec2_get_instances)'
+complete -c ec2 -n '__fish_seen_subcommand_from push pull' -a '(__fish_ec2_get_instances)'
+complete -c ec2 -n '__fish_seen_subcommand_from pool' -f -a 'status fill replenish drain'
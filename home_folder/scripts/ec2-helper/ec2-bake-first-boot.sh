@@ -0,0 +1,33 @@
+#!/bin/bash
+# Installed by `ec2 bake` as a per-instance cloud-init script: it runs once on every
+# instance booted from the baked image, and scrubs what they inherited from the instance
+# the image was baked from. cloud-init is done with that instance's per-instance scripts,
+# and the instance ID check below keeps it from ever running there.
+
+SOURCE_INSTANCE_ID="$BAKED_INSTANCE_ID"
+METADATA_URL="http://169.254.169.254/latest"
+
+TOKEN=$(curl -sf -X PUT "$METADATA_URL/api/token" -H "X-aws-ec2-metadata-token-ttl-seconds: 60")
+metadata() {
+    curl -sf -H "X-aws-ec2-metadata-token: $TOKEN" "$METADATA_URL/meta-data/$1"
+}
+
+INSTANCE_ID=$(metadata instance-id)
+if [ -z "$INSTANCE_ID" ] || [ "$INSTANCE_ID" = "$SOURCE_INSTANCE_ID" ]; then
+    exit 0
+fi
+
+# Only this instance's key pair may log in: the baked instance's keys (including ones
+# added by hand) would otherwise keep working on every instance of the image
+KEY=$(metadata public-keys/0/openssh-key)
+for LOGIN_USER in ec2-user ubuntu; do
+    if id "$LOGIN_USER" &>/dev/null; then
+        AUTHORIZED_KEYS="$(eval echo ~$LOGIN_USER)/.ssh/authorized_keys"
+        if [ -f "$AUTHORIZED_KEYS" ]; then
+            echo "$KEY" > "$AUTHORIZED_KEYS"
+        fi
+    fi
+done
+
+# The baked instance's cloud-init state
+rm -rf "/var/lib/cloud/instances/$SOURCE_INSTANCE_ID"
@@ -0,0 +1,36 @@
+terraform {
+  required_providers {
+    aws = {
+      source = "hashicorp/aws"
+    }
+  }
+}
+
+provider "aws" {
+  region              = "$REGION"
+  allowed_account_ids = [$ACCOUNT]
+}
+
+# Adopt the existing instance on the first apply
+import {
+  to = aws_instance.server
+  id = "$INSTANCE_ID"
+}
+
+resource "aws_instance" "server" {
+  ami           = "$AMI"
+  instance_type = "$INSTANCE_TYPE"
+
+  # Managed for destroy only - applies must never modify or replace the instance
+  lifecycle {
+    ignore_changes = all
+  }
+}
+
+output "server_ip" {
+  value       = aws_instance.server.public_ip
+}
+
+output "instance_id" {
+  value       = aws_instance.server.id
+}
@@ -9,13 +9,30 @@ else
     exit 1
 fi
 
-cat << EOF >> /etc/profile.d/status.sh
+cat << EOF > /etc/profile.d/status.sh
 function status() {
     tail -f /var/log/cloud-init-output.log
 }
 EOF
 chmod +x /etc/profile.d/status.sh
 
+# Images baked with `ec2 bake` are already provisioned - only refresh the dotfiles
+if [ -f /etc/ec2-helper-baked ]; then
+    echo "Baked image (version $(cat /etc/ec2-helper-baked)), only refreshing the configuration"
+
+    if id "ec2-user" &>/dev/null; then
+        LOGIN_USER="ec2-user"
+    else
+        LOGIN_USER="ubuntu"
+    fi
+
+    git clone --depth 1 https://github.com/danielkleinstein/config.git /tmp/config
+    chmod -R a+rX /tmp/config
+    su - $LOGIN_USER -c "cp -r /tmp/config/home_folder/. \$HOME/"
+    rm -rf /tmp/config
+    exit 0
+fi
+
 $PACKAGE_MANAGER update -y
 $PACKAGE_MANAGER install git -y
 
@@ -96,4 +96,8 @@ output "server_key" {
 
 output "server_public_key" {
   value       = local_file.public_key_file.filename
+}
+
+output "instance_id" {
+  value       = aws_instance.server.id
 }
\ No newline at end of file
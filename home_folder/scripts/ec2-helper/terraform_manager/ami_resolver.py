@@ -0,0 +1,100 @@
+"""Resolve AMI IDs to the Linux distribution they run, in batches and with a persistent memo."""
+import json
+import os
+import threading
+from typing import Dict, Iterable, List
+
+from terraform_manager.manager_base import cache_path, write_atomically
+
+# describe_images accepts at most 200 values per filter
+_DESCRIBE_IMAGES_BATCH_SIZE = 200
+
+UNKNOWN_DISTRO = "Unknown"
+
+
+def distro_from_description(description: str) -> str:
+    """Return a human-readable distro name guessed from an AMI description."""
+    description = description.lower()
+    if "ubuntu" in description:
+        return "Ubuntu"
+    if "amzn" in description or "amazon linux" in description:
+        return "Amazon Linux"
+    if "kubernetes worker ami" in description:
+        return "EKS AMI"
+    return f"{UNKNOWN_DISTRO} - {description}"
+
+
+class AmiDistroResolver:
+    """Maps AMI IDs to distro names.
+
+    An AMI's description never changes, so every resolved AMI is remembered on disk and
+    never looked up again. Unknown AMIs are resolved with batched describe_images calls.
+    The resolver is safe to share between threads (e.g. one per region).
+    """
+
+    def __init__(self):
+        self._memo_path = os.path.join(cache_path(), "ami-distros.json")
+        self._memo = self._read_memo()
+        self._new_entries: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _read_memo(self) -> Dict[str, str]:
+        try:
+            with open(self._memo_path, encoding="utf-8") as memo_file:
+                return json.load(memo_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _describe(self, ec2_client, image_ids: List[str]) -> Dict[str, str]:
+        distros = {}
+        for i in range(0, len(image_ids), _DESCRIBE_IMAGES_BATCH_SIZE):
+            batch = image_ids[i : i + _DESCRIBE_IMAGES_BATCH_SIZE]
+            # A filter (unlike ImageIds=) doesn't fail the whole call on deregistered AMIs
+            paginator = ec2_client.get_paginator("describe_images")
+            for page in paginator.paginate(
+                Filters=[{"Name": "image-id", "Values": batch}],
+                IncludeDeprecated=True,
+            ):
+                for image in page["Images"]:
+                    distros[image["ImageId"]] = distro_from_description(
+                        image.get("Description", "")
+                    )
+        return distros
+
+    def resolve(self, ec2_client, image_ids: Iterable[str]) -> Dict[str, str]:
+        """Return a mapping of every given AMI ID to its distro name.
+
+        ec2_client must be in the region the AMIs belong to.
+        """
+        image_ids = set(filter(None, image_ids))
+
+        with self._lock:
+            resolved = {
+                image_id: self._memo[image_id]
+                for image_id in image_ids
+                if image_id in self._memo
+            }
+        missing = sorted(image_ids - resolved.keys())
+
+        if missing:
+            described = self._describe(ec2_client, missing)
+            with self._lock:
+                self._memo.update(described)
+                self._new_entries.update(described)
+            resolved.update(described)
+
+            # Deregistered or inaccessible AMIs - don't memoize, they may become visible later
+            for image_id in missing:
+                resolved.setdefault(image_id, UNKNOWN_DISTRO)
+
+        return resolved
+
+    def save(self):
+        """Persist newly resolved AMIs, merging with entries written by other processes."""
+        with self._lock:
+            if not self._new_entries:
+                return
+            memo = self._read_memo()
+            memo.update(self._new_entries)
+            write_atomically(self._memo_path, json.dumps(memo, sort_keys=True))
+            self._new_entries = {}
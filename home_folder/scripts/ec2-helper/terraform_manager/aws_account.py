@@ -0,0 +1,37 @@
+"""Look up the AWS account of the current credentials, cached across runs."""
+import hashlib
+import os
+
+from terraform_manager.catalog_cache import CatalogCache
+
+# An account never changes for a given set of credentials
+ACCOUNT_ID_TTL_SECONDS = 30 * 24 * 60 * 60
+
+
+def _credentials_key() -> str:
+    access_key_id = os.environ.get("AWS_ACCESS_KEY_ID")
+    if access_key_id:
+        return "key-" + hashlib.sha256(access_key_id.encode("utf-8")).hexdigest()[:16]
+    profile = (
+        os.environ.get("AWS_PROFILE")
+        or os.environ.get("AWS_DEFAULT_PROFILE")
+        or "default"
+    )
+    return f"profile-{profile}"
+
+
+def _fetch_account_id() -> str:
+    import boto3  # pylint: disable=import-outside-toplevel
+
+    sts_client = boto3.session.Session().client("sts")
+    return sts_client.get_caller_identity()["Account"]
+
+
+def aws_account_id(refresh: bool = False) -> str:
+    """Return the account ID of the current credentials (profile or access key).
+
+    The STS lookup only happens the first time a set of credentials is used, or with
+    refresh.
+    """
+    cache = CatalogCache(ttl_seconds=ACCOUNT_ID_TTL_SECONDS, force_refresh=refresh)
+    return cache.get(f"account-id-{_credentials_key()}", _fetch_account_id)
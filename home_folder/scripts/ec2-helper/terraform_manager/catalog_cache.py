@@ -0,0 +1,91 @@
+"""On-disk TTL cache for slow-changing EC2 catalog lookups (regions, instance types, AMIs)."""
+import json
+import os
+import re
+import sys
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from terraform_manager.manager_base import cache_path, write_atomically
+
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+
+
+class CatalogCache:
+    """A JSON-file-per-key cache with a TTL and stale-while-revalidate semantics.
+
+    Missing entries are loaded synchronously. Stale entries are returned immediately and
+    refreshed in a background thread, so that only the very first lookup pays for the
+    AWS API calls.
+    """
+
+    def __init__(
+        self, ttl_seconds: float = DEFAULT_TTL_SECONDS, force_refresh: bool = False
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.force_refresh = force_refresh
+        self._directory = cache_path("catalog")
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _entry_path(self, key: str) -> str:
+        safe_key = re.sub(r"[^A-Za-z0-9_.-]", "_", key)
+        return os.path.join(self._directory, f"{safe_key}.json")
+
+    def _read(self, key: str) -> Optional[dict]:
+        try:
+            with open(self._entry_path(key), encoding="utf-8") as entry_file:
+                return json.load(entry_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _store(self, key: str, value: Any):
+        write_atomically(
+            self._entry_path(key),
+            json.dumps({"fetched_at": time.time(), "value": value}),
+        )
+
+    def _load_and_store(self, key: str, loader: Callable[[], Any]) -> Any:
+        value = loader()
+        self._store(key, value)
+        return value
+
+    def _background_refresh(self, key: str, loader: Callable[[], Any]):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._load_and_store(key, loader)
+            except Exception as e:  # pylint: disable=broad-except
+                sys.stderr.write(f'Background refresh of "{key}" failed: {e}\n')
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        # Not a daemon thread - let the refresh complete even if the command finishes first
+        threading.Thread(target=refresh, name=f"catalog-refresh-{key}").start()
+
+    def get(self, key: str, loader: Callable[[], Any]) -> Any:
+        """Return the cached value for key, calling loader to (re)populate it when needed."""
+        if self.force_refresh:
+            return self._load_and_store(key, loader)
+
+        entry = self._read(key)
+        if entry is None:
+            return self._load_and_store(key, loader)
+
+        if time.time() - entry["fetched_at"] > self.ttl_seconds:
+            self._background_refresh(key, loader)
+
+        return entry["value"]
+
+    def invalidate(self, key: str):
+        """Drop the cached value for key, if there is one."""
+        try:
+            os.remove(self._entry_path(key))
+        except FileNotFoundError:
+            pass
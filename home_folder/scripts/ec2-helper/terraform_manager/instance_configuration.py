@@ -1,10 +1,15 @@
 """Encapsulates logic for retrieving user configuration of an EC2 instance."""
-from typing import Optional, Tuple
-import boto3
+from typing import Dict, List, Optional, Tuple
 import dataclasses
 import enum
 import subprocess  # nosec (remove bandit warning)
 
+from terraform_manager.catalog_cache import CatalogCache
+from terraform_manager.instance_type_catalog import (
+    InstanceTypeIndex,
+    InstanceTypeRequirements,
+)
+
 
 class LinuxDistro(enum.Enum):
     """Represents a Linux distribution."""
@@ -29,6 +34,17 @@ class CpuArchitecture(enum.Enum):
         raise ValueError(f"Unexpected AWS architecture: {aws_arch}")
 
 
+# Tags of the images created by `ec2 bake`
+BAKED_IMAGE_TAG = "ec2-helper:baked"
+BAKED_DISTRO_TAG = "ec2-helper:distro"
+BAKED_VERSION_TAG = "ec2-helper:version"
+
+
+def distro_ami_key(distro: LinuxDistro) -> str:
+    """Return the key of the given distro in the AMI catalog."""
+    return distro.name.lower()
+
+
 @dataclasses.dataclass
 class InstanceConfiguration:
     """Represents the configuration needed to create an EC2 instance."""
@@ -39,10 +55,14 @@ class InstanceConfiguration:
     distro: LinuxDistro
 
 
-def fzf_select(options, header=""):
-    """Return the option selected by the user using fzf."""
+def fzf_select(options, header="", multi=False):
+    """Return the option selected by the user using fzf.
+
+    With multi, several options can be selected (with tab); they're returned one per line.
+    """
     with subprocess.Popen(
-        ["fzf", "--header=" + header],  # nosec (remove bandit warning)
+        ["fzf", "--header=" + header]
+        + (["--multi"] if multi else []),  # nosec (remove bandit warning)
         stdin=subprocess.PIPE,
         stdout=subprocess.PIPE,
     ) as process:
@@ -50,10 +70,20 @@ def fzf_select(options, header=""):
     return stdout.decode("utf-8").strip()
 
 
-def _instance_configuration_region(ec2_client, chosen_region: Optional[str]) -> str:
-    regions = [
-        region["RegionName"] for region in ec2_client.describe_regions()["Regions"]
-    ]
+def available_regions(ec2_client, cache: CatalogCache) -> List[str]:
+    """Return the regions enabled for the account, served from the catalog cache."""
+    return cache.get(
+        "regions",
+        lambda: [
+            region["RegionName"] for region in ec2_client.describe_regions()["Regions"]
+        ],
+    )
+
+
+def _instance_configuration_region(
+    ec2_client, cache: CatalogCache, chosen_region: Optional[str]
+) -> str:
+    regions = available_regions(ec2_client, cache)
 
     if chosen_region:
         if chosen_region not in regions:
@@ -72,74 +102,55 @@ def _instance_configuration_region(ec2_client, chosen_region: Optional[str]) ->
     return selected_region
 
 
-def _get_all_instance_types(ec2_client):
-    paginator = ec2_client.get_paginator("describe_instance_types")
-    iterator = paginator.paginate()
-
-    instance_types = []
-
-    for page in iterator:
-        for it in page["InstanceTypes"]:
-            if it["InstanceType"].startswith(("c", "m", "t")):
-                instance_types.append(it)
-
-    return instance_types
-
-
 def _instance_configuration_instance_type(
-    ec2_client, chosen_instance_type: Optional[str]
+    ec2_client,
+    cache: CatalogCache,
+    region: str,
+    chosen_instance_type: Optional[str],
+    requirements: Optional[InstanceTypeRequirements] = None,
 ) -> Tuple[str, CpuArchitecture]:
-    instance_types = _get_all_instance_types(ec2_client)
-
-    available_instance_types = [it["InstanceType"] for it in instance_types]
+    index = InstanceTypeIndex.load(ec2_client, cache, region)
+    requirements = requirements or InstanceTypeRequirements()
 
     if chosen_instance_type:
-        if chosen_instance_type not in available_instance_types:
+        if not requirements.unconstrained:
+            raise ValueError(
+                "Specify either an instance type or instance type requirements, not both."
+            )
+        chosen = index.get(chosen_instance_type)
+        if chosen is None:
             raise ValueError(
                 f'Instance type "{chosen_instance_type}" not found in available instance types '
-                f"{sorted(available_instance_types)}"
+                f"{sorted(instance_type.name for instance_type in index)}"
             )
-
-        # Fetch the architecture
-        chosen_instance_architecture = [
-            it["ProcessorInfo"]["SupportedArchitectures"][0]
-            for it in instance_types
-            if it["InstanceType"] == chosen_instance_type
-        ][0]
-        return chosen_instance_type, CpuArchitecture.from_aws_architecture(
-            chosen_instance_architecture
+    elif not requirements.unconstrained:
+        chosen = index.best_match(requirements)
+        if chosen is None:
+            raise ValueError(
+                f"No instance type in {region} satisfies the requirements {requirements}."
+            )
+        print(f"Selected {index.describe(chosen)}")
+    else:
+        chosen_instance_desc = fzf_select(
+            sorted(index.describe(instance_type) for instance_type in index)
         )
+        chosen = index.get(chosen_instance_desc.split(" - ", maxsplit=1)[0].strip())
+        if chosen is None:
+            raise ValueError("No instance type selected.")
 
-    instance_details = [
-        f'{it["InstanceType"]} - {it["VCpuInfo"]["DefaultVCpus"]} vCPUs, {it["MemoryInfo"]["SizeInMiB"]/1024} GiB RAM'
-        for it in instance_types
-    ]
-    chosen_instance_desc = fzf_select(sorted(instance_details))
-    chosen_instance = chosen_instance_desc.split("-", maxsplit=1)[0].strip()
-
-    chosen_instance_architecture = [
-        it["ProcessorInfo"]["SupportedArchitectures"][0]
-        for it in instance_types
-        if it["InstanceType"] == chosen_instance
-    ][0]
+    return chosen.name, CpuArchitecture.from_aws_architecture(chosen.architecture)
 
-    return chosen_instance, CpuArchitecture.from_aws_architecture(
-        chosen_instance_architecture
-    )
 
-
-def _instance_configuration_ami(
-    ec2_client,
-    chosen_distro: Optional[str],
-    chosen_instance_architecture: CpuArchitecture,
-) -> Tuple[str, LinuxDistro]:
+def _get_latest_amis(ec2_client, architecture: CpuArchitecture) -> Dict[str, str]:
     # Get the Amazon Linux AMI
     response = ec2_client.describe_images(
         Owners=["amazon"],
         Filters=[
             {
                 "Name": "description",
-                "Values": ["Amazon Linux 2023 AMI 2023* x86_64 HVM kernel-6.1"],
+                "Values": [
+                    f"Amazon Linux 2023 AMI 2023* {architecture.value} HVM kernel-6.1"
+                ],
             }
         ],
     )
@@ -159,12 +170,70 @@ def _instance_configuration_ami(
         if "UNSUPPORTED" not in img["Description"]
         and "Pro" not in img["Description"]
         and "Minimal" not in img["Description"]
-        and img["Architecture"] == chosen_instance_architecture.value
+        and img["Architecture"] == architecture.value
     ]
     ubuntu_ami = sorted(ubuntu_images, key=lambda x: x["CreationDate"], reverse=True)[
         0
     ]["ImageId"]
 
+    return {"amazon_linux": amazon_linux_ami, "ubuntu": ubuntu_ami}
+
+
+def _get_baked_amis(ec2_client, architecture: CpuArchitecture) -> Dict[str, dict]:
+    response = ec2_client.describe_images(
+        Owners=["self"],
+        Filters=[
+            {"Name": f"tag:{BAKED_IMAGE_TAG}", "Values": ["true"]},
+            {"Name": "architecture", "Values": [architecture.value]},
+            {"Name": "state", "Values": ["available"]},
+        ],
+    )
+
+    # The newest version of every distro
+    baked_amis = {}
+    for image in sorted(response["Images"], key=lambda x: x["CreationDate"]):
+        tags = {tag["Key"]: tag["Value"] for tag in image.get("Tags", [])}
+        if tags.get(BAKED_DISTRO_TAG) in LinuxDistro.__members__:
+            baked_amis[distro_ami_key(LinuxDistro[tags[BAKED_DISTRO_TAG]])] = {
+                "ami": image["ImageId"],
+                "version": tags.get(BAKED_VERSION_TAG, image["CreationDate"]),
+            }
+
+    return baked_amis
+
+
+def baked_amis_cache_key(region: str, architecture: CpuArchitecture) -> str:
+    """Return the catalog cache key of the baked images of the given region."""
+    return f"baked-amis-{region}-{architecture.value}"
+
+
+def _instance_configuration_ami(
+    ec2_client,
+    cache: CatalogCache,
+    region: str,
+    chosen_distro: Optional[str],
+    chosen_instance_architecture: CpuArchitecture,
+    prefer_baked: bool = True,
+) -> Tuple[str, LinuxDistro]:
+    amis = cache.get(
+        f"amis-{region}-{chosen_instance_architecture.value}",
+        lambda: _get_latest_amis(ec2_client, chosen_instance_architecture),
+    )
+    labels = {"amazon_linux": "Amazon Linux AMI", "ubuntu": "Ubuntu AMI"}
+
+    # Images baked with `ec2 bake` boot into a provisioned system, so they win
+    if prefer_baked:
+        baked_amis = cache.get(
+            baked_amis_cache_key(region, chosen_instance_architecture),
+            lambda: _get_baked_amis(ec2_client, chosen_instance_architecture),
+        )
+        for key, baked in baked_amis.items():
+            amis = {**amis, key: baked["ami"]}
+            labels[key] += f" (baked {baked['version']})"
+
+    amazon_linux_ami = amis["amazon_linux"]
+    ubuntu_ami = amis["ubuntu"]
+
     if chosen_distro:
         if chosen_distro == "ubuntu":
             return (ubuntu_ami, LinuxDistro.UBUNTU)
@@ -172,7 +241,10 @@ def _instance_configuration_ami(
             return (amazon_linux_ami, LinuxDistro.AMAZON_LINUX)
         raise ValueError(f"Unexpected distro: {chosen_distro}")
 
-    ami_options = [f"Amazon Linux AMI: {amazon_linux_ami}", f"Ubuntu AMI: {ubuntu_ami}"]
+    ami_options = [
+        f'{labels["amazon_linux"]}: {amazon_linux_ami}',
+        f'{labels["ubuntu"]}: {ubuntu_ami}',
+    ]
     chosen_ami_desc = fzf_select(ami_options)
     if "Amazon Linux" in chosen_ami_desc:
         distro = LinuxDistro.AMAZON_LINUX
@@ -190,12 +262,25 @@ def instance_configuration(
     chosen_region: Optional[str],
     chosen_distro: Optional[str],
     chosen_instance_type: Optional[str],
+    refresh_catalog: bool = False,
+    prefer_baked: bool = True,
+    requirements: Optional[InstanceTypeRequirements] = None,
 ) -> InstanceConfiguration:
-    """Return an InstanceConfiguration object with the settings chosen by the user."""
+    """Return an InstanceConfiguration object with the settings chosen by the user.
+
+    Catalog lookups are served from an on-disk cache; refresh_catalog forces a reload.
+    With prefer_baked, the newest image baked with `ec2 bake` replaces the stock AMI of
+    its distro. Without a chosen instance type, requirements (if any) select the smallest
+    matching one instead of the picker.
+    """
+    # Imported here so that the local-only commands never pay for loading the AWS SDK
+    import boto3  # pylint: disable=import-outside-toplevel
+
     session = boto3.session.Session()
     ec2_client = session.client("ec2")
+    cache = CatalogCache(force_refresh=refresh_catalog)
 
-    region = _instance_configuration_region(ec2_client, chosen_region)
+    region = _instance_configuration_region(ec2_client, cache, chosen_region)
     ec2_client_in_region = session.client("ec2", region_name=region)
 
     # It's important to choose the instance type before the AMI - so that we find an AMI matching the instance
@@ -204,10 +289,15 @@ def instance_configuration(
         chosen_instance,
         chosen_instance_architecture,
     ) = _instance_configuration_instance_type(
-        ec2_client_in_region, chosen_instance_type
+        ec2_client_in_region, cache, region, chosen_instance_type, requirements
     )
     ami, distro = _instance_configuration_ami(
-        ec2_client_in_region, chosen_distro, chosen_instance_architecture
+        ec2_client_in_region,
+        cache,
+        region,
+        chosen_distro,
+        chosen_instance_architecture,
+        prefer_baked,
     )
 
     return InstanceConfiguration(
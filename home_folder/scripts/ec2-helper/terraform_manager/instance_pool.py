@@ -0,0 +1,288 @@
+"""A warm pool of provisioned, stopped instances that `ec2 create` can claim."""
+import contextlib
+import dataclasses
+import fcntl
+import json
+import os
+import random
+import time
+from typing import Dict, Iterator, List, Optional
+
+from terraform_manager.instance_configuration import InstanceConfiguration, LinuxDistro
+from terraform_manager.instance_registry import InstanceRecord, InstanceRegistry
+from terraform_manager.manager_base import terraform_folders_path, write_atomically
+
+_POOL_VERSION = 1
+
+# A member is "provisioning" until it's fully set up and stopped, then "ready"
+PROVISIONING_STATE = "provisioning"
+READY_STATE = "ready"
+
+_START_ATTEMPTS = 5
+_START_BACKOFF_SECONDS = 2.0
+_RETRIED_START_ERRORS = ("InsufficientInstanceCapacity", "RequestLimitExceeded")
+
+
+def pool_path() -> str:
+    """Return the folder holding the pool members' terraform folders."""
+    path = os.path.join(terraform_folders_path(), "pool")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def pool_key(region: str, instance_type: str, distro: LinuxDistro) -> str:
+    """Return the key of the pool of the given kind of instances."""
+    return f"{region}/{instance_type}/{distro.name}"
+
+
+def distro_option(distro: LinuxDistro) -> str:
+    """Return the --distro value (and instance_configuration argument) of a distro."""
+    return distro.name.lower().replace("_", "-")
+
+
+@dataclasses.dataclass
+class PoolMember:
+    """A pooled instance, waiting (stopped) to be claimed."""
+
+    name: str
+    instance_configuration: InstanceConfiguration
+    creation_time: str
+    state: str = PROVISIONING_STATE
+    instance_id: Optional[str] = None
+    # Path of the private key, relative to the member's folder
+    server_key: Optional[str] = None
+
+    @property
+    def key(self) -> str:
+        """Return the key of the pool the member belongs to."""
+        return pool_key(
+            self.instance_configuration.region,
+            self.instance_configuration.instance_type,
+            self.instance_configuration.distro,
+        )
+
+    @property
+    def path(self) -> str:
+        """Return the terraform folder of the member."""
+        return os.path.join(pool_path(), self.name)
+
+    def to_json(self) -> dict:
+        """Return the member as a JSON-serializable dict."""
+        return {
+            "name": self.name,
+            "region": self.instance_configuration.region,
+            "ami": self.instance_configuration.ami,
+            "instance_type": self.instance_configuration.instance_type,
+            "distro": self.instance_configuration.distro.name,
+            "creation_time": self.creation_time,
+            "state": self.state,
+            "instance_id": self.instance_id,
+            "server_key": self.server_key,
+        }
+
+    @staticmethod
+    def from_json(member: dict) -> "PoolMember":
+        """Return the member stored as the given dict."""
+        return PoolMember(
+            name=member["name"],
+            instance_configuration=InstanceConfiguration(
+                region=member["region"],
+                ami=member["ami"],
+                instance_type=member["instance_type"],
+                distro=LinuxDistro[member["distro"]],
+            ),
+            creation_time=member["creation_time"],
+            state=member["state"],
+            instance_id=member.get("instance_id"),
+            server_key=member.get("server_key"),
+        )
+
+
+class WarmPool:
+    """The pool's target sizes and members.
+
+    Like the instance registry, reads cost a single file read and changes go through
+    update(), which holds an exclusive lock and rewrites the file atomically.
+    """
+
+    def __init__(self, targets: Dict[str, int], members: Dict[str, PoolMember]):
+        self.targets = targets
+        self._members = members
+
+    @staticmethod
+    def path() -> str:
+        """Return the path of the pool file."""
+        # Not created by reads, so that using no pool leaves no pool folder behind
+        return os.path.join(terraform_folders_path(), "pool", "pool.json")
+
+    @classmethod
+    def load(cls) -> "WarmPool":
+        """Return the current pool."""
+        try:
+            with open(cls.path(), encoding="utf-8") as pool_file:
+                contents = json.load(pool_file)
+        except FileNotFoundError:
+            return cls({}, {})
+
+        if contents.get("version") != _POOL_VERSION:
+            raise ValueError(
+                f'Unsupported pool version {contents.get("version")} in {cls.path()}'
+            )
+
+        return cls(
+            contents["targets"],
+            {
+                name: PoolMember.from_json(member)
+                for name, member in contents["members"].items()
+            },
+        )
+
+    @classmethod
+    @contextlib.contextmanager
+    def update(cls) -> Iterator["WarmPool"]:
+        """Yield the pool for modification and atomically save it afterwards."""
+        pool_path()
+        with open(cls.path() + ".lock", "w", encoding="utf-8") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                pool = cls.load()
+
+                yield pool
+
+                write_atomically(
+                    cls.path(),
+                    json.dumps(
+                        {
+                            "version": _POOL_VERSION,
+                            "targets": dict(sorted(pool.targets.items())),
+                            "members": {
+                                name: member.to_json()
+                                for name, member in sorted(pool._members.items())
+                            },
+                        },
+                        indent=2,
+                    ),
+                )
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def members(self, key: Optional[str] = None) -> List[PoolMember]:
+        """Return the members (of the given pool), oldest first."""
+        return sorted(
+            (
+                member
+                for member in self._members.values()
+                if key is None or member.key == key
+            ),
+            key=lambda member: member.creation_time,
+        )
+
+    def missing(self, key: str) -> int:
+        """Return how many members the given pool lacks, counting provisioning ones."""
+        return max(0, self.targets.get(key, 0) - len(self.members(key)))
+
+    def put(self, member: PoolMember):
+        """Add or replace a member (use within update())."""
+        self._members[member.name] = member
+
+    def remove(self, name: str):
+        """Remove a member, if it exists (use within update())."""
+        self._members.pop(name, None)
+
+    def claim(self, key: str) -> Optional[PoolMember]:
+        """Remove and return the oldest ready member of the pool (use within update())."""
+        for member in self.members(key):
+            if member.state == READY_STATE:
+                self.remove(member.name)
+                return member
+        return None
+
+
+def start_instance_with_retry(ec2_client, instance_id: str):
+    """Start a stopped instance and wait until it's running.
+
+    Capacity and throttling errors are retried with exponential backoff and jitter.
+    """
+    import botocore.exceptions  # pylint: disable=import-outside-toplevel
+
+    for attempt in range(_START_ATTEMPTS):
+        try:
+            ec2_client.start_instances(InstanceIds=[instance_id])
+            break
+        except botocore.exceptions.ClientError as e:
+            if (
+                e.response["Error"]["Code"] not in _RETRIED_START_ERRORS
+                or attempt == _START_ATTEMPTS - 1
+            ):
+                raise
+            time.sleep(random.uniform(0, _START_BACKOFF_SECONDS * 2**attempt))
+
+    ec2_client.get_waiter("instance_running").wait(
+        InstanceIds=[instance_id], WaiterConfig={"Delay": 2, "MaxAttempts": 90}
+    )
+
+
+def _return_to_pool(member: PoolMember, instance_path: str):
+    os.rename(instance_path, member.path)
+    with WarmPool.update() as pool:
+        pool.put(member)
+
+
+def claim_pool_instance(
+    name: str, instance_config: InstanceConfiguration
+) -> Optional[InstanceRecord]:
+    """Claim a pooled instance matching instance_config as instance name, if there is one.
+
+    The member's folder becomes ec2-<name> and the instance is started and registered.
+    Returns None (leaving the pool as it was) if the pool is empty or the instance
+    couldn't be started, e.g. for lack of capacity.
+    """
+    key = pool_key(
+        instance_config.region, instance_config.instance_type, instance_config.distro
+    )
+    # Most creates have no pool to claim from, so only lock once there is a candidate
+    if not any(member.state == READY_STATE for member in WarmPool.load().members(key)):
+        return None
+    with WarmPool.update() as pool:
+        member = pool.claim(key)
+    if member is None:
+        return None
+
+    import boto3  # pylint: disable=import-outside-toplevel
+
+    instance_path = os.path.join(terraform_folders_path(), f"ec2-{name}")
+    os.rename(member.path, instance_path)
+
+    ec2_client = boto3.client("ec2", region_name=instance_config.region)
+    try:
+        print(f"Starting pooled instance {member.instance_id}...")
+        start_instance_with_retry(ec2_client, member.instance_id)
+    except Exception as e:  # pylint: disable=broad-except
+        print(f"Could not start pooled instance {member.instance_id}: {e}")
+        _return_to_pool(member, instance_path)
+        return None
+
+    instance = ec2_client.describe_instances(InstanceIds=[member.instance_id])[
+        "Reservations"
+    ][0]["Instances"][0]
+    # Tag the instance like instances created directly, for `ec2 list --live` and humans.
+    # Its other resources keep the member's name, which the record keeps as base_name.
+    ec2_client.create_tags(
+        Resources=[member.instance_id],
+        Tags=[{"Key": "Name", "Value": f"{name}-server"}],
+    )
+
+    record = InstanceRecord(
+        name=name,
+        # The pooled instance keeps the AMI it was provisioned from
+        instance_configuration=member.instance_configuration,
+        creation_time=time.strftime("%Y-%m-%d %H:%M:%S"),
+        server_ip=instance.get("PublicIpAddress"),
+        server_key=member.server_key,
+        instance_id=member.instance_id,
+        base_name=member.name,
+    )
+    with InstanceRegistry.update() as registry:
+        registry.put(record)
+
+    return record
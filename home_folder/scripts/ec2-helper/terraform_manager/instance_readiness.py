@@ -0,0 +1,173 @@
+"""Wait for a freshly created instance to become usable, as soon as it actually is."""
+import dataclasses
+import socket
+import subprocess  # nosec (remove bandit warning)
+import time
+from typing import Callable, List
+
+DEFAULT_READY_TIMEOUT_SECONDS = 900.0
+
+# Exponential backoff bounds for the TCP and SSH probes
+_INITIAL_PROBE_DELAY_SECONDS = 0.5
+_MAX_PROBE_DELAY_SECONDS = 5.0
+
+# Probe options: never prompt and fail fast. EC2 reuses public IPs, so like the managed
+# ssh_config entries, don't check (or record) host keys: a stale one would fail every probe
+SSH_PROBE_OPTIONS = [
+    "-o",
+    "BatchMode=yes",
+    "-o",
+    "ConnectTimeout=5",
+    "-o",
+    "StrictHostKeyChecking=no",
+    "-o",
+    "UserKnownHostsFile=/dev/null",
+    "-o",
+    "LogLevel=ERROR",
+]
+
+
+@dataclasses.dataclass
+class ReadinessPhase:
+    """The time it took for the instance to pass one readiness phase."""
+
+    name: str
+    seconds: float
+
+
+def _retry_with_backoff(probe: Callable[[], bool], deadline: float, description: str):
+    delay = _INITIAL_PROBE_DELAY_SECONDS
+    while not probe():
+        if time.monotonic() + delay > deadline:
+            raise TimeoutError(f"Timed out waiting for {description}.")
+        time.sleep(delay)
+        delay = min(delay * 2, _MAX_PROBE_DELAY_SECONDS)
+
+
+def _tcp_port_open(host: str, port: int) -> bool:
+    try:
+        with socket.create_connection((host, port), timeout=3):
+            return True
+    except OSError:
+        return False
+
+
+def _ssh_succeeds(
+    ssh_command: List[str], remote_command: str, deadline: float, errors: List[str]
+) -> bool:
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        return False
+    try:
+        # Bounded by the deadline, as e.g. `cloud-init status --wait` may never return
+        result = subprocess.run(
+            ssh_command + SSH_PROBE_OPTIONS + [remote_command],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            timeout=remaining,
+            check=False,
+        )  # nosec (remove bandit warning)
+    except subprocess.TimeoutExpired:
+        errors.append(f'"{remote_command}" did not finish in time')
+        return False
+    if result.returncode != 0:
+        errors.append(
+            result.stderr.decode("utf-8", errors="replace").strip()
+            or f"exit status {result.returncode}"
+        )
+    return result.returncode == 0
+
+
+def _wait_for_ssh(
+    ssh_command: List[str], remote_command: str, deadline: float, description: str
+):
+    errors: List[str] = []
+    try:
+        _retry_with_backoff(
+            lambda: _ssh_succeeds(ssh_command, remote_command, deadline, errors),
+            deadline,
+            description,
+        )
+    except TimeoutError as e:
+        if errors:
+            raise TimeoutError(f"{e} Last error: {errors[-1]}") from e
+        raise
+
+
+def _wait_for_waiter(
+    region: str, instance_id: str, waiter_name: str, delay: int, deadline: float
+):
+    import boto3  # pylint: disable=import-outside-toplevel
+
+    ec2_client = boto3.client("ec2", region_name=region)
+    max_attempts = max(1, int((deadline - time.monotonic()) // delay))
+    ec2_client.get_waiter(waiter_name).wait(
+        InstanceIds=[instance_id],
+        WaiterConfig={"Delay": delay, "MaxAttempts": max_attempts},
+    )
+
+
+def wait_until_ready(
+    region: str,
+    instance_id: str,
+    host: str,
+    ssh_command: List[str],
+    wait_status_ok: bool = False,
+    wait_cloud_init: bool = False,
+    timeout: float = DEFAULT_READY_TIMEOUT_SECONDS,
+) -> List[ReadinessPhase]:
+    """Block until the instance accepts SSH logins, returning how long each phase took.
+
+    ssh_command is the ssh invocation without a remote command, e.g.
+    ["ssh", "-i", key, "ubuntu@1.2.3.4"]. Optionally also wait for the EC2 status checks
+    and for cloud-init (i.e. the user-data provisioning) to finish.
+    """
+    deadline = time.monotonic() + timeout
+    phases = []
+
+    def run_phase(name: str, wait: Callable[[], None]):
+        start = time.monotonic()
+        wait()
+        phase = ReadinessPhase(name=name, seconds=time.monotonic() - start)
+        print(f"{phase.name}: {phase.seconds:.1f}s")
+        phases.append(phase)
+
+    run_phase(
+        "Instance running",
+        lambda: _wait_for_waiter(region, instance_id, "instance_running", 2, deadline),
+    )
+    run_phase(
+        "SSH port open",
+        lambda: _retry_with_backoff(
+            lambda: _tcp_port_open(host, 22), deadline, f"port 22 on {host}"
+        ),
+    )
+    # The port opens before cloud-init has created the login user and its authorized keys
+    run_phase(
+        "SSH login accepted",
+        lambda: _wait_for_ssh(ssh_command, "true", deadline, f"SSH on {host}"),
+    )
+
+    if wait_status_ok:
+        run_phase(
+            "Status checks passed",
+            lambda: _wait_for_waiter(
+                region, instance_id, "instance_status_ok", 5, deadline
+            ),
+        )
+
+    if wait_cloud_init:
+        # Progress is logged to /var/log/cloud-init-output.log (the `status` shell function)
+        run_phase(
+            "Cloud-init finished",
+            lambda: _wait_for_ssh(
+                ssh_command,
+                "cloud-init status --wait > /dev/null 2>&1 "
+                "|| test -f /var/lib/cloud/instance/boot-finished",
+                deadline,
+                f"cloud-init on {host}",
+            ),
+        )
+
+    print(f"Ready in {sum(phase.seconds for phase in phases):.1f}s")
+    return phases
@@ -0,0 +1,360 @@
+"""A single JSON index holding the metadata of every managed instance."""
+import contextlib
+import dataclasses
+import fcntl
+import json
+import os
+import re
+import sys
+from typing import Dict, Iterator, List, Optional
+
+from terraform_manager.instance_configuration import InstanceConfiguration, LinuxDistro
+from terraform_manager.manager_base import terraform_folders_path, write_atomically
+from terraform_manager.terraform_state import (
+    InstanceOutputs,
+    read_instance_outputs,
+    read_state,
+)
+
+_REGISTRY_VERSION = 1
+
+_BASE_NAME_PATTERN = re.compile(r'^\s*base_name\s*=\s*"([^"]*)"', re.MULTILINE)
+
+
+def distro_username(distro: LinuxDistro) -> str:
+    """Return the default login user of the given distro's AMIs."""
+    if distro == LinuxDistro.AMAZON_LINUX:
+        return "ec2-user"
+    if distro == LinuxDistro.UBUNTU:
+        return "ubuntu"
+    raise ValueError(f"Unexpected distro: {distro}")
+
+
+@dataclasses.dataclass
+class InstanceRecord:
+    """Everything known locally about a managed instance."""
+
+    name: str
+    instance_configuration: InstanceConfiguration
+    creation_time: str
+    server_ip: Optional[str] = None
+    # Path of the private key, relative to the instance folder
+    server_key: Optional[str] = None
+    instance_id: Optional[str] = None
+    # The name the terraform resources (key pair, security groups...) were created with,
+    # if it isn't the instance name (e.g. an instance claimed from the warm pool)
+    base_name: Optional[str] = None
+
+    @property
+    def resource_name(self) -> str:
+        """Return the name the instance's terraform resources are named after."""
+        return self.base_name or self.name
+
+    @property
+    def instance_path(self) -> str:
+        """Return the terraform folder of the instance."""
+        return os.path.join(terraform_folders_path(), f"ec2-{self.name}")
+
+    @property
+    def username(self) -> str:
+        """Return the user to log into the instance as."""
+        return distro_username(self.instance_configuration.distro)
+
+    @property
+    def key_path(self) -> Optional[str]:
+        """Return the absolute path of the instance's private key, if it has one."""
+        if not self.server_key:
+            return None
+        return os.path.normpath(os.path.join(self.instance_path, self.server_key))
+
+    def to_json(self) -> dict:
+        """Return the record as a JSON-serializable dict."""
+        return {
+            "name": self.name,
+            "region": self.instance_configuration.region,
+            "ami": self.instance_configuration.ami,
+            "instance_type": self.instance_configuration.instance_type,
+            "distro": self.instance_configuration.distro.name,
+            "creation_time": self.creation_time,
+            "server_ip": self.server_ip,
+            "server_key": self.server_key,
+            "instance_id": self.instance_id,
+            "base_name": self.base_name,
+        }
+
+    @staticmethod
+    def from_json(record: dict) -> "InstanceRecord":
+        """Return the record stored as the given dict."""
+        return InstanceRecord(
+            name=record["name"],
+            instance_configuration=InstanceConfiguration(
+                region=record["region"],
+                ami=record["ami"],
+                instance_type=record["instance_type"],
+                distro=LinuxDistro[record["distro"]],
+            ),
+            creation_time=record["creation_time"],
+            server_ip=record.get("server_ip"),
+            server_key=record.get("server_key"),
+            instance_id=record.get("instance_id"),
+            base_name=record.get("base_name"),
+        )
+
+
+def read_base_name(instance_path: str) -> Optional[str]:
+    """Return the base_name local of the instance folder's main.tf, if it has one."""
+    try:
+        with open(
+            os.path.join(instance_path, "main.tf"), encoding="utf-8"
+        ) as main_file:
+            match = _BASE_NAME_PATTERN.search(main_file.read())
+    except FileNotFoundError:
+        return None
+    return match.group(1) if match else None
+
+
+def _read_legacy_file(config_dir: str, file_name: str) -> Optional[str]:
+    try:
+        with open(os.path.join(config_dir, file_name), encoding="utf-8") as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def _read_legacy_config_dir(name: str, config_dir: str) -> InstanceRecord:
+    """Return the record stored in the per-field files of an old-style config/ folder."""
+    fields = {}
+    for field, file_name in [
+        ("distro", "distro"),
+        ("region", "region"),
+        ("ami", "ami-id"),
+        ("instance_type", "instance-type"),
+        ("creation_time", "creation_time"),
+    ]:
+        fields[field] = _read_legacy_file(config_dir, file_name)
+        if fields[field] is None:
+            raise FileNotFoundError(
+                f"Missing file {file_name} in {config_dir}",
+                os.path.join(config_dir, file_name),
+            )
+
+    if fields["distro"] not in LinuxDistro.__members__:
+        raise ValueError(f'Unexpected distro {fields["distro"]} in {config_dir}')
+
+    # Old folders didn't always record the outputs, but the terraform state has them
+    state = read_state(os.path.dirname(config_dir))
+    outputs = state.instance_outputs() if state else InstanceOutputs()
+
+    return InstanceRecord(
+        name=name,
+        instance_configuration=InstanceConfiguration(
+            region=fields["region"],
+            ami=fields["ami"],
+            instance_type=fields["instance_type"],
+            distro=LinuxDistro[fields["distro"]],
+        ),
+        creation_time=fields["creation_time"],
+        server_ip=_read_legacy_file(config_dir, "server_ip.txt") or outputs.server_ip,
+        server_key=_read_legacy_file(config_dir, "server_key.txt")
+        or outputs.server_key,
+        instance_id=_read_legacy_file(config_dir, "instance-id") or outputs.instance_id,
+    )
+
+
+class InstanceRegistry:
+    """The registry of managed instances, indexed by name and by region.
+
+    Reads cost a single file read. Changes go through update(), which holds an exclusive
+    lock and rewrites the file atomically. Instance folders that predate the registry
+    (with per-field files under config/) are migrated automatically.
+    """
+
+    def __init__(self, records: Dict[str, InstanceRecord]):
+        self._records = records
+        self._by_region: Dict[str, List[InstanceRecord]] = {}
+        for record in records.values():
+            self._by_region.setdefault(record.instance_configuration.region, []).append(
+                record
+            )
+
+    @staticmethod
+    def path() -> str:
+        """Return the path of the registry file."""
+        return os.path.join(terraform_folders_path(), "registry.json")
+
+    @classmethod
+    def _read(cls) -> Optional["InstanceRegistry"]:
+        try:
+            with open(cls.path(), encoding="utf-8") as registry_file:
+                contents = json.load(registry_file)
+        except FileNotFoundError:
+            return None
+
+        if contents.get("version") != _REGISTRY_VERSION:
+            raise ValueError(
+                f'Unsupported registry version {contents.get("version")} in {cls.path()}'
+            )
+
+        return cls(
+            {
+                name: InstanceRecord.from_json(record)
+                for name, record in contents["instances"].items()
+            }
+        )
+
+    def _write(self):
+        write_atomically(
+            self.path(),
+            json.dumps(
+                {
+                    "version": _REGISTRY_VERSION,
+                    "instances": {
+                        name: record.to_json()
+                        for name, record in sorted(self._records.items())
+                    },
+                },
+                indent=2,
+            ),
+        )
+
+    @staticmethod
+    def _legacy_config_dir(name: str) -> Optional[str]:
+        config_dir = os.path.join(terraform_folders_path(), f"ec2-{name}", "config")
+        if os.path.isdir(config_dir):
+            return config_dir
+        return None
+
+    def _migrate_all(self):
+        base = terraform_folders_path()
+        for instance_dir in sorted(os.listdir(base)):
+            name = instance_dir.removeprefix("ec2-")
+            if (
+                instance_dir == name
+                or name in self._records
+                or not self._legacy_config_dir(name)
+            ):
+                continue
+            try:
+                self._add(_read_legacy_config_dir(name, self._legacy_config_dir(name)))
+            except (FileNotFoundError, ValueError) as e:
+                # On stderr: `ec2 list -n` output is parsed by the shell completions
+                sys.stderr.write(f"Not migrating {instance_dir}: {e.args[0]}\n")
+
+    def _add(self, record: InstanceRecord):
+        self.remove(record.name)
+        self._records[record.name] = record
+        self._by_region.setdefault(record.instance_configuration.region, []).append(
+            record
+        )
+
+    @classmethod
+    def load(cls) -> "InstanceRegistry":
+        """Return the current registry, creating (and migrating into) it if needed."""
+        registry = cls._read()
+        if registry is not None:
+            return registry
+
+        with cls.update() as registry:
+            return registry
+
+    @classmethod
+    @contextlib.contextmanager
+    def update(cls) -> Iterator["InstanceRegistry"]:
+        """Yield the registry for modification and atomically save it afterwards."""
+        with open(cls.path() + ".lock", "w", encoding="utf-8") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                registry = cls._read()
+                if registry is None:
+                    registry = cls({})
+                    registry._migrate_all()
+
+                yield registry
+
+                registry._write()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def find(self, name: str) -> Optional[InstanceRecord]:
+        """Return the record of the given instance, or None if it isn't managed."""
+        return self._records.get(name)
+
+    def get(self, name: str) -> InstanceRecord:
+        """Return the record of the given instance, migrating an old-style folder if needed."""
+        record = self._records.get(name)
+        if record is not None:
+            return record
+
+        config_dir = self._legacy_config_dir(name)
+        if config_dir is None:
+            instance_path = os.path.join(terraform_folders_path(), f"ec2-{name}")
+            if not os.path.exists(instance_path):
+                raise ValueError(f'Folder "{instance_path}" does not exist')
+            raise ValueError(f'Instance "{name}" is not in the registry {self.path()}')
+
+        with self.update() as registry:
+            registry._add(_read_legacy_config_dir(name, config_dir))
+        self._add(registry.get(name))
+        return self._records[name]
+
+    def all(self) -> List[InstanceRecord]:
+        """Return the records of all managed instances, sorted by name."""
+        return [self._records[name] for name in sorted(self._records)]
+
+    def by_region(self, region: str) -> List[InstanceRecord]:
+        """Return the records of the managed instances in the given region."""
+        return list(self._by_region.get(region, []))
+
+    def regions(self) -> List[str]:
+        """Return the regions that have managed instances."""
+        return sorted(self._by_region)
+
+    def put(self, record: InstanceRecord):
+        """Add or replace the record of an instance (use within update())."""
+        self._add(record)
+
+    def remove(self, name: str):
+        """Remove the record of an instance, if it exists (use within update())."""
+        record = self._records.pop(name, None)
+        if record is not None:
+            self._by_region[record.instance_configuration.region].remove(record)
+            if not self._by_region[record.instance_configuration.region]:
+                del self._by_region[record.instance_configuration.region]
+
+
+def backfill_from_state(records: List[InstanceRecord]) -> List[InstanceRecord]:
+    """Return the records with a missing IP, key or instance ID filled in from their state.
+
+    Only incomplete records cost a state read (one parse per folder, no terraform process
+    for local state). Completed records are saved to the registry.
+    """
+    incomplete = [
+        record
+        for record in records
+        if not record.server_ip or not record.server_key or not record.instance_id
+    ]
+    if not incomplete:
+        return records
+
+    outputs = read_instance_outputs(record.instance_path for record in incomplete)
+    completed = {}
+    for record in incomplete:
+        if record.instance_path not in outputs:
+            continue
+        instance_outputs = outputs[record.instance_path]
+        backfilled = dataclasses.replace(
+            record,
+            server_ip=record.server_ip or instance_outputs.server_ip,
+            server_key=record.server_key or instance_outputs.server_key,
+            instance_id=record.instance_id or instance_outputs.instance_id,
+        )
+        if backfilled != record:
+            completed[record.name] = backfilled
+
+    if completed:
+        with InstanceRegistry.update() as registry:
+            for record in completed.values():
+                if registry.find(record.name) is not None:
+                    registry.put(record)
+
+    return [completed.get(record.name, record) for record in records]
@@ -0,0 +1,189 @@
+"""Query the live EC2 state of managed instances, one batched call per region."""
+import dataclasses
+import datetime
+import sys
+from typing import Dict, Iterator, List, Optional
+
+from terraform_manager.instance_registry import InstanceRecord
+from terraform_manager.region_fanout import (
+    DEFAULT_MAX_WORKERS,
+    DEFAULT_REGION_TIMEOUT_SECONDS,
+    aws_client_config,
+    fan_out_regions,
+)
+
+# Used when a region couldn't be queried
+UNKNOWN_STATE = "unknown"
+# Used when EC2 has no instance for a record (e.g. it was deleted outside of ec2)
+MISSING_STATE = "not found"
+
+# EC2 accepts at most this many values per filter
+_MAX_FILTER_VALUES = 200
+
+
+@dataclasses.dataclass
+class InstanceStatus:
+    """The live state of a managed instance."""
+
+    name: str
+    state: str
+    instance_id: Optional[str] = None
+    public_ip: Optional[str] = None
+    launch_time: Optional[datetime.datetime] = None
+
+    @property
+    def uptime(self) -> Optional[datetime.timedelta]:
+        """Return how long the instance has been running, if it's running."""
+        if self.state != "running" or self.launch_time is None:
+            return None
+        return datetime.datetime.now(datetime.timezone.utc) - self.launch_time
+
+
+def instance_name_tag(name: str) -> str:
+    """Return the Name tag the instance template gives to the instance."""
+    return f"{name}-server"
+
+
+def _latest(instances: List[dict]) -> dict:
+    # A name can be reused after a destroy - prefer the live instance, then the newest
+    return max(
+        instances,
+        key=lambda instance: (
+            instance["State"]["Name"] != "terminated",
+            instance["LaunchTime"],
+        ),
+    )
+
+
+def _matching_instances(ec2_client, records: List[InstanceRecord]) -> Iterator[dict]:
+    # Instances are matched by ID, which holds whatever their Name tag is (imported ones
+    # keep theirs). Records migrated from old folders may lack an ID, so those fall back
+    # on the Name tag the template gives
+    filters = [
+        (
+            "instance-id",
+            sorted({record.instance_id for record in records if record.instance_id}),
+        ),
+        (
+            "tag:Name",
+            sorted(
+                {
+                    instance_name_tag(name)
+                    for record in records
+                    if not record.instance_id
+                    for name in (record.name, record.resource_name)
+                }
+            ),
+        ),
+    ]
+
+    paginator = ec2_client.get_paginator("describe_instances")
+    for filter_name, values in filters:
+        for start in range(0, len(values), _MAX_FILTER_VALUES):
+            pages = paginator.paginate(
+                Filters=[
+                    {
+                        "Name": filter_name,
+                        "Values": values[start : start + _MAX_FILTER_VALUES],
+                    }
+                ]
+            )
+            for page in pages:
+                for reservation in page["Reservations"]:
+                    yield from reservation["Instances"]
+
+
+def _describe_instances(
+    ec2_client, records: List[InstanceRecord]
+) -> Dict[str, InstanceStatus]:
+    by_id: Dict[str, dict] = {}
+    by_name_tag: Dict[str, List[dict]] = {}
+    for instance in _matching_instances(ec2_client, records):
+        by_id[instance["InstanceId"]] = instance
+        for tag in instance.get("Tags", []):
+            if tag["Key"] == "Name":
+                by_name_tag.setdefault(tag["Value"], []).append(instance)
+
+    statuses = {}
+    for record in records:
+        instance = by_id.get(record.instance_id)
+        # A claimed pool member is retagged with its new name, but its terraform folder
+        # still tags it with the member's name
+        for name in (record.name, record.resource_name):
+            name_tag = instance_name_tag(name)
+            if (
+                not record.instance_id
+                and instance is None
+                and by_name_tag.get(name_tag)
+            ):
+                instance = _latest(by_name_tag[name_tag])
+
+        if instance is None:
+            statuses[record.name] = InstanceStatus(
+                name=record.name, state=MISSING_STATE, instance_id=record.instance_id
+            )
+            continue
+
+        statuses[record.name] = InstanceStatus(
+            name=record.name,
+            state=instance["State"]["Name"],
+            instance_id=instance["InstanceId"],
+            public_ip=instance.get("PublicIpAddress"),
+            launch_time=instance.get("LaunchTime"),
+        )
+
+    return statuses
+
+
+def _describe_region(
+    region: str, records: List[InstanceRecord], region_timeout: float
+) -> Dict[str, InstanceStatus]:
+    import boto3  # pylint: disable=import-outside-toplevel
+
+    # Sessions aren't thread-safe, so every region gets its own
+    ec2_client = boto3.session.Session().client(
+        "ec2", region_name=region, config=aws_client_config(region_timeout)
+    )
+    return _describe_instances(ec2_client, records)
+
+
+def describe_managed_instances(
+    records: List[InstanceRecord],
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    region_timeout: float = DEFAULT_REGION_TIMEOUT_SECONDS,
+) -> Dict[str, InstanceStatus]:
+    """Return the live status of the given instances, keyed by name.
+
+    The instances are grouped by region and every region is queried concurrently with a
+    few paginated describe_instances calls. Instances of regions that failed or timed
+    out are reported in the UNKNOWN_STATE.
+    """
+    records_by_region: Dict[str, List[InstanceRecord]] = {}
+    for record in records:
+        records_by_region.setdefault(record.instance_configuration.region, []).append(
+            record
+        )
+
+    statuses = {}
+    for result in fan_out_regions(
+        records_by_region,
+        lambda region: _describe_region(
+            region, records_by_region[region], region_timeout
+        ),
+        max_workers=max_workers,
+        region_timeout=region_timeout,
+    ):
+        if result.ok:
+            statuses.update(result.value)
+            continue
+
+        sys.stderr.write(f"Could not query region {result.region}: {result.error}\n")
+        for record in records_by_region[result.region]:
+            statuses[record.name] = InstanceStatus(
+                name=record.name,
+                state=UNKNOWN_STATE,
+                instance_id=record.instance_id,
+                public_ip=record.server_ip,
+            )
+
+    return statuses
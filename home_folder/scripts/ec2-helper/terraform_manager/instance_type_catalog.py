@@ -0,0 +1,212 @@
+"""A compact, sorted index of a region's instance types, queried by resource needs.
+
+Prices are optional and come from a local file, instance-prices.json in the ec2-helper
+config folder, mapping regions to instance types to on-demand USD per hour:
+
+    {"us-east-1": {"t3.micro": 0.0104, "m7g.large": 0.0816}}
+"""
+import bisect
+import dataclasses
+import json
+import os
+from typing import Dict, Iterator, List, Optional
+
+# The only architectures the AMI catalog has images for
+SUPPORTED_ARCHITECTURES = ("x86_64", "arm64")
+
+# Instance type families offered by the picker and the automatic selection
+_INSTANCE_FAMILIES = ("c", "m", "t")
+
+
+@dataclasses.dataclass
+class InstanceTypeInfo:
+    """The resources of an instance type."""
+
+    name: str
+    vcpus: int
+    memory_mib: int
+    architecture: str
+    network_performance: str = ""
+    network_bandwidth_gbps: Optional[float] = None
+    ebs_bandwidth_mbps: Optional[int] = None
+
+    @property
+    def memory_gib(self) -> float:
+        """Return the memory in GiB."""
+        return self.memory_mib / 1024
+
+    @staticmethod
+    def from_description(description: dict) -> Optional["InstanceTypeInfo"]:
+        """Return the info of a describe_instance_types entry, or None if unsupported."""
+        architectures = [
+            architecture
+            for architecture in description["ProcessorInfo"]["SupportedArchitectures"]
+            if architecture in SUPPORTED_ARCHITECTURES
+        ]
+        if not architectures:
+            return None
+
+        network_info = description.get("NetworkInfo", {})
+        network_cards = network_info.get("NetworkCards") or [{}]
+        return InstanceTypeInfo(
+            name=description["InstanceType"],
+            vcpus=description["VCpuInfo"]["DefaultVCpus"],
+            memory_mib=description["MemoryInfo"]["SizeInMiB"],
+            architecture=architectures[0],
+            network_performance=network_info.get("NetworkPerformance", ""),
+            network_bandwidth_gbps=network_cards[0].get("BaselineBandwidthInGbps"),
+            ebs_bandwidth_mbps=description.get("EbsInfo", {})
+            .get("EbsOptimizedInfo", {})
+            .get("BaselineBandwidthInMbps"),
+        )
+
+
+@dataclasses.dataclass
+class InstanceTypeRequirements:
+    """Constraints an automatically selected instance type must satisfy."""
+
+    min_vcpus: int = 0
+    min_memory_gib: float = 0.0
+    architecture: Optional[str] = None
+    max_price: Optional[float] = None
+
+    @property
+    def unconstrained(self) -> bool:
+        """Return whether no constraint is set."""
+        return self == InstanceTypeRequirements()
+
+
+def _describe_instance_types(ec2_client) -> List[dict]:
+    paginator = ec2_client.get_paginator("describe_instance_types")
+
+    instance_types = []
+    for page in paginator.paginate():
+        for description in page["InstanceTypes"]:
+            if not description["InstanceType"].startswith(_INSTANCE_FAMILIES):
+                continue
+            info = InstanceTypeInfo.from_description(description)
+            if info is not None:
+                instance_types.append(dataclasses.asdict(info))
+
+    # Stored sorted, so that loading the index never sorts
+    return sorted(
+        instance_types, key=lambda x: (x["vcpus"], x["memory_mib"], x["name"])
+    )
+
+
+def prices_path() -> str:
+    """Return the path of the local instance price file."""
+    config_home = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config")
+    return os.path.join(config_home, "ec2-helper", "instance-prices.json")
+
+
+def _load_prices(region: str) -> Dict[str, float]:
+    try:
+        with open(prices_path(), encoding="utf-8") as prices_file:
+            return json.load(prices_file).get(region, {})
+    except FileNotFoundError:
+        return {}
+
+
+class InstanceTypeIndex:
+    """The instance types of a region, sorted by vCPUs, then memory.
+
+    Lookups by name are dict lookups, and a query bisects to the first type with enough
+    vCPUs instead of scanning the whole catalog.
+    """
+
+    def __init__(
+        self, instance_types: List[InstanceTypeInfo], prices: Dict[str, float]
+    ):
+        self._instance_types = instance_types
+        self._vcpus = [instance_type.vcpus for instance_type in instance_types]
+        self._by_name = {
+            instance_type.name: instance_type for instance_type in instance_types
+        }
+        self._prices = prices
+
+    @staticmethod
+    def load(ec2_client, cache, region: str) -> "InstanceTypeIndex":
+        """Return the index of the given region, built once and kept in the cache."""
+        entries = cache.get(
+            f"instance-type-index-{region}",
+            lambda: _describe_instance_types(ec2_client),
+        )
+        return InstanceTypeIndex(
+            [InstanceTypeInfo(**entry) for entry in entries], _load_prices(region)
+        )
+
+    def __iter__(self) -> Iterator[InstanceTypeInfo]:
+        return iter(self._instance_types)
+
+    def get(self, name: str) -> Optional[InstanceTypeInfo]:
+        """Return the info of the given instance type, if it's in the index."""
+        return self._by_name.get(name)
+
+    def price(self, name: str) -> Optional[float]:
+        """Return the hourly price of the given instance type, if it's known."""
+        return self._prices.get(name)
+
+    def _satisfies(
+        self, instance_type: InstanceTypeInfo, requirements: InstanceTypeRequirements
+    ) -> bool:
+        if instance_type.memory_gib < requirements.min_memory_gib:
+            return False
+        if (
+            requirements.architecture
+            and instance_type.architecture != requirements.architecture
+        ):
+            return False
+        if requirements.max_price is not None:
+            price = self.price(instance_type.name)
+            return price is not None and price <= requirements.max_price
+        return True
+
+    def best_match(
+        self, requirements: InstanceTypeRequirements
+    ) -> Optional[InstanceTypeInfo]:
+        """Return the smallest instance type satisfying the requirements, if any.
+
+        Among types with the same vCPUs and memory, the cheapest known one wins.
+        """
+        if requirements.max_price is not None and not self._prices:
+            raise ValueError(
+                f'--max-price needs instance prices, but "{prices_path()}" has none '
+                "for this region."
+            )
+
+        start = bisect.bisect_left(self._vcpus, requirements.min_vcpus)
+        candidates: List[InstanceTypeInfo] = []
+        for instance_type in self._instance_types[start:]:
+            if candidates and (instance_type.vcpus, instance_type.memory_mib) != (
+                candidates[0].vcpus,
+                candidates[0].memory_mib,
+            ):
+                break
+            if self._satisfies(instance_type, requirements):
+                candidates.append(instance_type)
+
+        if not candidates:
+            return None
+        return min(
+            candidates,
+            key=lambda x: (
+                self.price(x.name) if self.price(x.name) is not None else float("inf"),
+                x.name,
+            ),
+        )
+
+    def describe(self, instance_type: InstanceTypeInfo) -> str:
+        """Return a one-line description of the given instance type."""
+        description = (
+            f"{instance_type.name} - {instance_type.vcpus} vCPUs, "
+            f"{instance_type.memory_gib:g} GiB RAM, {instance_type.architecture}"
+        )
+        if instance_type.network_performance:
+            description += f", {instance_type.network_performance} network"
+        if instance_type.ebs_bandwidth_mbps:
+            description += f", {instance_type.ebs_bandwidth_mbps} Mbps EBS"
+        price = self.price(instance_type.name)
+        if price is not None:
+            description += f", ${price:.4f}/h"
+        return description
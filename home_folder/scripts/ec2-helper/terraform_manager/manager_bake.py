@@ -0,0 +1,154 @@
+"""Bake a provisioned instance into a versioned image that new instances boot from."""
+import os
+import subprocess  # nosec (remove bandit warning)
+import time
+
+from terraform_manager.catalog_cache import CatalogCache
+from terraform_manager.instance_configuration import (
+    BAKED_DISTRO_TAG,
+    BAKED_IMAGE_TAG,
+    BAKED_VERSION_TAG,
+    CpuArchitecture,
+    baked_amis_cache_key,
+)
+from terraform_manager.instance_readiness import (
+    DEFAULT_READY_TIMEOUT_SECONDS,
+    wait_until_ready,
+)
+from terraform_manager.instance_registry import InstanceRegistry, backfill_from_state
+from terraform_manager.manager_base import base_path
+from terraform_manager.manager_connect import instance_ssh_command
+
+DEFAULT_KEPT_VERSIONS = 3
+
+# Read by the user-data script: an image with this file only needs the delta step
+BAKED_MARKER_PATH = "/etc/ec2-helper-baked"
+
+# cloud-init runs per-instance scripts once on every new instance, so never on the source
+FIRST_BOOT_SCRIPT_PATH = "/var/lib/cloud/scripts/per-instance/ec2-helper-baked.sh"
+
+_IMAGE_AVAILABLE_TIMEOUT_SECONDS = 60 * 60
+
+
+def _mark_as_baked(ssh_command, version: str, source_instance_id: str):
+    # The source instance itself is left as is: it only gains the marker and a script
+    # that scrubs its keys and cloud-init state from instances booted from the image
+    with open(
+        os.path.join(base_path(), "ec2-bake-first-boot.sh"), encoding="utf-8"
+    ) as script_file:
+        first_boot_script = script_file.read().replace(
+            "$BAKED_INSTANCE_ID", source_instance_id
+        )
+    subprocess.run(  # nosec (remove bandit warning)
+        ssh_command
+        + [
+            f"echo {version} | sudo tee {BAKED_MARKER_PATH} > /dev/null "
+            f"&& sudo tee {FIRST_BOOT_SCRIPT_PATH} > /dev/null "
+            f"&& sudo chmod 755 {FIRST_BOOT_SCRIPT_PATH} && sync"
+        ],
+        input=first_boot_script.encode(),
+        check=True,
+    )
+
+
+def _prune_old_versions(ec2_client, distro_name: str, architecture: str, keep: int):
+    response = ec2_client.describe_images(
+        Owners=["self"],
+        Filters=[
+            {"Name": f"tag:{BAKED_IMAGE_TAG}", "Values": ["true"]},
+            {"Name": f"tag:{BAKED_DISTRO_TAG}", "Values": [distro_name]},
+            {"Name": "architecture", "Values": [architecture]},
+        ],
+    )
+    images = sorted(response["Images"], key=lambda x: x["CreationDate"], reverse=True)
+
+    for image in images[keep:]:
+        print(f'Deregistering old image {image["ImageId"]} ({image["Name"]})...')
+        ec2_client.deregister_image(ImageId=image["ImageId"])
+        # Deregistering keeps the snapshots (and their cost) around
+        for mapping in image.get("BlockDeviceMappings", []):
+            snapshot_id = mapping.get("Ebs", {}).get("SnapshotId")
+            if snapshot_id:
+                ec2_client.delete_snapshot(SnapshotId=snapshot_id)
+
+
+def bake_instance_image(
+    name: str,
+    keep: int = DEFAULT_KEPT_VERSIONS,
+    ready_timeout: float = DEFAULT_READY_TIMEOUT_SECONDS,
+) -> str:
+    """Snapshot the given instance into a new baked image and return its ID.
+
+    The instance is first waited on until its provisioning (cloud-init) is done. Images
+    are versioned per distro and architecture, and only the newest keep versions of
+    each are kept.
+    """
+    import boto3  # pylint: disable=import-outside-toplevel
+
+    # Pruning to zero versions would deregister the image just created
+    if keep < 1:
+        raise ValueError(f"At least one baked version must be kept, got {keep}.")
+
+    (record,) = backfill_from_state([InstanceRegistry.load().get(name)])
+    if not record.instance_id:
+        raise ValueError(f'Instance "{name}" has no known instance ID.')
+
+    region = record.instance_configuration.region
+    distro = record.instance_configuration.distro
+    ec2_client = boto3.client("ec2", region_name=region)
+
+    ssh_command = instance_ssh_command(record)
+    print(f'Waiting for the provisioning of "{name}" to finish...')
+    wait_until_ready(
+        region,
+        record.instance_id,
+        record.server_ip,
+        ssh_command,
+        wait_cloud_init=True,
+        timeout=ready_timeout,
+    )
+
+    architecture = ec2_client.describe_instances(InstanceIds=[record.instance_id])[
+        "Reservations"
+    ][0]["Instances"][0]["Architecture"]
+    version = time.strftime("%Y%m%d-%H%M%S")
+    image_name = f"ec2-helper-{distro.name.lower()}-{architecture}-{version}"
+
+    _mark_as_baked(ssh_command, version, record.instance_id)
+
+    print(f'Creating image "{image_name}" (the instance reboots once)...')
+    tags = [
+        {"Key": "Name", "Value": image_name},
+        {"Key": BAKED_IMAGE_TAG, "Value": "true"},
+        {"Key": BAKED_DISTRO_TAG, "Value": distro.name},
+        {"Key": BAKED_VERSION_TAG, "Value": version},
+    ]
+    image_id = ec2_client.create_image(
+        InstanceId=record.instance_id,
+        Name=image_name,
+        Description=f"{distro.value} ({architecture}) baked by ec2-helper from {name}",
+        TagSpecifications=[
+            {"ResourceType": "image", "Tags": tags},
+            {"ResourceType": "snapshot", "Tags": tags},
+        ],
+    )["ImageId"]
+
+    ec2_client.get_waiter("image_available").wait(
+        ImageIds=[image_id],
+        WaiterConfig={
+            "Delay": 15,
+            "MaxAttempts": _IMAGE_AVAILABLE_TIMEOUT_SECONDS // 15,
+        },
+    )
+    print(f"Image {image_id} is available.")
+
+    _prune_old_versions(ec2_client, distro.name, architecture, keep)
+
+    # New instances pick the image up right away instead of after the cache TTL
+    CatalogCache().invalidate(
+        baked_amis_cache_key(
+            region, CpuArchitecture.from_aws_architecture(architecture)
+        )
+    )
+
+    return image_id
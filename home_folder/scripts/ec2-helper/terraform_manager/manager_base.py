@@ -1,5 +1,6 @@
 """Base functions for the terraform manager."""
 import os
+import tempfile
 
 
 def base_path():
@@ -35,3 +36,26 @@ def manager_path():
         raise ValueError(f'"{manager_dir}" does not exist.')
 
     return manager_dir
+
+
+def cache_path(*subfolders: str):
+    """Return the path to the ec2 script's cache folder, creating it if it doesn't exist."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    cache_dir = os.path.join(cache_home, "ec2-helper", *subfolders)
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    return cache_dir
+
+
+def write_atomically(path: str, contents: str):
+    """Write contents to path so that readers never observe a partially written file."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as tmp_file:
+            tmp_file.write(contents)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -1,56 +1,49 @@
 """Connect to an instance."""
-import os
 import subprocess  # nosec (remove bandit warning)
+from typing import List
+
+from terraform_manager.instance_registry import (
+    InstanceRecord,
+    InstanceRegistry,
+    backfill_from_state,
+)
+from terraform_manager.ssh_config import ssh_host_alias, sync_ssh_config
+
+
+def require_server_ip(record: InstanceRecord) -> str:
+    """Return the public IP of the given instance, raising if it has none."""
+    # Without one, the instance has no ssh_config entry either
+    if not record.server_ip:
+        raise ValueError(
+            f'Instance "{record.name}" has no known public IP '
+            "(if it was just started, refresh it with `ec2 list --live`)."
+        )
+    return record.server_ip
 
-from terraform_manager.instance_configuration import LinuxDistro
-from terraform_manager.manager_base import terraform_folders_path
-
-
-def connect_instance_configuration_folder(name: str, print_command: bool):
-    """Connect to the given instance."""
-    instance_path = os.path.join(terraform_folders_path(), f"ec2-{name}")
-
-    if not os.path.exists(instance_path):
-        raise ValueError(f'Folder "{instance_path}" does not exist')
 
-    config_dir = os.path.join(instance_path, "config")
+def instance_ssh_command(record: InstanceRecord) -> List[str]:
+    """Return the ssh invocation (without a remote command) for the given instance."""
+    server_ip = require_server_ip(record)
 
-    # Assert that the config dir exists
-    if not os.path.exists(config_dir):
-        raise ValueError(f'Config folder "{config_dir}" does not exist.')
+    ssh_command = ["ssh"]
+    if record.key_path:
+        ssh_command += ["-i", record.key_path]
 
-    with open(
-        os.path.join(config_dir, "server_ip.txt"), encoding="utf-8"
-    ) as server_ip_file:
-        server_ip = server_ip_file.read().strip()
+    return ssh_command + [f"{record.username}@{server_ip}"]
 
-    with open(
-        os.path.join(config_dir, "server_key.txt"), encoding="utf-8"
-    ) as server_key_file:
-        server_key = server_key_file.read().strip()
 
-    # Retrieve username based on config/distro
-    with open(os.path.join(config_dir, "distro"), encoding="utf-8") as distro_file:
-        distro = distro_file.read().strip()
-        if distro == LinuxDistro.AMAZON_LINUX.name:
-            username = "ec2-user"
-        elif distro == LinuxDistro.UBUNTU.name:
-            username = "ubuntu"
-        else:
-            raise ValueError(f"Unexpected distro: {distro}")
+def connect_instance_configuration_folder(name: str, print_command: bool):
+    """Connect to the given instance."""
+    registry = InstanceRegistry.load()
+    (record,) = backfill_from_state([registry.get(name)])
 
+    ssh_command = instance_ssh_command(record)
     if print_command:
-        print(
-            f"ssh -i {os.path.join(instance_path, server_key)} {username}@{server_ip}"
-        )
+        print(" ".join(ssh_command))
         return
 
+    # Connect through the managed ssh_config entry, which reuses an open master connection
+    sync_ssh_config()
     subprocess.run(
-        [
-            "ssh",
-            "-i",
-            os.path.join(instance_path, server_key),
-            f"{username}@{server_ip}",
-        ],
-        check=True,
+        ["ssh", ssh_host_alias(record.name)], check=True
     )  # nosec (remove bandit warning)
@@ -4,104 +4,72 @@ import shutil
 import subprocess  # nosec (remove bandit warning)
 import sys
 import time
-from typing import Optional
+from typing import Callable, List, Optional
 
 from terraform_manager.instance_configuration import (
     InstanceConfiguration,
     instance_configuration,
 )
+from terraform_manager.instance_pool import claim_pool_instance
+from terraform_manager.instance_readiness import (
+    DEFAULT_READY_TIMEOUT_SECONDS,
+    wait_until_ready,
+)
+from terraform_manager.instance_registry import InstanceRecord, InstanceRegistry
+from terraform_manager.instance_type_catalog import InstanceTypeRequirements
 from terraform_manager.manager_base import base_path, terraform_folders_path
-from terraform_manager.manager_connect import connect_instance_configuration_folder
-
-
-def _create_config_folder(instance_path: str, instance_config: InstanceConfiguration):
-    # Create config folder if it doesn't exist
-    config_dir = os.path.join(instance_path, "config")
-    if not os.path.exists(config_dir):
-        os.makedirs(config_dir)
-
-    # Create "config/server_key.txt" based on terraform output
-    with open(
-        os.path.join(config_dir, "server_key.txt"), "w", encoding="utf-8"
-    ) as key_name_file:
-        with subprocess.Popen(
-            ["terraform", "output", "server_key"],  # nosec (remove bandit warning)
-            cwd=instance_path,
-            stdout=subprocess.PIPE,
-        ) as process:
-            stdout, stderr = process.communicate()
-            if process.returncode != 0:
-                sys.stderr.write(stderr.decode("utf-8"))
-                raise ValueError(f'terraform init failed in "{instance_path}".')
-
-        key_name = stdout.decode("utf-8").strip().strip('"')
-
-        subprocess.run(
-            ["chmod", "400", os.path.join(instance_path, key_name)],  # nosec (remove bandit warning)
-            check=True,
-        )
-
-        key_name_file.write(key_name)
+from terraform_manager.manager_connect import (
+    connect_instance_configuration_folder,
+    instance_ssh_command,
+)
+from terraform_manager.parallel_runner import (
+    DEFAULT_MAX_WORKERS,
+    print_summary,
+    run_parallel,
+)
+from terraform_manager.ssh_config import sync_ssh_config
+from terraform_manager.terraform_runner import run_terraform, terraform_init
+from terraform_manager.terraform_state import read_state
+
+
+def _register_instance(
+    name: str, instance_path: str, instance_config: InstanceConfiguration
+) -> InstanceRecord:
+    state = read_state(instance_path)
+    if state is None:
+        raise ValueError(f'No terraform state in "{instance_path}" after apply.')
+    outputs = state.instance_outputs()
+
+    key_path = os.path.join(instance_path, outputs.server_key)
+    subprocess.run(  # nosec (remove bandit warning)
+        ["chmod", "400", key_path], check=True
+    )
 
-    # Create "config/server_ip.txt" based on terraform output
-    with open(
-        os.path.join(config_dir, "server_ip.txt"), "w", encoding="utf-8"
-    ) as ip_file:
-        with subprocess.Popen(
-            ["terraform", "output", "server_ip"],  # nosec (remove bandit warning)
-            cwd=instance_path,
-            stdout=subprocess.PIPE,
-        ) as process:
-            stdout, stderr = process.communicate()
-            if process.returncode != 0:
-                sys.stderr.write(stderr.decode("utf-8"))
-                raise ValueError(f'terraform output failed in "{instance_path}".')
-        ip_file.write(stdout.decode("utf-8").strip().strip('"'))
-
-    # Create config/distro based on instance_config
-    with open(os.path.join(config_dir, "distro"), "w", encoding="utf-8") as distro_file:
-        distro_file.write(instance_config.distro.name)
-
-    # Create config/instance_type based on instance_config
-    with open(
-        os.path.join(config_dir, "instance-type"), "w", encoding="utf-8"
-    ) as instance_type_file:
-        instance_type_file.write(instance_config.instance_type)
+    record = InstanceRecord(
+        name=name,
+        instance_configuration=instance_config,
+        creation_time=time.strftime("%Y-%m-%d %H:%M:%S"),
+        server_ip=outputs.server_ip,
+        server_key=outputs.server_key,
+        instance_id=outputs.instance_id,
+    )
 
-    # Create config/region based on instance_config
-    with open(
-        os.path.join(config_dir, "region"), "w", encoding="utf-8"
-    ) as instance_type_file:
-        instance_type_file.write(instance_config.region)
+    with InstanceRegistry.update() as registry:
+        registry.put(record)
 
-    # Create config/ami-id based on instance_config
-    with open(
-        os.path.join(config_dir, "ami-id"), "w", encoding="utf-8"
-    ) as instance_type_file:
-        instance_type_file.write(instance_config.ami)
+    return record
 
-    # Create config/creation_time based on the current date
-    with open(
-        os.path.join(config_dir, "creation_time"), "w", encoding="utf-8"
-    ) as date_file:
-        date_file.write(time.strftime("%Y-%m-%d %H:%M:%S"))
 
-
-def create_instance_configuration_folder(
+def render_instance_folder(
     name: str,
     aws_account_id: str,
-    region: Optional[str] = None,
-    distro: Optional[str] = None,
-    instance_type: Optional[str] = None,
-):
-    """Create a folder for the given instance configuration."""
-    instance_path = os.path.join(terraform_folders_path(), f"ec2-{name}")
-
-    if os.path.exists(instance_path):
-        raise ValueError(f"Folder '{instance_path}' already exists.")
-
-    instance_config = instance_configuration(region, distro, instance_type)
-
+    instance_config: InstanceConfiguration,
+    instance_path: Optional[str] = None,
+) -> str:
+    """Render the instance template into a new folder (ec2-<name> by default)."""
+    instance_path = instance_path or os.path.join(
+        terraform_folders_path(), f"ec2-{name}"
+    )
     os.makedirs(instance_path)
 
     with open(
@@ -125,33 +93,143 @@ def create_instance_configuration_folder(
         os.path.join(base_path(), "ec2-terraform-template-user-data.sh"), instance_path
     )
 
-    # Run terraform init and terraform apply in the instance folder
-    with subprocess.Popen(
-        ["terraform", "init"],  # nosec (remove bandit warning)
-        cwd=instance_path,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    ) as process:
-        _, stderr = process.communicate()
-        if process.returncode != 0:
-            sys.stderr.write(stderr.decode("utf-8"))
-            raise ValueError(f'terraform init failed in "{instance_path}".')
-
-    with subprocess.Popen(
-        ["terraform", "apply", "-auto-approve"],  # nosec (remove bandit warning)
-        cwd=instance_path,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    ) as process:
-        _, stderr = process.communicate()
-        if process.returncode != 0:
-            sys.stderr.write(stderr.decode("utf-8"))
-            raise ValueError(f'terraform apply failed in "{instance_path}".')
-
-    _create_config_folder(instance_path, instance_config)
-
-    sleep_time = 30
-    print(f"Sleeping for {sleep_time} seconds to allow the instance to start...")
-    time.sleep(sleep_time)
+    return instance_path
+
+
+def _check_instance_folders_available(names: List[str]):
+    for name in names:
+        instance_path = os.path.join(terraform_folders_path(), f"ec2-{name}")
+        if os.path.exists(instance_path):
+            raise ValueError(f"Folder '{instance_path}' already exists.")
+
+
+def create_instance_configuration_folder(
+    name: str,
+    aws_account_id: str,
+    region: Optional[str] = None,
+    distro: Optional[str] = None,
+    instance_type: Optional[str] = None,
+    refresh_catalog: bool = False,
+    wait_status_ok: bool = False,
+    wait_cloud_init: bool = False,
+    ready_timeout: float = DEFAULT_READY_TIMEOUT_SECONDS,
+    offline: bool = False,
+    prefer_baked: bool = True,
+    use_pool: bool = True,
+    requirements: Optional[InstanceTypeRequirements] = None,
+):
+    """Create a folder for the given instance configuration and connect once it's up.
+
+    With use_pool, a matching stopped instance from the warm pool is claimed and started
+    instead, if there is one, and the pool is replenished in the background.
+    """
+    _check_instance_folders_available([name])
+
+    instance_config = instance_configuration(
+        region, distro, instance_type, refresh_catalog, prefer_baked, requirements
+    )
+
+    record = claim_pool_instance(name, instance_config) if use_pool else None
+    if record is not None:
+        # Imported here to keep manager_pool (which builds on this module) acyclic
+        from terraform_manager.manager_pool import (  # pylint: disable=import-outside-toplevel
+            spawn_replenisher,
+        )
+
+        spawn_replenisher()
+    else:
+        instance_path = render_instance_folder(name, aws_account_id, instance_config)
+
+        # Run terraform init and terraform apply in the instance folder
+        terraform_init(instance_path, offline)
+        run_terraform(instance_path, "apply", "-auto-approve")
+
+        record = _register_instance(name, instance_path, instance_config)
+    sync_ssh_config()
+
+    print("Waiting for the instance to become ready...")
+    wait_until_ready(
+        instance_config.region,
+        record.instance_id,
+        record.server_ip,
+        instance_ssh_command(record),
+        wait_status_ok=wait_status_ok,
+        wait_cloud_init=wait_cloud_init,
+        timeout=ready_timeout,
+    )
 
     connect_instance_configuration_folder(name, False)
+
+
+def rollback_instance_folder(name: str, instance_path: str):
+    """Destroy whatever a failed create left behind in instance_path."""
+    # Only instances whose apply got far enough to write state have resources to destroy
+    if os.path.exists(os.path.join(instance_path, "terraform.tfstate")):
+        run_terraform(instance_path, "destroy", "-auto-approve")
+    shutil.rmtree(instance_path)
+
+    with InstanceRegistry.update() as registry:
+        registry.remove(name)
+
+
+def create_instance_fleet(
+    name: str,
+    count: int,
+    aws_account_id: str,
+    region: Optional[str] = None,
+    distro: Optional[str] = None,
+    instance_type: Optional[str] = None,
+    refresh_catalog: bool = False,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    offline: bool = False,
+    prefer_baked: bool = True,
+    requirements: Optional[InstanceTypeRequirements] = None,
+):
+    """Create instances <name>-1 ... <name>-<count> sharing a single configuration.
+
+    The interactive configuration happens once, and the terraform runs happen
+    concurrently. Instances that fail to come up are destroyed; the others are kept.
+    """
+    if count < 1:
+        raise ValueError(f"Instance count must be positive, got {count}.")
+
+    names = [f"{name}-{i}" for i in range(1, count + 1)]
+    _check_instance_folders_available(names)
+
+    instance_config = instance_configuration(
+        region, distro, instance_type, refresh_catalog, prefer_baked, requirements
+    )
+
+    instance_paths = {
+        instance_name: render_instance_folder(
+            instance_name, aws_account_id, instance_config
+        )
+        for instance_name in names
+    }
+
+    def create_instance(instance_name: str, report: Callable[[str], None]):
+        instance_path = instance_paths[instance_name]
+        try:
+            report("terraform init")
+            terraform_init(instance_path, offline)
+            report("terraform apply")
+            run_terraform(instance_path, "apply", "-auto-approve")
+            report("registering")
+            _register_instance(instance_name, instance_path, instance_config)
+        except Exception as e:
+            report("rolling back")
+            try:
+                rollback_instance_folder(instance_name, instance_path)
+            except Exception as rollback_error:
+                raise ValueError(
+                    f"{e}\nRollback failed, clean up {instance_path} manually:\n"
+                    f"{rollback_error}"
+                ) from e
+            raise
+
+    results = run_parallel(names, create_instance, max_workers)
+    sync_ssh_config()
+    print_summary(results, "Create")
+
+    if any(not result.ok for result in results.values()):
+        sys.exit(1)
@@ -1,27 +1,95 @@
-"""Destroy an instance."""
+"""Destroy instances."""
+import fnmatch
 import os
 import shutil
-import subprocess  # nosec (remove bandit warning)
 import sys
+from typing import Callable, List, Optional
 
+from terraform_manager.instance_registry import InstanceRegistry
 from terraform_manager.manager_base import terraform_folders_path
+from terraform_manager.parallel_runner import (
+    DEFAULT_MAX_WORKERS,
+    print_summary,
+    run_parallel,
+)
+from terraform_manager.ssh_config import sync_ssh_config
+from terraform_manager.terraform_runner import run_terraform
 
 
-def destroy_instance_configuration_folder(name: str):
-    """Destroy the given instance."""
+def _managed_names() -> List[str]:
+    # Folders without a registry entry (e.g. half-created ones) can be destroyed too
+    names = {record.name for record in InstanceRegistry.load().all()}
+    for instance_dir in os.listdir(terraform_folders_path()):
+        if instance_dir.startswith("ec2-") and os.path.isdir(
+            os.path.join(terraform_folders_path(), instance_dir)
+        ):
+            names.add(instance_dir.removeprefix("ec2-"))
+    return sorted(names)
+
+
+def _resolve_targets(patterns: List[str], all_instances: bool) -> List[str]:
+    managed_names = _managed_names()
+    if all_instances:
+        return managed_names
+
+    targets = []
+    for pattern in patterns:
+        matches = fnmatch.filter(managed_names, pattern)
+        if not matches:
+            instance_path = os.path.join(terraform_folders_path(), f"ec2-{pattern}")
+            raise ValueError(f'Folder "{instance_path}" does not exist')
+        targets += [match for match in matches if match not in targets]
+    return targets
+
+
+def _destroy_instance(name: str, report: Callable[[str], None]) -> Optional[str]:
     instance_path = os.path.join(terraform_folders_path(), f"ec2-{name}")
 
-    if not os.path.exists(instance_path):
-        raise ValueError(f'Folder "{instance_path}" does not exist')
+    # Without its folder there is no state to destroy from: only the entry can go
+    if not os.path.isdir(instance_path):
+        with InstanceRegistry.update() as registry:
+            registry.remove(name)
+        return (
+            f'Folder "{instance_path}" does not exist, only removed the registry entry '
+            "(ec2 gc finds resources left behind)"
+        )
 
-    with subprocess.Popen(
-        ["terraform", "destroy", "-auto-approve"],  # nosec (remove bandit warning)
-        cwd=instance_path,
-        stdout=subprocess.PIPE,
-    ) as process:
-        _, stderr = process.communicate()
-        if process.returncode != 0:
-            sys.stderr.write(stderr.decode("utf-8"))
-            raise ValueError(f'terraform init failed in "{instance_path}".')
+    report("terraform destroy")
+    run_terraform(instance_path, "destroy", "-auto-approve")
 
+    # Only reached if the destroy succeeded - failed instances keep their folder
+    report("removing folder")
     shutil.rmtree(instance_path)
+
+    with InstanceRegistry.update() as registry:
+        registry.remove(name)
+    return None
+
+
+def destroy_instance_configuration_folders(
+    patterns: List[str],
+    all_instances: bool = False,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    assume_yes: bool = False,
+):
+    """Destroy the instances matching the given names or glob patterns, concurrently."""
+    targets = _resolve_targets(patterns, all_instances)
+    if not targets:
+        print("No instances found.")
+        return
+
+    if len(targets) > 1 and not assume_yes:
+        print("About to destroy: " + ", ".join(targets))
+        if input("Continue? [y/N] ").strip().lower() not in ("y", "yes"):
+            return
+
+    results = run_parallel(targets, _destroy_instance, max_workers)
+    # Drop the ssh_config entries of the destroyed instances
+    sync_ssh_config()
+    print_summary(results, "Destroy")
+    for result in results.values():
+        if result.ok and result.value:
+            print(f'\nNote for "{result.name}": {result.value}')
+
+    if any(not result.ok for result in results.values()):
+        sys.exit(1)
@@ -0,0 +1,239 @@
+"""Run a command on many instances concurrently, streaming their output."""
+import concurrent.futures
+import dataclasses
+import fnmatch
+import os
+import signal
+import subprocess  # nosec (remove bandit warning)
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from terraform_manager.instance_pool import distro_option
+from terraform_manager.instance_registry import (
+    InstanceRecord,
+    InstanceRegistry,
+    backfill_from_state,
+)
+from terraform_manager.ssh_config import ssh_host_alias, sync_ssh_config
+
+DEFAULT_MAX_WORKERS = 16
+DEFAULT_HOST_TIMEOUT_SECONDS = 300.0
+
+# Attributes that --filter KEY=PATTERN can match
+_FILTER_ATTRIBUTES = {
+    "name": lambda record: record.name,
+    "region": lambda record: record.instance_configuration.region,
+    "type": lambda record: record.instance_configuration.instance_type,
+    "distro": lambda record: distro_option(record.instance_configuration.distro),
+}
+
+_COLORS = ["31", "32", "33", "34", "35", "36"]
+
+
+@dataclasses.dataclass
+class HostResult:
+    """The outcome of the command on a single instance."""
+
+    name: str
+    exit_code: Optional[int] = None
+    timed_out: bool = False
+    error: Optional[str] = None
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        """Return whether the command succeeded on this instance."""
+        return self.exit_code == 0 and not self.timed_out
+
+
+def _parse_filters(filters: List[str]) -> Dict[str, str]:
+    parsed = {}
+    for instance_filter in filters:
+        key, separator, pattern = instance_filter.partition("=")
+        if not separator or key not in _FILTER_ATTRIBUTES:
+            raise ValueError(
+                f'Invalid filter "{instance_filter}", expected KEY=PATTERN with KEY one '
+                f"of {', '.join(_FILTER_ATTRIBUTES)}."
+            )
+        parsed[key] = pattern
+    return parsed
+
+
+def _resolve_targets(
+    patterns: List[str], all_instances: bool, filters: List[str]
+) -> List[InstanceRecord]:
+    parsed_filters = _parse_filters(filters)
+    records = InstanceRegistry.load().all()
+
+    if patterns:
+        targets = []
+        for pattern in patterns:
+            matches = [
+                record for record in records if fnmatch.fnmatch(record.name, pattern)
+            ]
+            if not matches:
+                raise ValueError(f'No instance matches "{pattern}".')
+            targets += [match for match in matches if match not in targets]
+    elif all_instances or parsed_filters:
+        targets = records
+    else:
+        raise ValueError("Specify instance names or patterns, --all or --filter.")
+
+    return [
+        record
+        for record in targets
+        if all(
+            fnmatch.fnmatch(_FILTER_ATTRIBUTES[key](record), pattern)
+            for key, pattern in parsed_filters.items()
+        )
+    ]
+
+
+class _OutputPrinter:
+    """Prints lines of every host prefixed with its name, never interleaving them."""
+
+    def __init__(self, names: List[str], stream=sys.stdout):
+        self._stream = stream
+        self._lock = threading.Lock()
+        width = max(len(name) for name in names)
+        colored = stream.isatty()
+        self._prefixes = {
+            name: (
+                f"\033[{_COLORS[i % len(_COLORS)]}m{name:<{width}}\033[0m | "
+                if colored
+                else f"{name:<{width}} | "
+            )
+            for i, name in enumerate(names)
+        }
+
+    def line(self, name: str, line: str):
+        """Print a line of output of the given host."""
+        with self._lock:
+            self._stream.write(self._prefixes[name] + line.rstrip("\n") + "\n")
+            self._stream.flush()
+
+
+def _kill(process: subprocess.Popen):
+    # The whole process group, so that nothing (e.g. a ProxyCommand) keeps the output open
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _run_on_host(
+    record: InstanceRecord,
+    command: str,
+    timeout: float,
+    printer: _OutputPrinter,
+    running: Dict[str, subprocess.Popen],
+) -> HostResult:
+    result = HostResult(name=record.name)
+    started = time.monotonic()
+
+    if not record.server_ip:
+        result.error = "no known public IP (refresh it with `ec2 list --live`)"
+        return result
+
+    # The managed ssh_config entry supplies the user and key, and its master connection
+    # makes repeated runs skip the ssh handshake
+    with subprocess.Popen(
+        [
+            "ssh",  # nosec (remove bandit warning)
+            "-o",
+            "BatchMode=yes",
+            "-o",
+            f"ConnectTimeout={max(1, int(min(timeout, 30)))}",
+            ssh_host_alias(record.name),
+            command,
+        ],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        start_new_session=True,
+    ) as process:
+        running[record.name] = process
+
+        def kill():
+            result.timed_out = True
+            _kill(process)
+
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+        try:
+            for line in process.stdout:
+                printer.line(record.name, line.decode("utf-8", errors="replace"))
+            result.exit_code = process.wait()
+        finally:
+            timer.cancel()
+            running.pop(record.name, None)
+
+    result.elapsed = time.monotonic() - started
+    return result
+
+
+def _print_summary(results: List[HostResult]):
+    failed = [result for result in results if not result.ok]
+
+    print(f"\nExec: {len(results) - len(failed)} succeeded, {len(failed)} failed.")
+    for result in results:
+        if result.error:
+            status = f"error: {result.error}"
+        elif result.timed_out:
+            status = "timed out"
+        else:
+            status = f"exit {result.exit_code}"
+        print(f"    {result.name}: {status} ({result.elapsed:.1f}s)")
+
+
+def exec_on_instances(
+    patterns: List[str],
+    command: List[str],
+    all_instances: bool = False,
+    filters: Optional[List[str]] = None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    timeout: float = DEFAULT_HOST_TIMEOUT_SECONDS,
+):
+    """Run command on the matching instances concurrently, prefixing output with names.
+
+    Instances are selected by names or glob patterns, or all of them, optionally narrowed
+    down by KEY=PATTERN filters. A host still running after timeout seconds is killed.
+    Exits with a non-zero status if the command failed on any host.
+    """
+    if not command:
+        raise ValueError("Specify the command to run after --.")
+
+    targets = _resolve_targets(patterns, all_instances, filters or [])
+    if not targets:
+        print("No instances found.")
+        return
+
+    targets = backfill_from_state(targets)
+    sync_ssh_config()
+
+    # Like ssh, the arguments are joined and run by the remote shell
+    remote_command = " ".join(command)
+    printer = _OutputPrinter([record.name for record in targets])
+    running: Dict[str, subprocess.Popen] = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                _run_on_host, record, remote_command, timeout, printer, running
+            )
+            for record in targets
+        ]
+        try:
+            results = [future.result() for future in futures]
+        except KeyboardInterrupt:
+            # The sessions run in their own process groups, out of reach of Ctrl-C
+            executor.shutdown(wait=False, cancel_futures=True)
+            for process in list(running.values()):
+                _kill(process)
+            raise
+
+    _print_summary(results)
+
+    if any(not result.ok for result in results):
+        sys.exit(1)
@@ -0,0 +1,261 @@
+"""Find and delete the AWS resources left behind by instances that no longer exist."""
+import concurrent.futures
+import dataclasses
+import os
+import sys
+from typing import Dict, List, Optional, Set
+
+from terraform_manager.catalog_cache import CatalogCache
+from terraform_manager.instance_configuration import available_regions
+from terraform_manager.instance_pool import WarmPool
+from terraform_manager.instance_registry import InstanceRegistry, read_base_name
+from terraform_manager.instance_status import instance_name_tag
+from terraform_manager.manager_base import terraform_folders_path
+from terraform_manager.region_fanout import (
+    DEFAULT_MAX_WORKERS,
+    DEFAULT_REGION_TIMEOUT_SECONDS,
+    aws_client_config,
+    fan_out_regions,
+)
+
+# Suffixes the instance template appends to the instance name, per resource type
+_KEY_PAIR_SUFFIX = "-server-key-pair"
+_SECURITY_GROUP_SUFFIXES = ("-allow-ssh", "-allow-all-outbound-traffic")
+_VOLUME_SUFFIX = "-server-volume"
+
+# Deletions retry throttling errors for longer than the region scans do
+_DELETE_MAX_ATTEMPTS = 10
+
+
+@dataclasses.dataclass
+class OrphanedResource:
+    """An AWS resource whose instance is neither managed nor alive."""
+
+    region: str
+    resource_type: str
+    resource_id: str
+    name: str
+
+
+def _managed_names() -> Set[str]:
+    # Every base name whose resources terraform still owns: registered instances, instance
+    # folders without a registry entry (e.g. half-created ones) and pool members. The
+    # resources are named after the folder's base_name, which a claimed pool member keeps.
+    names = {record.resource_name for record in InstanceRegistry.load().all()}
+    for instance_dir in os.listdir(terraform_folders_path()):
+        if instance_dir.startswith("ec2-"):
+            names.add(
+                read_base_name(os.path.join(terraform_folders_path(), instance_dir))
+                or instance_dir.removeprefix("ec2-")
+            )
+    names |= {member.name for member in WarmPool.load().members()}
+    return names
+
+
+def _base_name(name: str, suffixes) -> Optional[str]:
+    for suffix in suffixes:
+        if name.endswith(suffix):
+            return name.removesuffix(suffix)
+    return None
+
+
+def _tag(resource: dict, key: str) -> str:
+    for tag in resource.get("Tags", []):
+        if tag["Key"] == key:
+            return tag["Value"]
+    return ""
+
+
+def _scan_region(
+    region: str,
+    managed_names: Set[str],
+    all_volumes: bool,
+    region_timeout: float,
+) -> List[OrphanedResource]:
+    import boto3  # pylint: disable=import-outside-toplevel
+
+    # Sessions aren't thread-safe, so every region gets its own
+    ec2_client = boto3.session.Session().client(
+        "ec2", region_name=region, config=aws_client_config(region_timeout)
+    )
+
+    # Instances that still exist keep their resources, even when they aren't managed by
+    # this machine (e.g. created from another checkout), and whatever their name: the key
+    # pair and security groups an instance uses are never orphans
+    alive_names = set()
+    used_key_names = set()
+    used_group_ids = set()
+    for page in ec2_client.get_paginator("describe_instances").paginate(
+        Filters=[
+            {
+                "Name": "instance-state-name",
+                "Values": ["pending", "running", "stopping", "stopped"],
+            },
+        ]
+    ):
+        for reservation in page["Reservations"]:
+            for instance in reservation["Instances"]:
+                name_tag = _tag(instance, "Name")
+                if name_tag.endswith(instance_name_tag("")):
+                    alive_names.add(name_tag.removesuffix(instance_name_tag("")))
+                if instance.get("KeyName"):
+                    used_key_names.add(instance["KeyName"])
+                used_group_ids |= {
+                    group["GroupId"] for group in instance.get("SecurityGroups", [])
+                }
+
+    def orphaned(base_name: Optional[str]) -> bool:
+        return (
+            base_name is not None
+            and base_name not in managed_names
+            and base_name not in alive_names
+        )
+
+    orphans = []
+    for key_pair in ec2_client.describe_key_pairs()["KeyPairs"]:
+        if key_pair["KeyName"] in used_key_names:
+            continue
+        if orphaned(_base_name(key_pair["KeyName"], (_KEY_PAIR_SUFFIX,))):
+            orphans.append(
+                OrphanedResource(
+                    region, "key pair", key_pair["KeyPairId"], key_pair["KeyName"]
+                )
+            )
+
+    for page in ec2_client.get_paginator("describe_security_groups").paginate():
+        for group in page["SecurityGroups"]:
+            if group["GroupId"] in used_group_ids:
+                continue
+            if orphaned(_base_name(group["GroupName"], _SECURITY_GROUP_SUFFIXES)):
+                orphans.append(
+                    OrphanedResource(
+                        region, "security group", group["GroupId"], group["GroupName"]
+                    )
+                )
+
+    for page in ec2_client.get_paginator("describe_volumes").paginate(
+        Filters=[{"Name": "status", "Values": ["available"]}]
+    ):
+        for volume in page["Volumes"]:
+            name = _tag(volume, "Name")
+            if all_volumes or orphaned(_base_name(name, (_VOLUME_SUFFIX,))):
+                orphans.append(
+                    OrphanedResource(region, "volume", volume["VolumeId"], name or "-")
+                )
+
+    return orphans
+
+
+def _delete(ec2_client, orphan: OrphanedResource):
+    if orphan.resource_type == "key pair":
+        ec2_client.delete_key_pair(KeyPairId=orphan.resource_id)
+    elif orphan.resource_type == "security group":
+        ec2_client.delete_security_group(GroupId=orphan.resource_id)
+    else:
+        ec2_client.delete_volume(VolumeId=orphan.resource_id)
+
+
+def _delete_orphans(
+    orphans: List[OrphanedResource], max_workers: int, region_timeout: float
+) -> Dict[str, Exception]:
+    import boto3  # pylint: disable=import-outside-toplevel
+    import botocore.config  # pylint: disable=import-outside-toplevel
+
+    # Clients (unlike sessions) are thread-safe, so one per region is shared by all the
+    # workers - which also lets its adaptive retry mode slow every worker down together
+    # when the region throttles
+    config = aws_client_config(region_timeout).merge(
+        botocore.config.Config(
+            retries={"max_attempts": _DELETE_MAX_ATTEMPTS, "mode": "adaptive"}
+        )
+    )
+    clients = {
+        region: boto3.session.Session().client("ec2", region_name=region, config=config)
+        for region in {orphan.region for orphan in orphans}
+    }
+
+    errors = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_delete, clients[orphan.region], orphan): orphan
+            for orphan in orphans
+        }
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            orphan = futures[future]
+            if future.exception() is not None:
+                errors[f"{orphan.region}/{orphan.resource_id}"] = future.exception()
+            sys.stderr.write(
+                f"\rDeleted {done - len(errors)}/{len(orphans)} ({len(errors)} failed)..."
+            )
+    sys.stderr.write("\n")
+
+    return errors
+
+
+def collect_garbage(
+    region: Optional[str] = None,
+    delete: bool = False,
+    all_volumes: bool = False,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    region_timeout: float = DEFAULT_REGION_TIMEOUT_SECONDS,
+    assume_yes: bool = False,
+):
+    """List (or with delete, delete) the resources left behind by deleted instances.
+
+    Key pairs, security groups and unattached volumes named after an instance that is
+    neither managed here nor alive are orphans; with all_volumes, every unattached volume
+    is. Every region (or just the given one) is scanned concurrently, and deletions go
+    through a bounded pool of workers that backs off when AWS throttles.
+    """
+    import boto3  # pylint: disable=import-outside-toplevel
+
+    regions = (
+        [region] if region else available_regions(boto3.client("ec2"), CatalogCache())
+    )
+    managed_names = _managed_names()
+
+    orphans: List[OrphanedResource] = []
+    for result in fan_out_regions(
+        regions,
+        lambda scanned_region: _scan_region(
+            scanned_region, managed_names, all_volumes, region_timeout
+        ),
+        max_workers=max_workers,
+        region_timeout=region_timeout,
+    ):
+        if not result.ok:
+            sys.stderr.write(f"Skipping region {result.region}: {result.error}\n")
+            continue
+        orphans.extend(result.value)
+
+    if not orphans:
+        print("No orphaned resources found.")
+        return
+
+    orphans.sort(key=lambda x: (x.region, x.resource_type, x.name))
+    rows = [("REGION", "TYPE", "ID", "NAME")] + [
+        (orphan.region, orphan.resource_type, orphan.resource_id, orphan.name)
+        for orphan in orphans
+    ]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+    if not delete:
+        print(f"\n{len(orphans)} orphaned resources (dry run, use --delete to delete).")
+        return
+
+    if not assume_yes:
+        if input(f"\nDelete {len(orphans)} resources? [y/N] ").strip().lower() not in (
+            "y",
+            "yes",
+        ):
+            return
+
+    errors = _delete_orphans(orphans, max_workers, region_timeout)
+    print(f"Deleted {len(orphans) - len(errors)} resources, {len(errors)} failed.")
+    for resource, error in errors.items():
+        print(f"    {resource}: {error}")
+
+    if errors:
+        sys.exit(1)
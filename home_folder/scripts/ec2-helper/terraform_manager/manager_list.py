@@ -1,86 +1,114 @@
 """Lists all instances and their info."""
 import dataclasses
-import os
-import pathlib
-from typing import List
-
-from terraform_manager.instance_configuration import InstanceConfiguration, LinuxDistro
-from terraform_manager.manager_base import terraform_folders_path
-
-
-@dataclasses.dataclass
-class CreatedInstance:
-    """Represents an instance that has been created."""
-
-    name: str
-    instance_configuration: InstanceConfiguration
-    creation_time: str
-    base_path: pathlib.Path
-
-
-def _read_config_dir(instance_name: str, config_dir: pathlib.Path) -> CreatedInstance:
-    with open(os.path.join(config_dir, "region"), "r", encoding="utf-8") as region_file:
-        region = region_file.read().strip()
-    with open(os.path.join(config_dir, "ami-id"), "r", encoding="utf-8") as ami_file:
-        ami = ami_file.read().strip()
-    with open(
-        os.path.join(config_dir, "instance-type"), "r", encoding="utf-8"
-    ) as instance_type_file:
-        instance_type = instance_type_file.read().strip()
-    with open(os.path.join(config_dir, "distro"), "r", encoding="utf-8") as distro_file:
-        distro_name = distro_file.read().strip()
-        if distro_name == LinuxDistro.AMAZON_LINUX.name:
-            distro = LinuxDistro.AMAZON_LINUX
-        elif distro_name == LinuxDistro.UBUNTU.name:
-            distro = LinuxDistro.UBUNTU
-        else:
-            raise ValueError(f"Unexpected distro {distro_name} in {config_dir}")
-    with open(
-        os.path.join(config_dir, "creation_time"), "r", encoding="utf-8"
-    ) as creation_time_file:
-        creation_time = creation_time_file.read().strip()
-
-    return CreatedInstance(
-        name=instance_name,
-        instance_configuration=InstanceConfiguration(
-            region=region, ami=ami, instance_type=instance_type, distro=distro
-        ),
-        creation_time=creation_time,
-        base_path=config_dir,
-    )
-
-
-def _configurations() -> List[CreatedInstance]:
-    configurations = []
-
-    base = terraform_folders_path()
-    for instance_dir in os.listdir(base):
-        instance_path = os.path.join(base, instance_dir)
-
-        if os.path.isdir(instance_path):
-            config_dir = pathlib.Path(os.path.join(instance_path, "config"))
-            try:
-                configurations.append(_read_config_dir(instance_dir, config_dir))
-            except FileNotFoundError as e:
-                print(f"Missing file {e.filename} in {config_dir}")
-
-    return configurations
-
-
-def list_instance_configuration_folder(names_only: bool):
-    """List all instances in the configuration folder."""
-    configurations = _configurations()
+import datetime
+from typing import Dict, List, Optional
+
+from terraform_manager.instance_registry import (
+    InstanceRecord,
+    InstanceRegistry,
+    backfill_from_state,
+)
+from terraform_manager.instance_status import (
+    MISSING_STATE,
+    UNKNOWN_STATE,
+    InstanceStatus,
+    describe_managed_instances,
+)
+from terraform_manager.region_fanout import (
+    DEFAULT_MAX_WORKERS,
+    DEFAULT_REGION_TIMEOUT_SECONDS,
+)
+from terraform_manager.ssh_config import sync_ssh_config
+
+
+def _format_uptime(uptime: Optional[datetime.timedelta]) -> str:
+    if uptime is None:
+        return "-"
+    minutes = int(uptime.total_seconds()) // 60
+    days, minutes = divmod(minutes, 24 * 60)
+    hours, minutes = divmod(minutes, 60)
+    if days:
+        return f"{days}d {hours}h"
+    if hours:
+        return f"{hours}h {minutes}m"
+    return f"{minutes}m"
+
+
+def _save_live_state(statuses: Dict[str, InstanceStatus]):
+    """Write refreshed IPs (and discovered instance IDs) back to the registry."""
+    changed = False
+    with InstanceRegistry.update() as registry:
+        for status in statuses.values():
+            record = registry.find(status.name)
+            if record is None or status.state in (UNKNOWN_STATE, MISSING_STATE):
+                continue
+            refreshed = dataclasses.replace(
+                record, server_ip=status.public_ip, instance_id=status.instance_id
+            )
+            if refreshed != record:
+                registry.put(refreshed)
+                changed = True
+
+    if changed:
+        sync_ssh_config(registry)
+
+
+def _list_live(
+    configurations: List[InstanceRecord], max_workers: int, region_timeout: float
+):
+    statuses = describe_managed_instances(configurations, max_workers, region_timeout)
+
+    rows = [("NAME", "REGION", "TYPE", "STATE", "PUBLIC IP", "UPTIME")]
+    for configuration in configurations:
+        status = statuses[configuration.name]
+        rows.append(
+            (
+                configuration.name,
+                configuration.instance_configuration.region,
+                configuration.instance_configuration.instance_type,
+                status.state,
+                status.public_ip or "-",
+                _format_uptime(status.uptime),
+            )
+        )
+
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+    _save_live_state(statuses)
+
+
+def list_instance_configuration_folder(
+    names_only: bool,
+    live: bool = False,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    region_timeout: float = DEFAULT_REGION_TIMEOUT_SECONDS,
+):
+    """List all instances in the configuration folder.
+
+    With live, the instances' current state, public IP and uptime are queried from EC2
+    and refreshed IPs are saved, so that connect keeps working after a stop/start.
+    """
+    configurations = InstanceRegistry.load().all()
 
     if not configurations:
         print("No instances found.")
         return
 
+    if live and not names_only:
+        _list_live(configurations, max_workers, region_timeout)
+        return
+
+    if not names_only:
+        configurations = backfill_from_state(configurations)
+
     for configuration in configurations:
         if names_only:
-            print(configuration.name.removeprefix("ec2-"))
+            print(configuration.name)
             continue
 
-        print(f'Instance "{configuration.name.removeprefix("ec2-")}":')
+        print(f'Instance "{configuration.name}":')
         print(f"    Region: {configuration.instance_configuration.region}")
         print(f"    AMI: {configuration.instance_configuration.ami}")
         print(
@@ -88,5 +116,6 @@ def list_instance_configuration_folder(names_only: bool):
         )
         print(f"    Distro: {configuration.instance_configuration.distro.value}")
         print(f"    Creation time: {configuration.creation_time}")
-        print(f"    Base path: {configuration.base_path}")
+        print(f"    Public IP: {configuration.server_ip or '-'}")
+        print(f"    Base path: {configuration.instance_path}")
         print()
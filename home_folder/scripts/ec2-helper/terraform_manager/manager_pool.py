@@ -0,0 +1,229 @@
+"""Fill, replenish, inspect and drain the warm pool of stopped instances."""
+import fcntl
+import os
+import secrets
+import subprocess  # nosec (remove bandit warning)
+import sys
+import time
+from typing import Callable, List
+
+from terraform_manager.aws_account import aws_account_id
+from terraform_manager.instance_configuration import LinuxDistro, instance_configuration
+from terraform_manager.instance_pool import (
+    READY_STATE,
+    PoolMember,
+    WarmPool,
+    distro_option,
+    pool_key,
+    pool_path,
+)
+from terraform_manager.instance_readiness import wait_until_ready
+from terraform_manager.instance_registry import distro_username
+from terraform_manager.manager_base import base_path, cache_path
+from terraform_manager.manager_create import (
+    render_instance_folder,
+    rollback_instance_folder,
+)
+from terraform_manager.parallel_runner import (
+    DEFAULT_MAX_WORKERS,
+    print_summary,
+    run_parallel,
+)
+from terraform_manager.terraform_runner import run_terraform, terraform_init
+from terraform_manager.terraform_state import read_state
+
+
+def _provision_member(
+    member_name: str,
+    key: str,
+    aws_account_id: str,
+    report: Callable[[str], None],
+):
+    region, instance_type, distro_name = key.split("/")
+    distro = LinuxDistro[distro_name]
+    # Resolved on every replenish, so that members use the newest (baked) AMI
+    instance_config = instance_configuration(
+        region, distro_option(distro), instance_type
+    )
+
+    member = PoolMember(
+        name=member_name,
+        instance_configuration=instance_config,
+        creation_time=time.strftime("%Y-%m-%d %H:%M:%S"),
+    )
+    with WarmPool.update() as pool:
+        pool.put(member)
+
+    try:
+        render_instance_folder(
+            member_name, aws_account_id, instance_config, member.path
+        )
+        report("terraform init")
+        terraform_init(member.path)
+        report("terraform apply")
+        run_terraform(member.path, "apply", "-auto-approve")
+
+        state = read_state(member.path)
+        if state is None:
+            raise ValueError(f'No terraform state in "{member.path}" after apply.')
+        outputs = state.instance_outputs()
+        key_path = os.path.join(member.path, outputs.server_key)
+        os.chmod(key_path, 0o400)
+
+        report("provisioning")
+        wait_until_ready(
+            region,
+            outputs.instance_id,
+            outputs.server_ip,
+            ["ssh", "-i", key_path, f"{distro_username(distro)}@{outputs.server_ip}"],
+            wait_cloud_init=True,
+        )
+
+        report("stopping")
+        import boto3  # pylint: disable=import-outside-toplevel
+
+        ec2_client = boto3.client("ec2", region_name=region)
+        ec2_client.stop_instances(InstanceIds=[outputs.instance_id])
+        ec2_client.get_waiter("instance_stopped").wait(
+            InstanceIds=[outputs.instance_id],
+            WaiterConfig={"Delay": 5, "MaxAttempts": 120},
+        )
+    except Exception:
+        report("rolling back")
+        if os.path.exists(member.path):
+            rollback_instance_folder(member_name, member.path)
+        with WarmPool.update() as pool:
+            pool.remove(member_name)
+        raise
+
+    with WarmPool.update() as pool:
+        pool.put(
+            PoolMember(
+                name=member_name,
+                instance_configuration=instance_config,
+                creation_time=member.creation_time,
+                state=READY_STATE,
+                instance_id=outputs.instance_id,
+                server_key=outputs.server_key,
+            )
+        )
+
+
+def replenish_pool(max_workers: int = DEFAULT_MAX_WORKERS, quiet: bool = False):
+    """Provision members until every pool reaches its target size.
+
+    Only one replenisher runs at a time; a second one returns right away.
+    """
+    with open(
+        os.path.join(pool_path(), "replenish.lock"), "w", encoding="utf-8"
+    ) as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            if not quiet:
+                print("The pool is already being replenished.")
+            return
+
+        pool = WarmPool.load()
+        tasks = {
+            f"pool-{secrets.token_hex(4)}": key
+            for key in pool.targets
+            for _ in range(pool.missing(key))
+        }
+        if not tasks:
+            if not quiet:
+                print("The pool is full.")
+            return
+
+        account_id = aws_account_id()
+        results = run_parallel(
+            list(tasks),
+            lambda member_name, report: _provision_member(
+                member_name, tasks[member_name], account_id, report
+            ),
+            max_workers,
+        )
+        print_summary(results, "Replenish")
+
+
+def spawn_replenisher():
+    """Replenish the pool in a detached background process, logging to the cache."""
+    log_path = os.path.join(cache_path("pool"), "replenish.log")
+    with open(log_path, "a", encoding="utf-8") as log_file:
+        subprocess.Popen(  # pylint: disable=consider-using-with
+            [sys.executable, os.path.join(base_path(), "ec2"), "pool", "replenish"],
+            stdin=subprocess.DEVNULL,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )  # nosec (remove bandit warning)
+    print(f'Replenishing the pool in the background (log: "{log_path}").')
+
+
+def fill_pool(
+    region: str,
+    instance_type: str,
+    distro: str,
+    size: int,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+):
+    """Set the target size of a pool and provision the members it lacks."""
+    if size < 0:
+        raise ValueError(f"Pool size can't be negative, got {size}.")
+
+    key = pool_key(region, instance_type, LinuxDistro[distro.upper().replace("-", "_")])
+    with WarmPool.update() as pool:
+        if size:
+            pool.targets[key] = size
+        else:
+            pool.targets.pop(key, None)
+
+    replenish_pool(max_workers)
+
+
+def print_pool_status():
+    """Print the target size and members of every pool."""
+    pool = WarmPool.load()
+    keys = sorted(set(pool.targets) | {member.key for member in pool.members()})
+    if not keys:
+        print("The pool is empty.")
+        return
+
+    for key in keys:
+        members = pool.members(key)
+        ready = [member for member in members if member.state == READY_STATE]
+        print(f"{key}: {len(ready)} ready of {pool.targets.get(key, 0)} wanted")
+        for member in members:
+            print(
+                f"    {member.name}  {member.state:<12}  "
+                f"{member.instance_id or '-':<19}  {member.creation_time}"
+            )
+
+
+def _destroy_member(member_name: str, report: Callable[[str], None]):
+    member_path = os.path.join(pool_path(), member_name)
+    report("terraform destroy")
+    rollback_instance_folder(member_name, member_path)
+    with WarmPool.update() as pool:
+        pool.remove(member_name)
+
+
+def drain_pool(max_workers: int = DEFAULT_MAX_WORKERS, assume_yes: bool = False):
+    """Destroy every pooled instance and clear the target sizes."""
+    names: List[str] = [member.name for member in WarmPool.load().members()]
+
+    if names and not assume_yes:
+        print("About to destroy: " + ", ".join(names))
+        if input("Continue? [y/N] ").strip().lower() not in ("y", "yes"):
+            return
+
+    # Cleared first, so that a running replenisher doesn't provision new members
+    with WarmPool.update() as pool:
+        pool.targets.clear()
+
+    if not names:
+        print("The pool is empty.")
+        return
+
+    results = run_parallel(names, _destroy_member, max_workers)
+    print_summary(results, "Drain")
@@ -1,14 +1,34 @@
 import boto3
 import dataclasses
-import json
 import os
-import subprocess
+import re
+import shutil
 import sys
+import time
 
-from typing import List, Optional
+from typing import Callable, List, Optional
 
-from .instance_configuration import LinuxDistro, fzf_select
-from .manager_base import manager_path, terraform_folders_path
+from .ami_resolver import UNKNOWN_DISTRO, AmiDistroResolver
+from .aws_account import aws_account_id
+from .catalog_cache import CatalogCache
+from .instance_configuration import (
+    InstanceConfiguration,
+    LinuxDistro,
+    available_regions,
+    fzf_select,
+)
+from .instance_registry import InstanceRecord, InstanceRegistry
+from .manager_base import base_path, terraform_folders_path
+from . import parallel_runner
+from .region_fanout import (
+    DEFAULT_MAX_WORKERS,
+    DEFAULT_REGION_TIMEOUT_SECONDS,
+    aws_client_config,
+    fan_out_regions,
+)
+from .ssh_config import sync_ssh_config
+from .terraform_runner import run_terraform, terraform_init
+from .terraform_state import read_state
 
 
 @dataclasses.dataclass
@@ -19,175 +39,266 @@ class SyncInstanceConfiguration:
     region: str
     public_ip: Optional[str]
     distro: str
+    ami: str
 
     # String
     def __str__(self):
         return f"{self.name or '<No Name>'} ({self.instance_type}, {self.public_ip}) ({self.instance_id})"
 
 
-def _retrieve_instance_configurations(
-    region: Optional[str]
+def _retrieve_region_instance_configurations(
+    region: Optional[str],
+    resolver: AmiDistroResolver,
+    region_timeout: float = DEFAULT_REGION_TIMEOUT_SECONDS,
 ) -> List[SyncInstanceConfiguration]:
-    if region:
-        ec2 = boto3.resource("ec2", region_name=region)
-        ec2_client = boto3.client("ec2", region_name=region)
-    else:
-        ec2 = boto3.resource("ec2")
-        ec2_client = boto3.client("ec2")
+    # Sessions aren't thread-safe, so every region gets its own
+    session = boto3.session.Session()
+    ec2_client = session.client(
+        "ec2", region_name=region, config=aws_client_config(region_timeout)
+    )
 
     # Retrieve all EC2 instances that are active
-    instances = ec2.instances.filter(
+    paginator = ec2_client.get_paginator("describe_instances")
+    pages = paginator.paginate(
         Filters=[{"Name": "instance-state-name", "Values": ["running"]}]
     )
 
+    instances = [
+        instance
+        for page in pages
+        for reservation in page["Reservations"]
+        for instance in reservation["Instances"]
+    ]
+
+    # One batched lookup for all the instances' AMIs instead of one call per instance
+    distros = resolver.resolve(
+        ec2_client, [instance.get("ImageId") for instance in instances]
+    )
+
     configurations = []
     for instance in instances:
-        # For each instance, print its ID, type, and name
         # The name is a tag with the key "Name"
         name = ""
-        if instance.tags:
-            name_tag = [tag["Value"] for tag in instance.tags if tag["Key"] == "Name"]
-            if name_tag:
-                name = name_tag[0]
-
-        if instance.image_id:
-            image = ec2_client.describe_images(ImageIds=[instance.image_id])["Images"][
-                0
-            ]
-            description = image.get("Description", "").lower()
-            if "ubuntu" in description:
-                distro = "Ubuntu"
-            elif "amzn" in description or "amazon linux" in description:
-                distro = "Amazon Linux"
-            elif "kubernetes worker ami" in description:
-                distro = "EKS AMI"
-            else:
-                distro = f"Unknown - {description}"
+        name_tag = [
+            tag["Value"] for tag in instance.get("Tags", []) if tag["Key"] == "Name"
+        ]
+        if name_tag:
+            name = name_tag[0]
 
         configurations.append(
             SyncInstanceConfiguration(
                 name=name,
-                instance_id=instance.id,
-                instance_type=instance.instance_type,
-                region=instance.placement["AvailabilityZone"][:-1],
-                public_ip=instance.public_ip_address,
-                distro=distro,
+                instance_id=instance["InstanceId"],
+                instance_type=instance["InstanceType"],
+                region=instance["Placement"]["AvailabilityZone"][:-1],
+                public_ip=instance.get("PublicIpAddress"),
+                distro=distros.get(instance.get("ImageId"), UNKNOWN_DISTRO),
+                ami=instance.get("ImageId", ""),
             )
         )
 
     return configurations
 
 
-def sync_ec2_instances(region: Optional[str]):
-    instance_configurations = _retrieve_instance_configurations(region)
+def _retrieve_all_regions_instance_configurations(
+    resolver: AmiDistroResolver, max_workers: int, region_timeout: float
+) -> List[SyncInstanceConfiguration]:
+    regions = available_regions(boto3.client("ec2"), CatalogCache())
 
-    instance_configurations.sort(key=lambda x: not x.name)
+    configurations = []
+    for result in fan_out_regions(
+        regions,
+        lambda region: _retrieve_region_instance_configurations(
+            region, resolver, region_timeout
+        ),
+        max_workers=max_workers,
+        region_timeout=region_timeout,
+    ):
+        if not result.ok:
+            sys.stderr.write(f"Skipping region {result.region}: {result.error}\n")
+            continue
 
-    selected_config = fzf_select([str(x) for x in instance_configurations])
+        configurations.extend(result.value)
+        sys.stderr.write(
+            f"\rDiscovered {len(configurations)} running instances "
+            f"(last: {result.region}, {result.elapsed:.1f}s)..."
+        )
+    sys.stderr.write("\n")
 
-    if not selected_config:
-        return
+    return configurations
+
+
+def _retrieve_instance_configurations(
+    region: Optional[str],
+    all_regions: bool = False,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    region_timeout: float = DEFAULT_REGION_TIMEOUT_SECONDS,
+) -> List[SyncInstanceConfiguration]:
+    resolver = AmiDistroResolver()
+    try:
+        if all_regions:
+            return _retrieve_all_regions_instance_configurations(
+                resolver, max_workers, region_timeout
+            )
+        return _retrieve_region_instance_configurations(
+            region, resolver, region_timeout
+        )
+    finally:
+        resolver.save()
 
-    selected_config = [x for x in instance_configurations if str(x) == selected_config][
-        0
-    ]
 
-    if not selected_config.name:
-        raise Exception("TODO")
-
-    # terraformer import aws --resources=ec2_instance --filter="Name=id;Value=i-0450bdd70834f2294" --regions=us-east-1 --profile=deployment-tests --compact --path-output test --path-pattern "{output}/"
-    with subprocess.Popen(
-        [
-            "terraformer",
-            "import",
-            "aws",
-            "--resources=ec2_instance",
-            f"--filter=Name=id;Value={selected_config.instance_id}",
-            f"--profile={os.environ['AWS_PROFILE']}",
-            "--compact",
-            "--path-pattern",
-            f"{terraform_folders_path()}/ec2-{selected_config.name}",
-        ],
-        cwd=manager_path(),
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    ) as process:
-        _, stderr = process.communicate()
-        if process.returncode != 0:
-            sys.stderr.write(stderr.decode("utf-8"))
-            raise ValueError("Terraformer failed.")
-
-    # terraform state replace-provider -auto-approve "registry.terraform.io/-/aws" "hashicorp/aws"
-    with subprocess.Popen(
-        [
-            "terraform",
-            "state",
-            "replace-provider",
-            "-auto-approve",
-            "registry.terraform.io/-/aws",
-            "hashicorp/aws",
-        ],
-        cwd=os.path.join(terraform_folders_path(), f"ec2-{selected_config.name}"),
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    ) as process:
-        _, stderr = process.communicate()
-        if process.returncode != 0:
-            sys.stderr.write(stderr.decode("utf-8"))
-            raise ValueError("Terraform state replace-provider failed.")
-
-    with subprocess.Popen(
-        ["terraform", "init"],
-        cwd=os.path.join(terraform_folders_path(), f"ec2-{selected_config.name}"),
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    ) as process:
-        _, stderr = process.communicate()
-        if process.returncode != 0:
-            sys.stderr.write(stderr.decode("utf-8"))
-            raise ValueError("Terraform init failed.")
-
-    with subprocess.Popen(
-        ["terraform", "validate", "-json"],
-        cwd=os.path.join(terraform_folders_path(), f"ec2-{selected_config.name}"),
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    ) as process:
-        terraform_validate_output, stderr = process.communicate()
-        if stderr:
-            sys.stderr.write(stderr.decode("utf-8"))
-            raise ValueError("Terraform validate failed.")
-
-    terraform_validate_json = json.loads(terraform_validate_output.decode("utf-8"))
-
-    line_numbers = [
-        diagnostic["range"]["start"]["line"]
-        for diagnostic in terraform_validate_json.get("diagnostics", [])
-        if "range" in diagnostic and "start" in diagnostic["range"]
+def _linux_distro(selected_config: SyncInstanceConfiguration) -> LinuxDistro:
+    # An instance without a registry entry would be invisible to every other command
+    if selected_config.distro not in [distro.value for distro in LinuxDistro]:
+        raise ValueError(
+            f"Unknown distro ({selected_config.distro}), so the login user can't be "
+            "determined."
+        )
+    return LinuxDistro(selected_config.distro)
+
+
+def _register_imported_instance(
+    selected_config: SyncInstanceConfiguration, instance_path: str
+):
+    state = read_state(instance_path)
+    instances = [
+        attributes
+        for attributes in (state.resource_attributes("aws_instance") if state else [])
+        if attributes.get("id") == selected_config.instance_id
     ]
+    if not instances:
+        raise ValueError(
+            f"Instance {selected_config.instance_id} is missing from the state "
+            f'in "{instance_path}".'
+        )
 
-    # Remove line numbers from the 'resources.tf' file:
-    with open(
-        os.path.join(
-            terraform_folders_path(), f"ec2-{selected_config.name}", "resources.tf"
+    record = InstanceRecord(
+        name=selected_config.name,
+        instance_configuration=InstanceConfiguration(
+            region=selected_config.region,
+            ami=instances[0]["ami"],
+            instance_type=instances[0]["instance_type"],
+            distro=_linux_distro(selected_config),
         ),
-        "r",
-        encoding="utf-8",
-    ) as resources_file:
-        resources_contents = resources_file.read()
-
-    resources_lines = resources_contents.split("\n")
-    resources_lines = [
-        line
-        for line_number, line in enumerate(resources_lines, start=1)
-        if line_number not in line_numbers
-    ]
+        creation_time=time.strftime("%Y-%m-%d %H:%M:%S"),
+        server_ip=instances[0].get("public_ip"),
+        instance_id=instances[0]["id"],
+    )
+    with InstanceRegistry.update() as registry:
+        registry.put(record)
+
+
+def _instance_folder_name(selected_config: SyncInstanceConfiguration) -> str:
+    # Name tags are free-form, folder names and ssh aliases aren't
+    return (
+        re.sub(r"[^A-Za-z0-9_.-]+", "-", selected_config.name or "").strip("-")
+        or selected_config.instance_id
+    )
+
+
+def _render_import_folder(
+    selected_config: SyncInstanceConfiguration, account_id: str, instance_path: str
+):
+    os.makedirs(instance_path)
 
     with open(
-        os.path.join(
-            terraform_folders_path(), f"ec2-{selected_config.name}", "resources.tf"
+        os.path.join(base_path(), "ec2-terraform-import-template.tf"), encoding="utf-8"
+    ) as terraform_file:
+        terraform_contents = terraform_file.read()
+
+    for placeholder, value in [
+        ("$REGION", selected_config.region),
+        ("$ACCOUNT", account_id),
+        ("$INSTANCE_ID", selected_config.instance_id),
+        ("$AMI", selected_config.ami),
+        ("$INSTANCE_TYPE", selected_config.instance_type),
+    ]:
+        terraform_contents = terraform_contents.replace(placeholder, value)
+
+    with open(
+        os.path.join(instance_path, "main.tf"), "w", encoding="utf-8"
+    ) as instance_file:
+        instance_file.write(terraform_contents)
+
+
+def _import_instance(
+    selected_config: SyncInstanceConfiguration,
+    instance_path: str,
+    report: Callable[[str], None],
+):
+    try:
+        # Checked first, to fail before spending an init and an apply
+        _linux_distro(selected_config)
+        report("terraform init")
+        terraform_init(instance_path)
+        # The import block adopts the instance; the lifecycle rule keeps it untouched
+        report("terraform import")
+        run_terraform(instance_path, "apply", "-auto-approve", "-input=false")
+        report("registering")
+        _register_imported_instance(selected_config, instance_path)
+    except Exception:
+        report("rolling back")
+        # Nothing to destroy: an import never creates resources
+        shutil.rmtree(instance_path)
+        with InstanceRegistry.update() as registry:
+            registry.remove(selected_config.name)
+        raise
+
+
+def sync_ec2_instances(
+    region: Optional[str],
+    all_regions: bool = False,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    region_timeout: float = DEFAULT_REGION_TIMEOUT_SECONDS,
+    import_workers: int = parallel_runner.DEFAULT_MAX_WORKERS,
+):
+    """Adopt running instances selected with fzf (several with tab) as managed instances.
+
+    Every selected instance gets a folder with a generated import configuration, and the
+    folders are initialized and applied concurrently.
+    """
+    instance_configurations = _retrieve_instance_configurations(
+        region, all_regions, max_workers, region_timeout
+    )
+
+    instance_configurations.sort(key=lambda x: not x.name)
+
+    selected = fzf_select(
+        [str(x) for x in instance_configurations],
+        "Select the instances to import (tab to select several):",
+        multi=True,
+    ).splitlines()
+    if not selected:
+        return
+
+    selected_configs = {}
+    for config in instance_configurations:
+        if str(config) not in selected:
+            continue
+        name = _instance_folder_name(config)
+        instance_path = os.path.join(terraform_folders_path(), f"ec2-{name}")
+        if os.path.exists(instance_path) or name in selected_configs:
+            print(f'Skipping {config.instance_id}: "{name}" is already managed.')
+            continue
+        selected_configs[name] = dataclasses.replace(config, name=name)
+    if not selected_configs:
+        return
+
+    account_id = aws_account_id()
+    instance_paths = {}
+    for name, config in selected_configs.items():
+        instance_paths[name] = os.path.join(terraform_folders_path(), f"ec2-{name}")
+        _render_import_folder(config, account_id, instance_paths[name])
+
+    results = parallel_runner.run_parallel(
+        list(selected_configs),
+        lambda name, report: _import_instance(
+            selected_configs[name], instance_paths[name], report
         ),
-        "w",
-        encoding="utf-8",
-    ) as resources_file:
-        resources_file.write("\n".join(resources_lines))
+        import_workers,
+    )
+    sync_ssh_config()
+    parallel_runner.print_summary(results, "Import")
+
+    if any(not result.ok for result in results.values()):
+        sys.exit(1)
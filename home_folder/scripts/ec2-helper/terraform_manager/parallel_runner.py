@@ -0,0 +1,131 @@
+"""Run one task per instance concurrently, with a live per-instance progress table."""
+import concurrent.futures
+import dataclasses
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+DEFAULT_MAX_WORKERS = 4
+
+
+@dataclasses.dataclass
+class TaskResult:
+    """The outcome of the task for a single instance."""
+
+    name: str
+    state: str = "pending"
+    value: Any = None
+    error: Optional[BaseException] = None
+    started: Optional[float] = None
+    finished: Optional[float] = None
+
+    @property
+    def ok(self) -> bool:
+        """Return whether the task finished successfully."""
+        return self.finished is not None and self.error is None
+
+    @property
+    def elapsed(self) -> float:
+        """Return the number of seconds the task has been (or was) running."""
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+
+class ProgressTable:
+    """Shows the state of every task.
+
+    On a terminal the table is redrawn in place; otherwise every state change is streamed
+    as a line, which keeps logs readable.
+    """
+
+    def __init__(self, results: List[TaskResult], stream=sys.stderr):
+        self._results = results
+        self._stream = stream
+        self._interactive = stream.isatty()
+        self._lock = threading.Lock()
+        self._drawn_lines = 0
+        self._name_width = max([len(result.name) for result in results] + [4])
+
+    def _row(self, result: TaskResult) -> str:
+        row = f"{result.name:<{self._name_width}}  {result.state:<18}"
+        if result.started is not None:
+            row += f"  {result.elapsed:7.1f}s"
+        return row
+
+    def draw(self):
+        """Redraw the whole table (terminal output only)."""
+        if not self._interactive:
+            return
+        with self._lock:
+            if self._drawn_lines:
+                self._stream.write(f"\033[{self._drawn_lines}F")
+            for result in self._results:
+                self._stream.write(f"\033[2K{self._row(result)}\n")
+            self._drawn_lines = len(self._results)
+            self._stream.flush()
+
+    def changed(self, result: TaskResult):
+        """Report that the given task's state changed."""
+        if self._interactive:
+            self.draw()
+            return
+        with self._lock:
+            self._stream.write(self._row(result) + "\n")
+            self._stream.flush()
+
+
+def run_parallel(
+    names: List[str],
+    task: Callable[[str, Callable[[str], None]], Any],
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    stream=sys.stderr,
+) -> Dict[str, TaskResult]:
+    """Run task(name, report) for every name with at most max_workers running at once.
+
+    task calls report(state) to update its row in the progress table. A task that raises
+    is marked as failed; it never affects the other tasks.
+    """
+    results = {name: TaskResult(name=name) for name in names}
+    table = ProgressTable(list(results.values()), stream)
+
+    def run(name: str):
+        result = results[name]
+        result.started = time.monotonic()
+
+        def report(state: str):
+            result.state = state
+            table.changed(result)
+
+        report("running")
+        try:
+            result.value = task(name, report)
+            result.finished = time.monotonic()
+            report("done")
+        except Exception as e:  # pylint: disable=broad-except
+            result.error = e
+            result.finished = time.monotonic()
+            report("failed")
+
+    table.draw()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run, name) for name in names]
+        # Keep the elapsed times ticking on a terminal while tasks are running
+        while not all(future.done() for future in futures):
+            concurrent.futures.wait(futures, timeout=1)
+            table.draw()
+
+    return results
+
+
+def print_summary(results: Dict[str, TaskResult], action: str):
+    """Print timings for every task and the errors of the ones that failed."""
+    failed = [result for result in results.values() if not result.ok]
+
+    print(f"\n{action}: {len(results) - len(failed)} succeeded, {len(failed)} failed.")
+    for result in results.values():
+        status = "ok" if result.ok else "FAILED"
+        print(f"    {result.name}: {status} ({result.elapsed:.1f}s)")
+    for result in failed:
+        print(f'\nError for "{result.name}":\n{result.error}')
@@ -0,0 +1,105 @@
+"""Run a per-region AWS operation concurrently across many regions."""
+import concurrent.futures
+import dataclasses
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+DEFAULT_MAX_WORKERS = 16
+DEFAULT_REGION_TIMEOUT_SECONDS = 20.0
+
+# How often the fan-out loop wakes up to check for regions that exceeded their timeout
+_POLL_INTERVAL_SECONDS = 0.25
+
+
+@dataclasses.dataclass
+class RegionResult:
+    """The outcome of running an operation in a single region."""
+
+    region: str
+    value: Any = None
+    error: Optional[BaseException] = None
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        """Return whether the operation succeeded in this region."""
+        return self.error is None
+
+
+def aws_client_config(region_timeout: float = DEFAULT_REGION_TIMEOUT_SECONDS):
+    """Return a botocore Config whose network timeouts fit inside the region timeout."""
+    import botocore.config  # pylint: disable=import-outside-toplevel
+
+    return botocore.config.Config(
+        connect_timeout=min(5.0, region_timeout),
+        read_timeout=region_timeout,
+        retries={"max_attempts": 3, "mode": "adaptive"},
+    )
+
+
+def fan_out_regions(
+    regions: Iterable[str],
+    operation: Callable[[str], Any],
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    region_timeout: float = DEFAULT_REGION_TIMEOUT_SECONDS,
+) -> Iterator[RegionResult]:
+    """Run operation(region) for every region, yielding results as they complete.
+
+    At most max_workers regions run at once. A region that raises is reported with its
+    error, and a region that runs for longer than region_timeout is reported as timed
+    out and abandoned, so one slow or disabled region can never block the others.
+    """
+    started_at: Dict[str, float] = {}
+    started_lock = threading.Lock()
+
+    def run(region: str) -> Any:
+        with started_lock:
+            started_at[region] = time.monotonic()
+        return operation(region)
+
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="region"
+    )
+    try:
+        pending = {executor.submit(run, region): region for region in regions}
+
+        while pending:
+            done, _ = concurrent.futures.wait(
+                pending,
+                timeout=_POLL_INTERVAL_SECONDS,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+
+            for future in done:
+                region = pending.pop(future)
+                elapsed = time.monotonic() - started_at.get(region, time.monotonic())
+                error = future.exception()
+                if error is not None:
+                    yield RegionResult(region=region, error=error, elapsed=elapsed)
+                else:
+                    yield RegionResult(
+                        region=region, value=future.result(), elapsed=elapsed
+                    )
+
+            now = time.monotonic()
+            with started_lock:
+                timed_out = [
+                    future
+                    for future, region in pending.items()
+                    if region in started_at
+                    and now - started_at[region] > region_timeout
+                ]
+            for future in timed_out:
+                region = pending.pop(future)
+                future.cancel()
+                yield RegionResult(
+                    region=region,
+                    error=TimeoutError(
+                        f"Region {region} did not respond within {region_timeout}s"
+                    ),
+                    elapsed=now - started_at[region],
+                )
+    finally:
+        # Don't wait for abandoned regions - their client timeouts will reap them
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,98 @@
+"""Maintains a managed block of ssh_config host entries for the managed instances."""
+import os
+import re
+from typing import List, Optional
+
+from terraform_manager.instance_registry import InstanceRecord, InstanceRegistry
+from terraform_manager.manager_base import write_atomically
+
+BLOCK_BEGIN = "# BEGIN ec2-helper managed hosts - generated, do not edit"
+BLOCK_END = "# END ec2-helper managed hosts"
+
+CONTROL_PERSIST = "10m"
+
+# Stanzas appended by earlier versions, one per IP the instance ever had
+_LEGACY_STANZA_RE = re.compile(
+    r"\nHost EC2-Helper-[0-9.]+\n(?:    [^\n]*\n)*?    StrictHostKeyChecking no\n    "
+)
+
+
+def ssh_config_path() -> str:
+    """Return the path of the user's ssh_config."""
+    return os.path.expanduser("~/.ssh/config")
+
+
+def control_path_dir() -> str:
+    """Return the folder holding the multiplexed master connections' sockets."""
+    return os.path.expanduser("~/.ssh/ec2-helper-control")
+
+
+def ssh_host_alias(name: str) -> str:
+    """Return the ssh_config Host alias of the given instance."""
+    return f"EC2-Helper-{name}"
+
+
+def _host_stanza(record: InstanceRecord) -> List[str]:
+    lines = [
+        f"Host {ssh_host_alias(record.name)}",
+        f"    HostName {record.server_ip}",
+        f"    User {record.username}",
+        "    Port 22",
+    ]
+    if record.key_path:
+        lines += [f"    IdentityFile {record.key_path}", "    IdentitiesOnly yes"]
+    return lines + [
+        # IPs (and host keys) are recycled as instances come and go
+        "    StrictHostKeyChecking no",
+        "    UserKnownHostsFile /dev/null",
+        "    LogLevel ERROR",
+        # Reuse one authenticated connection for ssh, scp and VS Code sessions
+        "    ControlMaster auto",
+        f"    ControlPath {os.path.join(control_path_dir(), '%C')}",
+        f"    ControlPersist {CONTROL_PERSIST}",
+        "    ServerAliveInterval 60",
+    ]
+
+
+def _managed_block(records: List[InstanceRecord]) -> str:
+    lines = [BLOCK_BEGIN]
+    for record in records:
+        if record.server_ip:
+            lines += _host_stanza(record) + [""]
+    # Options following the block (e.g. global ones at the top of the file) must not end
+    # up scoped to the last stanza, so the block hands back to a match-everything scope
+    return "\n".join(lines + ["Host *", BLOCK_END]) + "\n"
+
+
+def _strip_managed_block(contents: str) -> str:
+    begin = contents.find(BLOCK_BEGIN)
+    end = contents.find(BLOCK_END)
+    if begin == -1 or end == -1:
+        return contents
+    end = contents.find("\n", end)
+    return contents[:begin] + (contents[end + 1 :] if end != -1 else "")
+
+
+def sync_ssh_config(registry: Optional[InstanceRegistry] = None):
+    """Rewrite the managed block to hold exactly one entry per managed instance.
+
+    The block is placed at the top of the file, since ssh uses the first value it finds
+    for every option. Entries of destroyed instances disappear with the rewrite.
+    """
+    registry = registry or InstanceRegistry.load()
+    path = ssh_config_path()
+
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    os.makedirs(control_path_dir(), mode=0o700, exist_ok=True)
+
+    try:
+        with open(path, encoding="utf-8") as config_file:
+            contents = config_file.read()
+    except FileNotFoundError:
+        contents = ""
+
+    rest = _LEGACY_STANZA_RE.sub("", _strip_managed_block(contents)).lstrip("\n")
+    new_contents = _managed_block(registry.all()) + ("\n" + rest if rest else "")
+
+    if new_contents != contents:
+        write_atomically(path, new_contents)
@@ -0,0 +1,216 @@
+"""Run terraform commands in managed instance folders."""
+import contextlib
+import fcntl
+import os
+import re
+import shutil
+import subprocess  # nosec (remove bandit warning)
+import tempfile
+from typing import Dict, Set
+
+from terraform_manager.manager_base import base_path, cache_path, write_atomically
+
+# A copy is shared by every managed folder so that cached providers are reused
+_LOCK_FILE_NAME = ".terraform.lock.hcl"
+_LOCK_FILE_HEADER = (
+    '# This file is maintained automatically by "terraform init".\n'
+    "# Manual edits may be lost in future updates.\n"
+)
+
+_LOCKED_PROVIDER_RE = re.compile(
+    r'^provider "([^"]+)" \{\n.*?^\}\n', re.MULTILINE | re.DOTALL
+)
+_LOCKED_VERSION_RE = re.compile(r'^\s*version\s*=\s*"([^"]+)"', re.MULTILINE)
+_PROVIDER_SOURCE_RE = re.compile(r'^\s*source\s*=\s*"([^"]+)"', re.MULTILINE)
+# Resources and data sources without an explicit provider imply hashicorp/<prefix>
+_RESOURCE_TYPE_RE = re.compile(r'^\s*(?:resource|data)\s+"([a-z0-9]+)_', re.MULTILINE)
+
+
+class TerraformError(ValueError):
+    """Raised when a terraform command exits with a non-zero status."""
+
+
+def plugin_cache_path() -> str:
+    """Return the shared terraform provider plugin cache folder."""
+    return cache_path("terraform", "plugin-cache")
+
+
+def provider_mirror_path() -> str:
+    """Return the local filesystem provider mirror used for offline inits."""
+    return cache_path("terraform", "provider-mirror")
+
+
+def _shared_lock_file_path() -> str:
+    return os.path.join(cache_path("terraform"), _LOCK_FILE_NAME)
+
+
+def _terraform_env() -> Dict[str, str]:
+    return {**os.environ, "TF_PLUGIN_CACHE_DIR": plugin_cache_path()}
+
+
+def run_terraform(instance_path: str, *args: str) -> str:
+    """Run terraform with the given arguments in instance_path and return its stdout."""
+    with subprocess.Popen(
+        ["terraform", *args],  # nosec (remove bandit warning)
+        cwd=instance_path,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=_terraform_env(),
+    ) as process:
+        stdout, stderr = process.communicate()
+        if process.returncode != 0:
+            raise TerraformError(
+                f'terraform {args[0]} failed in "{instance_path}".\n'
+                f'{stderr.decode("utf-8")}'
+            )
+
+    return stdout.decode("utf-8")
+
+
+@contextlib.contextmanager
+def _plugin_cache_lock():
+    # Terraform's plugin cache isn't safe for concurrent writers (e.g. fleet creates)
+    with open(
+        os.path.join(cache_path("terraform"), "init.lock"), "w", encoding="utf-8"
+    ) as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _mirror_is_populated() -> bool:
+    return any(os.scandir(provider_mirror_path()))
+
+
+def _locked_providers(lock_file_path: str) -> Dict[str, str]:
+    """Return the provider blocks of a dependency lock file, keyed by address."""
+    try:
+        with open(lock_file_path, encoding="utf-8") as lock_file:
+            contents = lock_file.read()
+    except FileNotFoundError:
+        return {}
+    return {
+        match.group(1): match.group(0)
+        for match in _LOCKED_PROVIDER_RE.finditer(contents)
+    }
+
+
+def _required_providers(instance_path: str) -> Set[str]:
+    with open(os.path.join(instance_path, "main.tf"), encoding="utf-8") as main_file:
+        contents = main_file.read()
+    sources = set(_PROVIDER_SOURCE_RE.findall(contents))
+    sources |= {f"hashicorp/{prefix}" for prefix in _RESOURCE_TYPE_RE.findall(contents)}
+    return {
+        source if source.count("/") == 2 else f"registry.terraform.io/{source}"
+        for source in sources
+    }
+
+
+def _providers_cached(instance_path: str) -> bool:
+    # Whether an init only has to read the shared lock file and the plugin cache
+    locked = _locked_providers(_shared_lock_file_path())
+    for address in _required_providers(instance_path):
+        version = _LOCKED_VERSION_RE.search(locked.get(address, ""))
+        if version is None or not os.path.isdir(
+            os.path.join(plugin_cache_path(), address, version.group(1))
+        ):
+            return False
+    return True
+
+
+def _merge_lock_file(source_path: str, dest_path: str):
+    # Providers already in dest keep their version, so that every folder keeps reusing it
+    dest = _locked_providers(dest_path)
+    added = {
+        address: block
+        for address, block in _locked_providers(source_path).items()
+        if address not in dest
+    }
+    if not added:
+        return
+    merged = {**dest, **added}
+    write_atomically(
+        dest_path,
+        _LOCK_FILE_HEADER
+        + "".join(f"\n{merged[address]}" for address in sorted(merged)),
+    )
+
+
+def terraform_init(instance_path: str, offline: bool = False):
+    """Run terraform init in instance_path, reusing the shared provider cache.
+
+    The shared dependency lock file is copied in first, since terraform only links
+    cached providers whose checksums are already recorded in the lock file. With
+    offline, providers are installed from the local mirror and the registry is never
+    contacted.
+
+    Inits whose providers are all cached and locked only read the cache, so they run
+    concurrently. The others hold an exclusive lock, and merge the providers they locked
+    into the shared lock file.
+    """
+    instance_lock_file = os.path.join(instance_path, _LOCK_FILE_NAME)
+    shared_lock_file = _shared_lock_file_path()
+
+    if os.path.exists(shared_lock_file) and not os.path.exists(instance_lock_file):
+        shutil.copy2(shared_lock_file, instance_lock_file)
+
+    args = ["init", "-input=false"]
+    if offline:
+        if not _mirror_is_populated():
+            raise ValueError(
+                f'Provider mirror "{provider_mirror_path()}" is empty, '
+                "run `ec2 providers` while online first."
+            )
+        args.append(f"-plugin-dir={provider_mirror_path()}")
+
+    if _providers_cached(instance_path):
+        run_terraform(instance_path, *args)
+        return
+
+    with _plugin_cache_lock():
+        # Another init may have locked more providers while this one waited
+        _merge_lock_file(shared_lock_file, instance_lock_file)
+        run_terraform(instance_path, *args)
+        _merge_lock_file(instance_lock_file, shared_lock_file)
+
+
+def mirror_providers():
+    """Download the providers used by the instance template into the local mirror."""
+    with open(
+        os.path.join(base_path(), "ec2-terraform-template.tf"), encoding="utf-8"
+    ) as terraform_file:
+        terraform_contents = terraform_file.read()
+
+    # Placeholder values - only the provider requirements matter here
+    for placeholder, value in [
+        ("$NAME", "mirror"),
+        ("$REGION", "us-east-1"),
+        ("$AMI", "ami-00000000"),
+        ("$INSTANCE_TYPE", "t3.micro"),
+        ("$ACCOUNT", "000000000000"),
+    ]:
+        terraform_contents = terraform_contents.replace(placeholder, value)
+
+    with tempfile.TemporaryDirectory() as template_dir:
+        with open(
+            os.path.join(template_dir, "main.tf"), "w", encoding="utf-8"
+        ) as instance_file:
+            instance_file.write(terraform_contents)
+
+        with _plugin_cache_lock():
+            run_terraform(template_dir, "providers", "mirror", provider_mirror_path())
+
+            # Record the mirrored providers' checksums for every managed folder to reuse
+            run_terraform(
+                template_dir,
+                "init",
+                "-input=false",
+                f"-plugin-dir={provider_mirror_path()}",
+            )
+            shutil.copy2(
+                os.path.join(template_dir, _LOCK_FILE_NAME), _shared_lock_file_path()
+            )
+
+    print(f'Providers mirrored to "{provider_mirror_path()}".')
@@ -0,0 +1,114 @@
+"""Read outputs and resources straight from the terraform state of instance folders."""
+import dataclasses
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+from terraform_manager.terraform_runner import run_terraform
+
+_LOCAL_STATE_FILE = "terraform.tfstate"
+# Written by terraform init when the folder is configured with a (remote) backend
+_BACKEND_STATE_FILE = os.path.join(".terraform", "terraform.tfstate")
+
+
+@dataclasses.dataclass
+class InstanceOutputs:
+    """The outputs of the instance template."""
+
+    server_ip: Optional[str] = None
+    # Path of the private key, relative to the instance folder
+    server_key: Optional[str] = None
+    server_public_key: Optional[str] = None
+    instance_id: Optional[str] = None
+
+
+@dataclasses.dataclass
+class TerraformState:
+    """A parsed (version 4) terraform state."""
+
+    outputs: Dict[str, Any]
+    resources: List[dict]
+
+    @staticmethod
+    def from_json(state: dict) -> "TerraformState":
+        """Return the state stored as the given dict."""
+        if state.get("version") != 4:
+            raise ValueError(
+                f'Unsupported terraform state version {state.get("version")}'
+            )
+        return TerraformState(
+            outputs={
+                name: output["value"]
+                for name, output in state.get("outputs", {}).items()
+            },
+            resources=state.get("resources", []),
+        )
+
+    def output(self, name: str) -> Optional[str]:
+        """Return the value of the given string output, if the state has it."""
+        value = self.outputs.get(name)
+        if value is not None and not isinstance(value, str):
+            raise ValueError(
+                f'Output "{name}" is a {type(value).__name__}, not a string'
+            )
+        return value
+
+    def instance_outputs(self) -> InstanceOutputs:
+        """Return the outputs of the instance template."""
+        return InstanceOutputs(
+            **{
+                field.name: self.output(field.name)
+                for field in dataclasses.fields(InstanceOutputs)
+            }
+        )
+
+    def resource_attributes(self, resource_type: str) -> List[dict]:
+        """Return the attributes of every managed resource instance of the given type."""
+        return [
+            instance["attributes"]
+            for resource in self.resources
+            if resource.get("mode") == "managed" and resource["type"] == resource_type
+            for instance in resource.get("instances", [])
+        ]
+
+
+def _uses_remote_backend(instance_path: str) -> bool:
+    try:
+        with open(
+            os.path.join(instance_path, _BACKEND_STATE_FILE), encoding="utf-8"
+        ) as backend_file:
+            backend = json.load(backend_file).get("backend") or {}
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+    return backend.get("type", "local") != "local"
+
+
+def read_state(instance_path: str) -> Optional[TerraformState]:
+    """Return the terraform state of instance_path, or None if nothing was applied yet.
+
+    A local state file is parsed directly. A folder with a remote backend costs a single
+    `terraform state pull`, which returns the state in the same format.
+    """
+    if _uses_remote_backend(instance_path):
+        contents = run_terraform(instance_path, "state", "pull")
+        return (
+            TerraformState.from_json(json.loads(contents)) if contents.strip() else None
+        )
+
+    try:
+        with open(
+            os.path.join(instance_path, _LOCAL_STATE_FILE), encoding="utf-8"
+        ) as state_file:
+            return TerraformState.from_json(json.load(state_file))
+    except FileNotFoundError:
+        return None
+
+
+def read_instance_outputs(instance_paths: Iterable[str]) -> Dict[str, InstanceOutputs]:
+    """Return the outputs of every given folder that has a state, keyed by folder."""
+    outputs = {}
+    for instance_path in instance_paths:
+        state = read_state(instance_path)
+        if state is not None:
+            outputs[instance_path] = state.instance_outputs()
+    return outputs
@@ -0,0 +1,20 @@
+"""Shared setup of the terraform_manager tests."""
+import os
+import sys
+
+import pytest
+
+# The ec2 script runs from its own folder, which makes terraform_manager importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def terraform_folders(tmp_path, monkeypatch):
+    """Point the managed terraform folders at a temporary folder and return it."""
+    # pylint: disable=import-outside-toplevel
+    from terraform_manager import instance_registry
+
+    path = tmp_path / "terraform_folders"
+    path.mkdir()
+    monkeypatch.setattr(instance_registry, "terraform_folders_path", lambda: str(path))
+    return path
@@ -0,0 +1,208 @@
+"""Tests of the instance registry and its migration of old-style folders."""
+import dataclasses
+import json
+import threading
+import time
+
+from terraform_manager import instance_registry
+from terraform_manager.instance_configuration import InstanceConfiguration, LinuxDistro
+from terraform_manager.instance_registry import (
+    InstanceRecord,
+    InstanceRegistry,
+    read_base_name,
+)
+
+_LEGACY_FILES = {
+    "distro": "UBUNTU",
+    "region": "eu-west-1",
+    "ami-id": "ami-0123456789abcdef0",
+    "instance-type": "t3.micro",
+    "creation_time": "2023-06-01 08:00:00",
+}
+
+
+def _record(name: str, region: str = "eu-west-1", **fields) -> InstanceRecord:
+    return InstanceRecord(
+        name=name,
+        instance_configuration=InstanceConfiguration(
+            region=region,
+            ami="ami-0123456789abcdef0",
+            instance_type="t3.micro",
+            distro=LinuxDistro.UBUNTU,
+        ),
+        creation_time="2023-06-01 08:00:00",
+        **fields,
+    )
+
+
+def _legacy_folder(terraform_folders, name: str, files: dict):
+    config_dir = terraform_folders / f"ec2-{name}" / "config"
+    config_dir.mkdir(parents=True)
+    for file_name, value in files.items():
+        (config_dir / file_name).write_text(value + "\n", encoding="utf-8")
+    return config_dir.parent
+
+
+def test_records_round_trip_through_json():
+    record = _record(
+        "web",
+        server_ip="1.2.3.4",
+        server_key="./web_server_key.pem",
+        instance_id="i-0123",
+        base_name="pool-abcd1234",
+    )
+    assert InstanceRecord.from_json(json.loads(json.dumps(record.to_json()))) == record
+    assert record.resource_name == "pool-abcd1234"
+    assert _record("web").resource_name == "web"
+
+
+def test_legacy_folders_are_migrated_on_first_load(terraform_folders):
+    _legacy_folder(
+        terraform_folders,
+        "web",
+        {
+            **_LEGACY_FILES,
+            "server_ip.txt": "1.2.3.4",
+            "server_key.txt": "./web_server_key.pem",
+            "instance-id": "i-0123",
+        },
+    )
+
+    registry = InstanceRegistry.load()
+
+    assert registry.all() == [
+        _record(
+            "web",
+            server_ip="1.2.3.4",
+            server_key="./web_server_key.pem",
+            instance_id="i-0123",
+        )
+    ]
+    contents = json.loads((terraform_folders / "registry.json").read_text())
+    assert contents["version"] == 1
+    assert list(contents["instances"]) == ["web"]
+
+
+def test_migration_falls_back_on_the_terraform_state(terraform_folders):
+    instance_path = _legacy_folder(terraform_folders, "web", _LEGACY_FILES)
+    (instance_path / "terraform.tfstate").write_text(
+        json.dumps(
+            {
+                "version": 4,
+                "outputs": {
+                    "server_ip": {"value": "5.6.7.8"},
+                    "server_key": {"value": "./web_server_key.pem"},
+                    "instance_id": {"value": "i-0456"},
+                },
+                "resources": [],
+            }
+        ),
+        encoding="utf-8",
+    )
+
+    record = InstanceRegistry.load().get("web")
+
+    assert (record.server_ip, record.server_key, record.instance_id) == (
+        "5.6.7.8",
+        "./web_server_key.pem",
+        "i-0456",
+    )
+
+
+def test_incomplete_legacy_folders_are_skipped(terraform_folders, capsys):
+    _legacy_folder(terraform_folders, "web", _LEGACY_FILES)
+    _legacy_folder(
+        terraform_folders,
+        "broken",
+        {key: value for key, value in _LEGACY_FILES.items() if key != "ami-id"},
+    )
+    _legacy_folder(terraform_folders, "odd", {**_LEGACY_FILES, "distro": "GENTOO"})
+
+    assert [record.name for record in InstanceRegistry.load().all()] == ["web"]
+    assert "Not migrating ec2-broken" in capsys.readouterr().err
+
+
+def test_folders_added_later_are_migrated_on_get(terraform_folders):
+    registry = InstanceRegistry.load()
+    assert registry.all() == []
+
+    _legacy_folder(terraform_folders, "web", _LEGACY_FILES)
+
+    assert registry.get("web") == _record("web")
+    assert InstanceRegistry.load().find("web") == _record("web")
+
+
+def test_records_are_indexed_by_region(terraform_folders):
+    with InstanceRegistry.update() as registry:
+        registry.put(_record("a", region="us-east-1"))
+        registry.put(_record("b", region="eu-west-1"))
+        registry.put(_record("c", region="us-east-1"))
+        registry.put(_record("b", region="us-east-1"))
+        registry.remove("a")
+
+    registry = InstanceRegistry.load()
+    assert registry.regions() == ["us-east-1"]
+    assert [record.name for record in registry.by_region("us-east-1")] == ["b", "c"]
+
+
+def test_concurrent_updates_are_not_lost(terraform_folders, monkeypatch):
+    write_atomically = instance_registry.write_atomically
+
+    def slow_write(path, contents):
+        # Widens the read-modify-write window that the lock must protect
+        time.sleep(0.01)
+        write_atomically(path, contents)
+
+    monkeypatch.setattr(instance_registry, "write_atomically", slow_write)
+    InstanceRegistry.load()
+
+    def add(name):
+        with InstanceRegistry.update() as registry:
+            registry.put(_record(name))
+
+    threads = [
+        threading.Thread(target=add, args=(f"instance-{i:02}",)) for i in range(16)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [record.name for record in InstanceRegistry.load().all()] == [
+        f"instance-{i:02}" for i in range(16)
+    ]
+
+
+def test_backfill_completes_records_from_the_state(terraform_folders):
+    instance_path = terraform_folders / "ec2-web"
+    instance_path.mkdir()
+    (instance_path / "terraform.tfstate").write_text(
+        json.dumps(
+            {
+                "version": 4,
+                "outputs": {"server_ip": {"value": "5.6.7.8"}},
+                "resources": [],
+            }
+        ),
+        encoding="utf-8",
+    )
+    with InstanceRegistry.update() as registry:
+        registry.put(_record("web", instance_id="i-0123"))
+
+    (record,) = instance_registry.backfill_from_state(
+        [_record("web", instance_id="i-0123")]
+    )
+
+    expected = dataclasses.replace(
+        _record("web", instance_id="i-0123"), server_ip="5.6.7.8"
+    )
+    assert record == expected
+    assert InstanceRegistry.load().find("web") == expected
+
+
+def test_base_name_is_read_from_main_tf(tmp_path):
+    (tmp_path / "main.tf").write_text(
+        'locals {\n  base_name = "pool-abcd1234"\n}\n', encoding="utf-8"
+    )
+    assert read_base_name(str(tmp_path)) == "pool-abcd1234"
+    assert read_base_name(str(tmp_path / "missing")) is None
@@ -0,0 +1,98 @@
+"""Tests of how managed instances are matched to the live EC2 instances."""
+import datetime
+
+from terraform_manager.instance_configuration import InstanceConfiguration, LinuxDistro
+from terraform_manager.instance_registry import InstanceRecord
+from terraform_manager.instance_status import MISSING_STATE, _describe_instances
+
+
+class _FakeEc2Client:
+    """Answers describe_instances filters from a fixed list of instances."""
+
+    def __init__(self, instances):
+        self.instances = instances
+        self.filters = []
+
+    def get_paginator(self, operation):
+        assert operation == "describe_instances"
+        return self
+
+    def paginate(self, Filters):  # pylint: disable=invalid-name
+        (ec2_filter,) = Filters
+        self.filters.append(ec2_filter)
+        assert len(ec2_filter["Values"]) <= 200
+
+        def matches(instance):
+            if ec2_filter["Name"] == "instance-id":
+                return instance["InstanceId"] in ec2_filter["Values"]
+            return any(
+                tag["Key"] == "Name" and tag["Value"] in ec2_filter["Values"]
+                for tag in instance["Tags"]
+            )
+
+        return [
+            {"Reservations": [{"Instances": [i for i in self.instances if matches(i)]}]}
+        ]
+
+
+def _instance(instance_id: str, name_tag: str, state: str = "running") -> dict:
+    return {
+        "InstanceId": instance_id,
+        "State": {"Name": state},
+        "Tags": [{"Key": "Name", "Value": name_tag}],
+        "PublicIpAddress": "1.2.3.4",
+        "LaunchTime": datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc),
+    }
+
+
+def _record(name: str, instance_id=None) -> InstanceRecord:
+    return InstanceRecord(
+        name=name,
+        instance_configuration=InstanceConfiguration(
+            region="eu-west-1",
+            ami="ami-0123456789abcdef0",
+            instance_type="t3.micro",
+            distro=LinuxDistro.UBUNTU,
+        ),
+        creation_time="2024-01-01 12:00:00",
+        instance_id=instance_id,
+    )
+
+
+def test_instances_are_matched_by_id_whatever_their_name_tag():
+    client = _FakeEc2Client(
+        [
+            _instance("i-imported", "my-own-name"),
+            _instance("i-legacy-old", "legacy-server", state="terminated"),
+            _instance("i-legacy", "legacy-server"),
+        ]
+    )
+
+    statuses = _describe_instances(
+        client,
+        [_record("imported", "i-imported"), _record("legacy"), _record("gone", "i-0")],
+    )
+
+    assert statuses["imported"].instance_id == "i-imported"
+    assert statuses["imported"].public_ip == "1.2.3.4"
+    assert statuses["legacy"].instance_id == "i-legacy"
+    assert statuses["gone"].state == MISSING_STATE
+    assert client.filters == [
+        {"Name": "instance-id", "Values": ["i-0", "i-imported"]},
+        {"Name": "tag:Name", "Values": ["legacy-server"]},
+    ]
+
+
+def test_filter_values_are_chunked():
+    records = [_record(f"web-{i:03}", f"i-{i:03}") for i in range(450)]
+    client = _FakeEc2Client([_instance("i-449", "web-449-server")])
+
+    statuses = _describe_instances(client, records)
+
+    assert [len(ec2_filter["Values"]) for ec2_filter in client.filters] == [
+        200,
+        200,
+        50,
+    ]
+    assert statuses["web-449"].state == "running"
+    assert statuses["web-000"].state == MISSING_STATE
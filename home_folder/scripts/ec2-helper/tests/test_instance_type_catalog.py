@@ -0,0 +1,125 @@
+"""Tests of the instance type index."""
+import pytest
+
+from terraform_manager.instance_type_catalog import (
+    InstanceTypeIndex,
+    InstanceTypeInfo,
+    InstanceTypeRequirements,
+)
+
+_INSTANCE_TYPES = [
+    InstanceTypeInfo("t3.nano", 2, 512, "x86_64"),
+    InstanceTypeInfo("t3.micro", 2, 1024, "x86_64"),
+    InstanceTypeInfo("t3a.micro", 2, 1024, "x86_64"),
+    InstanceTypeInfo("t4g.micro", 2, 1024, "arm64"),
+    InstanceTypeInfo("c5.large", 2, 4096, "x86_64"),
+    InstanceTypeInfo("c5.xlarge", 4, 8192, "x86_64"),
+    InstanceTypeInfo("m5.xlarge", 4, 16384, "x86_64"),
+    InstanceTypeInfo("m7g.2xlarge", 8, 32768, "arm64"),
+]
+
+
+def _index(prices=None) -> InstanceTypeIndex:
+    # Sorted like the cached index
+    return InstanceTypeIndex(
+        sorted(_INSTANCE_TYPES, key=lambda x: (x.vcpus, x.memory_mib, x.name)),
+        prices or {},
+    )
+
+
+def _best_match(index: InstanceTypeIndex, **requirements) -> str:
+    match = index.best_match(InstanceTypeRequirements(**requirements))
+    return match.name if match else None
+
+
+def test_unconstrained_returns_the_smallest_type():
+    assert _best_match(_index()) == "t3.nano"
+
+
+@pytest.mark.parametrize(
+    "min_vcpus, expected",
+    [
+        (0, "t3.nano"),
+        (1, "t3.nano"),
+        (2, "t3.nano"),
+        (3, "c5.xlarge"),
+        (4, "c5.xlarge"),
+        (8, "m7g.2xlarge"),
+        (9, None),
+    ],
+)
+def test_min_vcpus_bisects_to_the_first_type_with_enough(min_vcpus, expected):
+    assert _best_match(_index(), min_vcpus=min_vcpus) == expected
+
+
+@pytest.mark.parametrize(
+    "min_memory_gib, expected",
+    [
+        (0.5, "t3.nano"),
+        (0.75, "t3.micro"),
+        (1, "t3.micro"),
+        (4, "c5.large"),
+        (4.5, "c5.xlarge"),
+        (16, "m5.xlarge"),
+        (32, "m7g.2xlarge"),
+        (64, None),
+    ],
+)
+def test_min_memory_moves_on_to_bigger_types(min_memory_gib, expected):
+    assert _best_match(_index(), min_memory_gib=min_memory_gib) == expected
+
+
+def test_architecture_is_matched():
+    assert _best_match(_index(), architecture="arm64") == "t4g.micro"
+    assert _best_match(_index(), architecture="arm64", min_vcpus=3) == "m7g.2xlarge"
+
+
+def test_requirements_are_combined():
+    assert _best_match(_index(), min_vcpus=4, min_memory_gib=12) == "m5.xlarge"
+
+
+def test_ties_go_to_the_cheapest_then_to_the_name():
+    assert _best_match(_index(), min_memory_gib=1) == "t3.micro"
+    prices = {"t3.micro": 0.0104, "t3a.micro": 0.0094, "t4g.micro": 0.0084}
+    assert _best_match(_index(prices), min_memory_gib=1) == "t4g.micro"
+    # Unknown prices lose against known ones
+    assert _best_match(_index({"t3a.micro": 0.0094}), min_memory_gib=1) == "t3a.micro"
+
+
+def test_max_price_excludes_expensive_and_unpriced_types():
+    prices = {"t3.nano": 0.0052, "c5.large": 0.085, "c5.xlarge": 0.17}
+    assert _best_match(_index(prices), max_price=0.01) == "t3.nano"
+    assert _best_match(_index(prices), min_memory_gib=1, max_price=0.1) == "c5.large"
+    assert _best_match(_index(prices), min_vcpus=4, max_price=0.1) is None
+
+
+def test_max_price_needs_prices():
+    with pytest.raises(ValueError):
+        _index().best_match(InstanceTypeRequirements(max_price=1.0))
+
+
+def test_empty_index_has_no_match():
+    assert InstanceTypeIndex([], {}).best_match(InstanceTypeRequirements()) is None
+
+
+def test_lookups_by_name():
+    index = _index({"t3.nano": 0.0052})
+    assert index.get("c5.large").vcpus == 2
+    assert index.get("x1.32xlarge") is None
+    assert index.price("t3.nano") == 0.0052
+    assert index.price("c5.large") is None
+
+
+def test_from_description_skips_unsupported_architectures():
+    description = {
+        "InstanceType": "t2.micro",
+        "ProcessorInfo": {"SupportedArchitectures": ["i386", "x86_64"]},
+        "VCpuInfo": {"DefaultVCpus": 1},
+        "MemoryInfo": {"SizeInMiB": 1024},
+        "NetworkInfo": {"NetworkPerformance": "Low to Moderate"},
+    }
+    info = InstanceTypeInfo.from_description(description)
+    assert (info.architecture, info.vcpus, info.memory_gib) == ("x86_64", 1, 1.0)
+
+    description["ProcessorInfo"]["SupportedArchitectures"] = ["i386"]
+    assert InstanceTypeInfo.from_description(description) is None
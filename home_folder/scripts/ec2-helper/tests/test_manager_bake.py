@@ -0,0 +1,27 @@
+"""Tests of what baking runs on the source instance."""
+from terraform_manager import manager_bake
+from terraform_manager.manager_bake import (
+    BAKED_MARKER_PATH,
+    FIRST_BOOT_SCRIPT_PATH,
+    _mark_as_baked,
+)
+
+
+def test_source_only_gains_the_marker_and_first_boot_script(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        manager_bake.subprocess,
+        "run",
+        lambda command, **kwargs: calls.append((command, kwargs["input"])),
+    )
+
+    _mark_as_baked(["ssh", "ubuntu@1.2.3.4"], "20240101-120000", "i-0123")
+
+    ((ssh_command, script),) = calls
+    (command,) = ssh_command[2:]
+    assert command.count("sudo tee") == 2
+    assert BAKED_MARKER_PATH in command and FIRST_BOOT_SCRIPT_PATH in command
+    assert "cloud-init clean" not in command
+    assert "authorized_keys" not in command
+    assert b'SOURCE_INSTANCE_ID="i-0123"\n' in script
+    assert b"$BAKED_INSTANCE_ID" not in script
@@ -0,0 +1,39 @@
+"""Tests of destroying instances."""
+from terraform_manager import manager_destroy
+from terraform_manager.instance_configuration import InstanceConfiguration, LinuxDistro
+from terraform_manager.instance_registry import InstanceRecord, InstanceRegistry
+from terraform_manager.manager_destroy import destroy_instance_configuration_folders
+
+
+def test_entries_without_a_folder_are_only_removed_from_the_registry(
+    terraform_folders, tmp_path, monkeypatch, capsys
+):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setattr(
+        manager_destroy, "terraform_folders_path", lambda: str(terraform_folders)
+    )
+
+    def fail(*_):
+        raise AssertionError("terraform ran")
+
+    monkeypatch.setattr(manager_destroy, "run_terraform", fail)
+    with InstanceRegistry.update() as registry:
+        registry.put(
+            InstanceRecord(
+                name="stale",
+                instance_configuration=InstanceConfiguration(
+                    region="eu-west-1",
+                    ami="ami-0123456789abcdef0",
+                    instance_type="t3.micro",
+                    distro=LinuxDistro.UBUNTU,
+                ),
+                creation_time="2024-01-01 12:00:00",
+            )
+        )
+
+    destroy_instance_configuration_folders([], all_instances=True)
+
+    assert InstanceRegistry.load().all() == []
+    output = capsys.readouterr().out
+    assert "Destroy: 1 succeeded, 0 failed." in output
+    assert 'Note for "stale"' in output
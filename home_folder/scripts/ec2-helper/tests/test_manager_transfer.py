@@ -0,0 +1,167 @@
+"""Tests of the manifest diffing behind ec2 push and ec2 pull."""
+import os
+
+import pytest
+
+from terraform_manager import manager_transfer
+from terraform_manager.instance_configuration import InstanceConfiguration, LinuxDistro
+from terraform_manager.instance_registry import InstanceRecord
+
+# pylint: disable=protected-access
+
+
+@pytest.fixture(name="source")
+def fixture_source(tmp_path):
+    source = tmp_path / "project"
+    (source / "src").mkdir(parents=True)
+    (source / "README.md").write_text("hello\n")
+    (source / "src" / "main.py").write_text("print('hello')\n")
+    return source
+
+
+def _diff(source, entries):
+    return manager_transfer._diff_local(str(source), str(source), entries)
+
+
+def _touch(path, mtime_ns):
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_first_push_sends_everything(source):
+    changed, sizes, entries = _diff(source, {})
+
+    assert sorted(changed) == ["README.md", os.path.join("src", "main.py")]
+    assert sizes == {"README.md": 6, os.path.join("src", "main.py"): 15}
+    assert set(entries) == set(changed)
+    assert entries["README.md"][0] == 6
+    assert len(entries["README.md"][2]) == 64
+
+
+def test_unchanged_files_are_skipped_without_hashing(source, monkeypatch):
+    _, _, entries = _diff(source, {})
+
+    def fail(path):
+        raise AssertionError(f"{path} hashed")
+
+    monkeypatch.setattr(manager_transfer, "_sha256", fail)
+    assert _diff(source, entries) == ([], {}, entries)
+
+
+def test_touched_but_identical_files_are_skipped(source):
+    _, _, entries = _diff(source, {})
+    _touch(source / "README.md", 1_000_000_000_000_000_000)
+
+    changed, _, new_entries = _diff(source, entries)
+
+    assert not changed
+    # The new modification time is recorded, so the next push doesn't hash it again
+    assert new_entries["README.md"][1] == 1_000_000_000_000_000_000
+    assert new_entries["README.md"][2] == entries["README.md"][2]
+
+
+def test_modified_and_new_files_are_sent(source):
+    _, _, entries = _diff(source, {})
+    mtime_ns = entries["README.md"][1]
+    # Same size, so only the new modification time gives the change away
+    (source / "README.md").write_text("HELLO\n")
+    _touch(source / "README.md", mtime_ns + 1)
+    (source / "src" / "util.py").write_text("")
+
+    changed, sizes, _ = _diff(source, entries)
+
+    assert sorted(changed) == ["README.md", os.path.join("src", "util.py")]
+    assert sizes == {"README.md": 6, os.path.join("src", "util.py"): 0}
+
+
+def test_deleted_files_leave_the_manifest(source):
+    _, _, entries = _diff(source, {})
+    (source / "README.md").unlink()
+
+    _, _, new_entries = _diff(source, entries)
+
+    assert list(new_entries) == [os.path.join("src", "main.py")]
+
+
+def test_single_files_are_diffed_by_name(source):
+    changed, _, _ = manager_transfer._diff_local(
+        str(source / "README.md"), str(source), {}
+    )
+    assert changed == ["README.md"]
+
+
+def test_failed_transfers_keep_their_old_entry():
+    old_entries = {"a": [1, 1, "a1"], "b": [1, 1, "b1"]}
+    new_entries = {"a": [2, 2, "a2"], "b": [2, 2, "b2"], "c": [3, 3, "c3"]}
+
+    entries = manager_transfer._pushed_entries(
+        old_entries, new_entries, ["a", "b", "c"], {"a"}
+    )
+
+    # b is retried from its old entry; c, never pushed, from no entry at all
+    assert entries == {"a": [2, 2, "a2"], "b": [1, 1, "b1"]}
+
+
+def test_pull_skips_files_unchanged_on_both_sides(tmp_path):
+    (tmp_path / "a.txt").write_text("a")
+    (tmp_path / "b.txt").write_text("b")
+    listing = {
+        "a.txt": ["1", "1700000000.0"],
+        "b.txt": ["1", "1700000000.0"],
+        "c.txt": ["2048", "1700000000.0"],
+    }
+    entries = {
+        path: [listing[path], manager_transfer._local_stat(str(tmp_path / path))]
+        for path in ("a.txt", "b.txt")
+    }
+    entries["c.txt"] = [listing["c.txt"], [2048, 1]]
+
+    assert manager_transfer._diff_remote(listing, str(tmp_path), entries) == (
+        ["c.txt"],
+        {"c.txt": 2048},
+    )
+
+    # Changed remotely, and changed locally since the last pull
+    listing["a.txt"] = ["1", "1700000001.0"]
+    _touch(tmp_path / "b.txt", 1_000_000_000_000_000_000)
+    changed, _ = manager_transfer._diff_remote(listing, str(tmp_path), entries)
+    assert changed == ["a.txt", "b.txt", "c.txt"]
+
+
+def test_streams_are_balanced_by_size():
+    sizes = {"big": 40 << 20, "medium": 30 << 20, "small": 20 << 20, "tiny": 15 << 20}
+
+    buckets = manager_transfer._split_streams(list(sizes), sizes, 2)
+
+    assert sorted(buckets) == [["big", "tiny"], ["medium", "small"]]
+
+
+def test_small_transfers_use_a_single_stream():
+    sizes = {"a": 1024, "b": 2048}
+    assert manager_transfer._split_streams(list(sizes), sizes, 4) == [["b", "a"]]
+
+
+def test_manifests_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    record = InstanceRecord(
+        name="web",
+        instance_configuration=InstanceConfiguration(
+            region="eu-west-1",
+            ami="ami-0123456789abcdef0",
+            instance_type="t3.micro",
+            distro=LinuxDistro.UBUNTU,
+        ),
+        creation_time="2024-01-01 12:00:00",
+        instance_id="i-0123",
+    )
+    manifest = manager_transfer._Manifest(record, "push", "/src", "dest")
+    manifest.entries = {"a": [1, 2, "abc"]}
+    manifest.save()
+
+    assert manager_transfer._Manifest(
+        record, "push", "/src", "dest"
+    ).load().entries == {"a": [1, 2, "abc"]}
+    # Other directions, paths and instances have their own manifest
+    assert not manager_transfer._Manifest(record, "pull", "/src", "dest").load().entries
+    assert (
+        not manager_transfer._Manifest(record, "push", "/src", "other").load().entries
+    )
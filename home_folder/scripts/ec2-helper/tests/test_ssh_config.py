@@ -0,0 +1,150 @@
+"""Tests of the managed ssh_config block."""
+import pytest
+
+from terraform_manager import ssh_config
+from terraform_manager.instance_configuration import InstanceConfiguration, LinuxDistro
+from terraform_manager.instance_registry import InstanceRecord, InstanceRegistry
+from terraform_manager.ssh_config import BLOCK_BEGIN, BLOCK_END, sync_ssh_config
+
+_USER_CONFIG = """Host github.com
+    User git
+
+Host *
+    AddKeysToAgent yes
+"""
+
+# What earlier versions appended for every IP an instance had
+_LEGACY_STANZA = """
+Host EC2-Helper-1.2.3.4
+    HostName 1.2.3.4
+    User ubuntu
+    Port 22
+    IdentityFile /path/to/web_server_key.pem
+    StrictHostKeyChecking no
+    """
+
+
+@pytest.fixture(name="config_path")
+def fixture_config_path(tmp_path, monkeypatch, terraform_folders):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    return tmp_path / ".ssh" / "config"
+
+
+def _register(*records: InstanceRecord):
+    with InstanceRegistry.update() as registry:
+        for record in records:
+            registry.put(record)
+
+
+def _record(name: str, server_ip=None, server_key=None) -> InstanceRecord:
+    return InstanceRecord(
+        name=name,
+        instance_configuration=InstanceConfiguration(
+            region="eu-west-1",
+            ami="ami-0123456789abcdef0",
+            instance_type="t3.micro",
+            distro=LinuxDistro.AMAZON_LINUX,
+        ),
+        creation_time="2024-01-01 12:00:00",
+        server_ip=server_ip,
+        server_key=server_key,
+    )
+
+
+def _hosts(contents: str):
+    return [
+        line.split()[1] for line in contents.splitlines() if line.startswith("Host ")
+    ]
+
+
+def test_block_has_one_entry_per_instance_with_an_ip(config_path, terraform_folders):
+    _register(
+        _record("web", "1.2.3.4", "./web_server_key.pem"),
+        _record("db", "5.6.7.8"),
+        _record("stopped"),
+    )
+
+    sync_ssh_config()
+
+    contents = config_path.read_text()
+    assert contents.startswith(BLOCK_BEGIN + "\n")
+    assert contents.endswith("Host *\n" + BLOCK_END + "\n")
+    assert _hosts(contents) == ["EC2-Helper-db", "EC2-Helper-web", "*"]
+    assert "    HostName 1.2.3.4\n    User ec2-user\n" in contents
+    key_path = terraform_folders / "ec2-web" / "web_server_key.pem"
+    assert f"    IdentityFile {key_path}\n    IdentitiesOnly yes\n" in contents
+    assert contents.count("IdentityFile") == 1
+
+
+def test_block_is_rewritten_at_the_top(config_path):
+    config_path.parent.mkdir()
+    config_path.write_text(_USER_CONFIG)
+    _register(_record("web", "1.2.3.4"), _record("db", "5.6.7.8"))
+    sync_ssh_config()
+
+    with InstanceRegistry.update() as registry:
+        registry.remove("db")
+    sync_ssh_config()
+
+    contents = config_path.read_text()
+    assert _hosts(contents) == ["EC2-Helper-web", "*", "github.com", "*"]
+    assert contents.endswith(BLOCK_END + "\n\n" + _USER_CONFIG)
+    assert contents.count(BLOCK_BEGIN) == 1
+
+
+def test_unchanged_config_is_not_rewritten(config_path, monkeypatch):
+    _register(_record("web", "1.2.3.4"))
+    sync_ssh_config()
+
+    def fail(*_):
+        raise AssertionError("rewritten")
+
+    monkeypatch.setattr(ssh_config, "write_atomically", fail)
+    sync_ssh_config()
+
+
+def test_legacy_stanzas_are_stripped(config_path):
+    config_path.parent.mkdir()
+    config_path.write_text(
+        "Host github.com\n    User git\n"
+        + _LEGACY_STANZA
+        + _LEGACY_STANZA.replace("1.2.3.4", "5.6.7.8")
+        + "\nHost gitlab.com\n    User git\n"
+    )
+    _register(_record("web", "9.9.9.9"))
+
+    sync_ssh_config()
+
+    contents = config_path.read_text()
+    assert "1.2.3.4" not in contents
+    assert "5.6.7.8" not in contents
+    assert _hosts(contents) == ["EC2-Helper-web", "*", "github.com", "gitlab.com"]
+    assert contents.endswith(
+        "Host github.com\n    User git\n\nHost gitlab.com\n    User git\n"
+    )
+
+
+def test_other_hosts_with_the_same_options_are_kept(config_path):
+    user_config = (
+        "Host build\n    HostName 10.0.0.1\n    StrictHostKeyChecking no\n"
+        "    User ci\n"
+    )
+    config_path.parent.mkdir()
+    config_path.write_text(user_config)
+
+    sync_ssh_config()
+
+    assert config_path.read_text() == BLOCK_BEGIN + "\nHost *\n" + BLOCK_END + (
+        "\n\n" + user_config
+    )
+
+
+def test_config_of_only_legacy_stanzas_is_replaced(config_path):
+    config_path.parent.mkdir()
+    config_path.write_text(
+        _LEGACY_STANZA + _LEGACY_STANZA.replace("1.2.3.4", "5.6.7.8")
+    )
+
+    sync_ssh_config()
+
+    assert config_path.read_text() == BLOCK_BEGIN + "\nHost *\n" + BLOCK_END + "\n"
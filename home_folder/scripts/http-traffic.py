@@ -1,45 +1,516 @@
 #!/usr/bin/env python3
 
 import argparse
-import requests
+import asyncio
+import collections
+import json
+import math
+import os
 import sys
 import time
 
 DEFAULT_ENDPOINT = "https://api.sampleapis.com/countries/countries"
 
+REPORTED_PERCENTILES = [50, 90, 99, 99.9]
+
+class LatencyHistogram:
+    """Fixed-memory histogram of latencies in microseconds with ~3% relative precision.
+
+    Values below 2 * SUB_BUCKETS are stored exactly; above that every power of two is split
+    into SUB_BUCKETS linear sub-buckets (the HdrHistogram layout). Latencies above MAX_US
+    are clamped into the last bucket (but the exact max is still tracked).
+    """
+
+    SUB_BUCKET_BITS = 5
+    SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+    MAX_US = 3600 * 1000 * 1000
+
+    def __init__(self):
+        self.counts = [0] * (self._index(self.MAX_US) + 1)
+        self.count = 0
+        self.total_us = 0
+        self.min_us = None
+        self.max_us = 0
+
+    @classmethod
+    def _index(cls, value_us):
+        if value_us < 2 * cls.SUB_BUCKETS:
+            return value_us
+        shift = value_us.bit_length() - 1 - cls.SUB_BUCKET_BITS
+        return shift * cls.SUB_BUCKETS + (value_us >> shift)
+
+    @classmethod
+    def _upper_bound(cls, index):
+        if index < 2 * cls.SUB_BUCKETS:
+            return index
+        shift = index // cls.SUB_BUCKETS - 1
+        top = index - shift * cls.SUB_BUCKETS
+        return ((top + 1) << shift) - 1
+
+    def record(self, seconds):
+        value_us = max(0, int(seconds * 1_000_000))
+        self.counts[self._index(min(value_us, self.MAX_US))] += 1
+        self.count += 1
+        self.total_us += value_us
+        self.min_us = value_us if self.min_us is None else min(self.min_us, value_us)
+        self.max_us = max(self.max_us, value_us)
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total_us += other.total_us
+        if other.min_us is not None:
+            self.min_us = other.min_us if self.min_us is None else min(self.min_us, other.min_us)
+        self.max_us = max(self.max_us, other.max_us)
+
+    def snapshot(self):
+        """Return a compact, picklable copy (only the non-empty buckets)."""
+        return {
+            "counts": {index: count for index, count in enumerate(self.counts) if count},
+            "count": self.count,
+            "total_us": self.total_us,
+            "min_us": self.min_us,
+            "max_us": self.max_us,
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        histogram = cls()
+        for index, count in snapshot["counts"].items():
+            histogram.counts[index] = count
+        histogram.count = snapshot["count"]
+        histogram.total_us = snapshot["total_us"]
+        histogram.min_us = snapshot["min_us"]
+        histogram.max_us = snapshot["max_us"]
+        return histogram
+
+    def percentile(self, percentile):
+        """Return the latency in seconds at the given percentile (0 if nothing was recorded)."""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(percentile / 100 * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self._upper_bound(index), self.max_us) / 1_000_000
+        return self.max_us / 1_000_000
+
+    def summary(self):
+        summary = {f"p{p:g}": self.percentile(p) for p in REPORTED_PERCENTILES}
+        summary["min"] = (self.min_us or 0) / 1_000_000
+        summary["mean"] = self.total_us / self.count / 1_000_000 if self.count else 0.0
+        summary["max"] = self.max_us / 1_000_000
+        return summary
+
+class Stats:
+    """Request counters, latency histogram and error breakdown."""
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.status_codes = collections.Counter()
+        self.exceptions = collections.Counter()
+
+    @property
+    def requests(self):
+        return self.latency.count
+
+    @property
+    def errors(self):
+        return sum(self.exceptions.values()) + sum(count for status, count in self.status_codes.items() if status >= 400)
+
+    def record_response(self, status, seconds):
+        self.latency.record(seconds)
+        self.status_codes[status] += 1
+
+    def record_exception(self, exception, seconds):
+        self.latency.record(seconds)
+        self.exceptions[type(exception).__name__] += 1
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        self.status_codes.update(other.status_codes)
+        self.exceptions.update(other.exceptions)
+
+    def snapshot(self):
+        return {"latency": self.latency.snapshot(), "status_codes": dict(self.status_codes), "exceptions": dict(self.exceptions)}
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        stats = cls()
+        stats.latency = LatencyHistogram.from_snapshot(snapshot["latency"])
+        stats.status_codes.update(snapshot["status_codes"])
+        stats.exceptions.update(snapshot["exceptions"])
+        return stats
+
+    def report(self, elapsed):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "elapsed_seconds": elapsed,
+            "requests_per_second": self.requests / elapsed if elapsed > 0 else 0.0,
+            "latency_seconds": self.latency.summary(),
+            "status_codes": {str(status): count for status, count in sorted(self.status_codes.items())},
+            "exceptions": dict(self.exceptions.most_common()),
+        }
+
+def format_latencies(latency):
+    return ", ".join(f"{name}={value * 1000:.1f}ms" for name, value in latency.summary().items() if name != "mean")
+
+class StatsReporter:
+    """Accumulates stats and streams an interval summary to stderr every `interval` seconds."""
+
+    def __init__(self, interval=None):
+        self.interval = interval
+        # In worker processes: ship interval snapshots here instead of printing them
+        self.sink = None
+        self.total = Stats()
+        self.current = Stats()
+        self.last_report = time.monotonic()
+
+    def maybe_report(self, force=False):
+        now = time.monotonic()
+        if not self.interval or (not force and now - self.last_report < self.interval):
+            return
+        current, self.current = self.current, Stats()
+        if self.sink:
+            self.last_report = now
+            self.sink(current.snapshot())
+            return
+        self.total.merge(current)
+        elapsed = now - self.last_report
+        self.last_report = now
+        line = f"[{time.strftime('%H:%M:%S')}] {current.requests / elapsed:.1f} req/s, {current.errors} errors"
+        if current.requests:
+            line += f", {format_latencies(current.latency)}"
+        sys.stderr.write(line + "\n")
+
+    def finish(self):
+        self.total.merge(self.current)
+        self.current = Stats()
+        return self.total
+
+reporter = StatsReporter()
+issued_requests = 0
+
 def fetch_endpoint(endpoint, interval=1, count=None, quiet=False):
-    global total_requests
+    """Compatibility mode: one request at a time, sleeping `interval` between requests."""
+    import requests
+
     total_requests = 0
 
+    # Reuse one keep-alive connection instead of a new TCP/TLS handshake per request
+    with requests.Session() as session:
+        while True:
+            start = time.perf_counter()
+            try:
+                response = session.get(endpoint)
+            except requests.RequestException as e:
+                reporter.current.record_exception(e, time.perf_counter() - start)
+                raise
+            reporter.current.record_response(response.status_code, time.perf_counter() - start)
+            total_requests += 1
+            if not quiet:
+                print(response.text)
+            reporter.maybe_report()
+
+            if count is not None and total_requests >= count:
+                break
+
+            time.sleep(interval)
+            if not quiet:
+                sys.stderr.write(f"Total requests made: {total_requests}\n")
+
+async def worker(session, endpoint, interval, count, quiet):
+    global issued_requests
+
+    # Workers share one event loop thread, so checking and claiming a request is atomic
+    while count is None or issued_requests < count:
+        issued_requests += 1
+        start = time.perf_counter()
+        try:
+            async with session.get(endpoint) as response:
+                body = await response.read()
+            reporter.current.record_response(response.status, time.perf_counter() - start)
+            if not quiet:
+                print(body.decode("utf-8", errors="replace"))
+        except Exception as e:  # aiohttp.ClientError, asyncio.TimeoutError, ...
+            reporter.current.record_exception(e, time.perf_counter() - start)
+            if not quiet:
+                sys.stderr.write(f"Request failed: {e!r}\n")
+
+        if interval:
+            await asyncio.sleep(interval)
+
+async def report_periodically():
     while True:
-        response = requests.get(endpoint)
-        total_requests += 1
-        if not quiet:
-            print(response.text)
+        await asyncio.sleep(reporter.interval)
+        reporter.maybe_report(force=True)
 
-        if count is not None and total_requests >= count:
-            break
+def import_aiohttp(option):
+    try:
+        import aiohttp
+    except ImportError:
+        sys.exit(f"{option} requires aiohttp (pip3 install aiohttp).")
+    return aiohttp
+
+def client_session(aiohttp, connections, timeout):
+    """Return a session whose keep-alive connection pool holds up to `connections` connections."""
+    connector = aiohttp.TCPConnector(limit=connections, ttl_dns_cache=300, keepalive_timeout=60)
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout))
+
+async def fetch_endpoint_concurrently(endpoint, concurrency, interval=0, count=None, quiet=False, timeout=30):
+    """Run `concurrency` request loops sharing one pooled keep-alive connection pool."""
+    aiohttp = import_aiohttp("--concurrency")
+
+    reporter_task = asyncio.create_task(report_periodically()) if reporter.interval else None
+
+    async with client_session(aiohttp, concurrency, timeout) as session:
+        await asyncio.gather(*(worker(session, endpoint, interval, count, quiet) for _ in range(concurrency)))
+
+    if reporter_task:
+        reporter_task.cancel()
+
+def rate_profile(profile, rate, start_rate=0, ramp_up=0, step_size=None, step_duration=None):
+    """Return the target arrival rate (requests/second) as a function of the elapsed time."""
+    if profile == "hold":
+        return lambda elapsed: rate
+    if profile == "ramp":
+        if not ramp_up:
+            raise ValueError("--profile ramp requires --ramp-up.")
+        return lambda elapsed: min(rate, start_rate + (rate - start_rate) * elapsed / ramp_up)
+    if profile == "step":
+        if not step_size or not step_duration:
+            raise ValueError("--profile step requires --step-size and --step-duration.")
+        return lambda elapsed: min(rate, start_rate + step_size * (1 + int(elapsed // step_duration)))
+    raise ValueError(f"Unknown profile: {profile}")
+
+# The arrival curve is integrated in steps this long, over which the target rate is taken as constant
+RATE_INTEGRATION_STEP = 0.01
+
+def send_times(rate_at, duration=None, phase=0.0):
+    """Yield the times (seconds from the start) at which to send requests.
+
+    Sends follow the integral of `rate_at`: the k-th one goes out when it reaches `phase` + k, so
+    the number sent by any time t is the integral up to t (rounded up), even on a ramp from 0.
+    """
+    step_start = 0.0
+    arrivals = 0.0
+    due = phase
+    while duration is None or step_start < duration:
+        rate = rate_at(step_start + RATE_INTEGRATION_STEP / 2)
+        step_arrivals = rate * RATE_INTEGRATION_STEP
+        while rate > 0 and due < arrivals + step_arrivals:
+            send_time = step_start + (due - arrivals) / rate
+            if duration is not None and send_time >= duration:
+                return
+            yield send_time
+            due += 1
+        step_start += RATE_INTEGRATION_STEP
+        arrivals += step_arrivals
 
-        time.sleep(interval)
+async def timed_request(session, endpoint, intended_start, quiet):
+    try:
+        async with session.get(endpoint) as response:
+            body = await response.read()
+        # Measured from when the request *should* have been sent, not when it was, so that
+        # queueing behind a slow server counts (no coordinated omission)
+        reporter.current.record_response(response.status, time.perf_counter() - intended_start)
+        if not quiet:
+            print(body.decode("utf-8", errors="replace"))
+    except Exception as e:  # aiohttp.ClientError, asyncio.TimeoutError, ...
+        reporter.current.record_exception(e, time.perf_counter() - intended_start)
         if not quiet:
-            sys.stderr.write(f"Total requests made: {total_requests}\n")
+            sys.stderr.write(f"Request failed: {e!r}\n")
+
+async def fetch_endpoint_at_rate(endpoint, rate_at, duration=None, count=None, quiet=False, timeout=30, connections=1000, phase=0.0):
+    """Open-loop load: send requests on a fixed arrival timeline, however slow responses get."""
+    global issued_requests
+    aiohttp = import_aiohttp("--rate")
+
+    reporter_task = asyncio.create_task(report_periodically()) if reporter.interval else None
+    in_flight = set()
+    max_lag = 0.0
+
+    async with client_session(aiohttp, connections, timeout) as session:
+        start = time.perf_counter()
+        for next_send in send_times(rate_at, duration, phase):
+            if count is not None and issued_requests >= count:
+                break
+            delay = start + next_send - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+
+            issued_requests += 1
+            task = asyncio.create_task(timed_request(session, endpoint, start + next_send, quiet))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+        await asyncio.gather(*in_flight)
+
+    if reporter_task:
+        reporter_task.cancel()
+
+    if max_lag > 1:
+        sys.stderr.write(f"Warning: the scheduler fell up to {max_lag:.1f}s behind - this process can't sustain the requested rate.\n")
+
+def run_event_loop(coroutine):
+    try:
+        # Noticeably faster event loop, if available
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    asyncio.run(coroutine)
+
+def share(total, workers, index):
+    """Return worker `index`'s part of `total` when it's split as evenly as possible."""
+    return total // workers + (1 if index < total % workers else 0)
+
+def run_load(args, workers=1, index=0):
+    """Run the load mode selected by `args`, doing this worker's 1/workers share of it."""
+    count = None if args.count is None else share(args.count, workers, index)
+    if args.rate is not None:
+        rate_at = rate_profile(args.profile, args.rate / workers, args.start_rate / workers, args.ramp_up,
+                               args.step_size and args.step_size / workers, args.step_duration)
+        connections = share(args.concurrency, workers, index) if args.concurrency else 1000
+        # Worker `index` sends its first request index / rate seconds in, so that the workers'
+        # sends interleave instead of all going out at once
+        run_event_loop(fetch_endpoint_at_rate(args.endpoint, rate_at, args.duration, count, args.quiet, args.timeout, connections, index / workers))
+    elif args.concurrency is None:
+        fetch_endpoint(args.endpoint, 1 if args.interval is None else args.interval, count, args.quiet)
+    else:
+        run_event_loop(fetch_endpoint_concurrently(args.endpoint, share(args.concurrency, workers, index), args.interval or 0, count, args.quiet, args.timeout))
+
+# How often worker processes send their stats to the parent
+SNAPSHOT_INTERVAL = 0.5
+
+def worker_process(args, workers, index, queue):
+    reporter.interval = SNAPSHOT_INTERVAL
+    reporter.sink = lambda snapshot: queue.put(("stats", snapshot))
+    try:
+        run_load(args, workers, index)
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        queue.put(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        queue.put(("stats", reporter.current.snapshot()))
+        queue.put(("done", None))
+
+def run_processes(args, workers):
+    """Run the load in `workers` processes, merging their stats into this process's reporter."""
+    import multiprocessing
+    import queue as queue_module
+
+    queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=worker_process, args=(args, workers, index, queue), daemon=True) for index in range(workers)]
+    for process in processes:
+        process.start()
+
+    running = workers
+    try:
+        while running:
+            try:
+                kind, payload = queue.get(timeout=0.1)
+            except queue_module.Empty:
+                # A worker that died without saying goodbye (e.g. it was killed)
+                running = min(running, sum(process.is_alive() for process in processes))
+            else:
+                if kind == "stats":
+                    reporter.current.merge(Stats.from_snapshot(payload))
+                elif kind == "error":
+                    sys.stderr.write(f"Worker failed: {payload}\n")
+                elif kind == "done":
+                    running -= 1
+            reporter.maybe_report()
+    except KeyboardInterrupt:
+        # The workers got the interrupt too - collect their final stats
+        deadline = time.monotonic() + 5
+        while running and time.monotonic() < deadline:
+            try:
+                kind, payload = queue.get(timeout=0.1)
+            except queue_module.Empty:
+                continue
+            if kind == "stats":
+                reporter.current.merge(Stats.from_snapshot(payload))
+            elif kind == "done":
+                running -= 1
+
+    for process in processes:
+        process.join(timeout=1)
+
+def print_report(stats, elapsed_time, report_format):
+    if report_format == "json":
+        print(json.dumps(stats.report(elapsed_time), indent=2))
+        return
+
+    print(f"\n\nTotal number of requests: {stats.requests}")
+    if stats.errors:
+        print(f"Total number of failed requests: {stats.errors}")
+        for status, count in sorted(stats.status_codes.items()):
+            if status >= 400:
+                print(f"    HTTP {status}: {count}")
+        for exception, count in stats.exceptions.most_common():
+            print(f"    {exception}: {count}")
+    print(f"Elapsed time: {elapsed_time:.2f} seconds")
+    if elapsed_time > 0:
+        print(f"Requests per second: {stats.requests / elapsed_time:.2f}")
+    if stats.requests:
+        print(f"Latency: {format_latencies(stats.latency)}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Access an endpoint at regular intervals.")
     parser.add_argument("-e", "--endpoint", default=DEFAULT_ENDPOINT, help=f"URL of the endpoint to access (default is {DEFAULT_ENDPOINT}).")
-    parser.add_argument("-i", "--interval", type=float, default=1, help="Interval in seconds between requests (default is 1 second).")
+    parser.add_argument("-i", "--interval", type=float, default=None, help="Interval in seconds between requests (default is 1 second, or 0 with --concurrency).")
     parser.add_argument("-c", "--count", type=int, help="Limit the number of requests to this count. If not provided, the script will run indefinitely.")
     parser.add_argument("-q", "--quiet", action="store_true", help="Suppress output. If provided, the response text and total requests made won't be printed.")
+    parser.add_argument("-n", "--concurrency", type=int, help="Run this many concurrent request loops over a pooled keep-alive connection pool (requires aiohttp). With --rate: the maximum number of open connections (default is 1000).")
+    parser.add_argument("-t", "--timeout", type=float, default=30, help="Per-request timeout in seconds with --concurrency or --rate (default is 30 seconds).")
+    parser.add_argument("-R", "--rate", type=float, help="Open-loop mode: send this many requests per second on a fixed schedule, regardless of response times (requires aiohttp).")
+    parser.add_argument("-p", "--profile", choices=["hold", "ramp", "step"], default="hold", help="With --rate: hold the rate, ramp up to it linearly over --ramp-up seconds, or step up to it by --step-size every --step-duration seconds (default is hold).")
+    parser.add_argument("--start-rate", type=float, default=0, help="With --rate: the rate at which the ramp or step profiles start (default is 0).")
+    parser.add_argument("--ramp-up", type=float, help="With --profile ramp: seconds to ramp up from --start-rate to --rate.")
+    parser.add_argument("--step-size", type=float, help="With --profile step: requests per second added at every step.")
+    parser.add_argument("--step-duration", type=float, help="With --profile step: seconds spent at every step.")
+    parser.add_argument("-d", "--duration", type=float, help="With --rate: stop scheduling requests after this many seconds.")
+    parser.add_argument("-P", "--processes", type=int, help="With --concurrency or --rate: split the load across this many worker processes (default is the number of cores).")
+    parser.add_argument("-s", "--stats-interval", type=float, help="Stream throughput, errors and latency percentiles to stderr every this many seconds.")
+    parser.add_argument("-r", "--report", choices=["text", "json"], default="text", help="Format of the summary printed at exit (default is text).")
     args = parser.parse_args()
 
+    if args.rate is not None and args.rate <= 0:
+        parser.error("--rate must be positive.")
+
+    if args.concurrency is None and args.rate is None:
+        # Compatibility mode is inherently sequential
+        processes = 1
+    else:
+        processes = args.processes or os.cpu_count() or 1
+        if args.concurrency is not None:
+            processes = min(processes, args.concurrency)
+        if args.rate is not None:
+            # Every worker should get at least a request per second of the rate
+            processes = max(1, min(processes, int(args.rate)))
+        if args.count is not None:
+            processes = max(1, min(processes, args.count))
+
+    reporter.interval = args.stats_interval
     start_time = time.time()
 
     try:
-        fetch_endpoint(args.endpoint, args.interval, args.count, args.quiet)
+        if processes > 1:
+            run_processes(args, processes)
+        else:
+            run_load(args)
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
-        print(f"An exception occurred: {e}")
+        print(f"An exception occurred: {e}", file=sys.stderr if args.report == "json" else sys.stdout)
     finally:
         end_time = time.time()
         elapsed_time = end_time - start_time
-        print(f"\n\nTotal number of requests: {total_requests}")
-        print(f"Elapsed time: {elapsed_time:.2f} seconds")
\ No newline at end of file
+        print_report(reporter.finish(), elapsed_time, args.report)
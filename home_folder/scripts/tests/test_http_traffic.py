@@ -0,0 +1,154 @@
+"""Tests of the latency histogram and the request schedule of http-traffic.py."""
+import importlib.util
+import math
+import os
+import random
+
+import pytest
+
+_SPEC = importlib.util.spec_from_file_location(
+    "http_traffic",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "http-traffic.py"),
+)
+http_traffic = importlib.util.module_from_spec(_SPEC)
+_SPEC.loader.exec_module(http_traffic)
+
+LatencyHistogram = http_traffic.LatencyHistogram
+
+# Relative precision of values above the exactly stored range (1 / SUB_BUCKETS)
+_PRECISION = 1 / LatencyHistogram.SUB_BUCKETS
+
+
+def _histogram(latencies_us):
+    histogram = LatencyHistogram()
+    for latency_us in latencies_us:
+        histogram.record(latency_us / 1_000_000)
+    return histogram
+
+
+def _exact_percentile(sorted_us, percentile):
+    return sorted_us[max(1, math.ceil(percentile / 100 * len(sorted_us))) - 1]
+
+
+def test_empty_histogram():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(50) == 0.0
+    assert histogram.summary()["mean"] == 0.0
+
+
+def test_small_values_are_exact():
+    latencies_us = list(range(2 * LatencyHistogram.SUB_BUCKETS))
+    histogram = _histogram(latencies_us)
+    for percentile in (1, 25, 50, 90, 100):
+        assert histogram.percentile(percentile) * 1_000_000 == pytest.approx(
+            _exact_percentile(latencies_us, percentile)
+        )
+
+
+@pytest.mark.parametrize("percentile", [1, 50, 90, 99, 99.9, 100])
+def test_percentiles_are_within_the_precision(percentile):
+    rng = random.Random(42)
+    # Log-normal, like real latencies: ~1ms to ~1s
+    latencies_us = sorted(
+        int(rng.lognormvariate(math.log(20_000), 1.2)) for _ in range(20_000)
+    )
+    histogram = _histogram(latencies_us)
+
+    exact = _exact_percentile(latencies_us, percentile)
+    estimate = histogram.percentile(percentile) * 1_000_000
+    # Buckets report their upper bound, so estimates never undershoot
+    assert exact <= estimate <= exact * (1 + _PRECISION) + 1
+
+
+def test_bucket_bounds_cover_every_value():
+    for value_us in [0, 63, 64, 65, 127, 128, 1000, 123_456, 10**9]:
+        index = LatencyHistogram._index(value_us)  # pylint: disable=protected-access
+        upper = LatencyHistogram._upper_bound(index)  # pylint: disable=protected-access
+        assert value_us <= upper <= value_us * (1 + _PRECISION) + 1
+        assert (
+            LatencyHistogram._index(upper) == index
+        )  # pylint: disable=protected-access
+
+
+def test_values_above_the_maximum_are_clamped():
+    histogram = _histogram([10, LatencyHistogram.MAX_US * 2])
+    assert histogram.max_us == LatencyHistogram.MAX_US * 2
+    assert histogram.percentile(100) == pytest.approx(
+        LatencyHistogram.MAX_US / 1_000_000, rel=_PRECISION
+    )
+
+
+def test_merge_equals_recording_everything_in_one():
+    rng = random.Random(7)
+    first = [rng.randrange(1, 5_000_000) for _ in range(1000)]
+    second = [rng.randrange(1, 50_000) for _ in range(3000)]
+
+    merged = _histogram(first)
+    merged.merge(_histogram(second))
+    combined = _histogram(first + second)
+
+    assert merged.counts == combined.counts
+    assert (merged.count, merged.total_us) == (combined.count, combined.total_us)
+    assert (merged.min_us, merged.max_us) == (combined.min_us, combined.max_us)
+    assert merged.summary() == combined.summary()
+
+
+def test_merge_of_an_empty_histogram():
+    histogram = _histogram([100, 200])
+    histogram.merge(LatencyHistogram())
+    assert (histogram.count, histogram.min_us, histogram.max_us) == (2, 100, 200)
+
+    empty = LatencyHistogram()
+    empty.merge(_histogram([100, 200]))
+    assert (empty.count, empty.min_us, empty.max_us) == (2, 100, 200)
+
+
+def test_snapshots_round_trip():
+    histogram = _histogram([5, 500, 50_000, 5_000_000])
+    restored = LatencyHistogram.from_snapshot(histogram.snapshot())
+    assert restored.counts == histogram.counts
+    assert restored.summary() == histogram.summary()
+
+
+def _sends_by(rate_at, duration):
+    return list(http_traffic.send_times(rate_at, duration))
+
+
+@pytest.mark.parametrize("rate", [0.5, 10, 100, 2500])
+def test_ramp_sends_follow_the_integral_of_the_rate(rate):
+    rate_at = http_traffic.rate_profile("ramp", rate, ramp_up=60)
+
+    sends = _sends_by(rate_at, 90)
+
+    # Half the final rate over the ramp, then the full rate
+    for elapsed in (1, 6, 30, 60, 90):
+        integral = rate * min(elapsed, 60) ** 2 / 120 + rate * max(0, elapsed - 60)
+        assert sum(send < elapsed for send in sends) == pytest.approx(integral, abs=1)
+    assert sends == sorted(sends)
+
+
+def test_step_sends_follow_the_integral_of_the_rate():
+    rate_at = http_traffic.rate_profile("step", 40, step_size=10, step_duration=5)
+
+    sends = _sends_by(rate_at, 30)
+
+    assert len(sends) == pytest.approx(50 + 100 + 150 + 200 * 3, abs=1)
+
+
+def test_hold_sends_are_evenly_spaced():
+    sends = _sends_by(http_traffic.rate_profile("hold", 4), 2)
+
+    assert sends == pytest.approx([i / 4 for i in range(8)])
+
+
+def test_workers_interleave_their_sends():
+    workers = 4
+    sends = sorted(
+        send
+        for index in range(workers)
+        for send in http_traffic.send_times(
+            http_traffic.rate_profile("hold", 8 / workers), 1, index / workers
+        )
+    )
+
+    assert sends == pytest.approx([i / 8 for i in range(8)])
@@ -0,0 +1,146 @@
+#!/bin/bash
+
+# Dependency-aware provisioning steps, sourced by setup.sh and secondary_setup.sh.
+#
+#   step NAME "DEPENDENCIES" COMMAND [ARGS...]
+#       Run COMMAND in the background as soon as every step in DEPENDENCIES succeeded.
+#       Its output goes to a per-step log, which is printed if it fails.
+#   wait_for_steps
+#       Wait for all steps, print their timings, and fail if any of them failed.
+#   fetch URL DESTINATION [CHECKSUM_URL]
+#       Download URL through a local cache. Cached files are verified against the
+#       checksum recorded when they were downloaded, and against CHECKSUM_URL (a file
+#       with a single SHA-256 or a sha256sum-style list) when it's given.
+
+PROVISIONING_STEPS_DIR=$(mktemp -d)
+if [ "$EUID" -eq 0 ]; then
+    PROVISIONING_CACHE_DIR=${PROVISIONING_CACHE_DIR:-/var/cache/ec2-helper-setup}
+else
+    PROVISIONING_CACHE_DIR=${PROVISIONING_CACHE_DIR:-${XDG_CACHE_HOME:-$HOME/.cache}/ec2-helper-setup}
+fi
+mkdir -p "$PROVISIONING_CACHE_DIR"
+
+PROVISIONING_START=$(date +%s.%N)
+PROVISIONING_STEPS=()
+PROVISIONING_PIDS=()
+
+function _elapsed_since() {
+    awk -v start="$1" -v end="$(date +%s.%N)" 'BEGIN { printf "%.1f", end - start }'
+}
+
+function step() {
+    local name=$1
+    local dependencies=$2
+    shift 2
+
+    (
+        for dependency in $dependencies; do
+            while [ ! -f "$PROVISIONING_STEPS_DIR/$dependency.status" ]; do
+                sleep 0.2
+            done
+            if [ "$(cat "$PROVISIONING_STEPS_DIR/$dependency.status")" != "0" ]; then
+                echo -e "${RED}Skipping $name: $dependency failed${NC}"
+                echo "skipped" > "$PROVISIONING_STEPS_DIR/$name.time"
+                echo 1 > "$PROVISIONING_STEPS_DIR/$name.status"
+                exit 1
+            fi
+        done
+
+        echo -e "${GREEN}Starting $name...${NC}"
+        local start
+        start=$(date +%s.%N)
+        "$@" > "$PROVISIONING_STEPS_DIR/$name.log" 2>&1
+        local status=$?
+        echo "$(_elapsed_since "$start")s" > "$PROVISIONING_STEPS_DIR/$name.time"
+
+        if [ $status -eq 0 ]; then
+            echo -e "${GREEN}Finished $name ($(cat "$PROVISIONING_STEPS_DIR/$name.time"))${NC}"
+        else
+            echo -e "${RED}$name failed with status $status:${NC}"
+            cat "$PROVISIONING_STEPS_DIR/$name.log"
+        fi
+        # Written last - dependent steps start as soon as it appears
+        echo $status > "$PROVISIONING_STEPS_DIR/$name.status"
+    ) &
+
+    PROVISIONING_STEPS+=("$name")
+    PROVISIONING_PIDS+=($!)
+}
+
+function wait_for_steps() {
+    wait "${PROVISIONING_PIDS[@]}"
+
+    local failed=0
+    local timings=""
+    for name in "${PROVISIONING_STEPS[@]}"; do
+        timings+="$(printf "    %-28s %8s" "$name" "$(cat "$PROVISIONING_STEPS_DIR/$name.time")")\n"
+        if [ "$(cat "$PROVISIONING_STEPS_DIR/$name.status")" != "0" ]; then
+            failed=1
+        fi
+    done
+    timings+="$(printf "    %-28s %8ss" "total (wall clock)" "$(_elapsed_since "$PROVISIONING_START")")"
+
+    echo -e "${GREEN}Step timings:${NC}"
+    echo -e "$timings"
+    echo -e "$(date -Is) $(basename "$0")\n$timings" >> "$PROVISIONING_CACHE_DIR/timings.log"
+
+    PROVISIONING_STEPS=()
+    PROVISIONING_PIDS=()
+    return $failed
+}
+
+function _expected_checksum() {
+    local checksum_url=$1
+    local file_name=$2
+
+    local checksums
+    checksums=$(curl -fsSL --retry 3 "$checksum_url") || return 1
+    if [ "$(echo "$checksums" | wc -w)" -eq 1 ]; then
+        echo "$checksums"
+    else
+        echo "$checksums" | awk -v name="$file_name" '$2 == name || $2 == "*" name { print $1 }'
+    fi
+}
+
+function fetch() {
+    local url=$1
+    local destination=$2
+    local checksum_url=$3
+
+    local file_name
+    file_name=$(basename "$url")
+    # Different versions of an artifact can share a file name, but not a URL
+    local cached
+    cached="$PROVISIONING_CACHE_DIR/$(echo -n "$url" | sha256sum | cut -c1-16)-$file_name"
+
+    local expected=""
+    if [ -n "$checksum_url" ]; then
+        expected=$(_expected_checksum "$checksum_url" "$file_name")
+        if [ -z "$expected" ]; then
+            # Still fine offline, as long as the cached copy is intact
+            echo "Could not retrieve the checksum of $file_name from $checksum_url"
+            [ -f "$cached" ] || return 1
+        fi
+    fi
+
+    if [ -f "$cached" ] && [ -f "$cached.sha256" ] && \
+        sha256sum --status -c "$cached.sha256" && \
+        { [ -z "$expected" ] || [ "$(cut -d' ' -f1 "$cached.sha256")" == "$expected" ]; }; then
+        echo "Using cached $file_name"
+    else
+        curl -fsSL --retry 3 -o "$cached.part" "$url" || return 1
+
+        local actual
+        actual=$(sha256sum "$cached.part" | cut -d' ' -f1)
+        if [ -n "$expected" ] && [ "$actual" != "$expected" ]; then
+            echo "Checksum mismatch for $file_name: expected $expected, got $actual"
+            rm -f "$cached.part"
+            return 1
+        fi
+
+        mv "$cached.part" "$cached"
+        echo "$actual  $cached" > "$cached.sha256"
+    fi
+
+    cp "$cached" "$destination"
+}
@@ -28,14 +28,32 @@ if [ "$EUID" -eq 0 ] && [ "$OVERRIDE_SUDO_CHECK" = false ]; then
   exit 1
 fi
 
-PYTHON_PACKAGES=("virtualenv" "requests" "boto3" "tldr")
-for package in "${PYTHON_PACKAGES[@]}"; do
-    echo -e "${RED}Installing $package...${NC}"
-    pip3 install $package > /dev/null 2>&1
-done
-
-echo -e "${RED}Installing fzf...${NC}"
-git clone --depth 1 https://github.com/junegunn/fzf.git ~/.fzf
-~/.fzf/install --all > /dev/null 2>&1
-
-cp -r $SCRIPT_DIR/home_folder/. $HOME/
+source "$SCRIPT_DIR/provisioning.sh"
+
+function install_python_packages() {
+    # One resolver run instead of one pip run per package
+    if pip3 install "$@"; then
+        return 0
+    fi
+
+    echo "Batched install failed, installing the packages one by one"
+    for package in "$@"; do
+        pip3 install "$package" || echo "Could not install $package"
+    done
+}
+
+function install_fzf() {
+    if [ -d ~/.fzf ]; then
+        git -C ~/.fzf pull --ff-only
+    else
+        git clone --depth 1 https://github.com/junegunn/fzf.git ~/.fzf
+    fi && ~/.fzf/install --all
+}
+
+PYTHON_PACKAGES=("virtualenv" "requests" "aiohttp" "boto3" "tldr")
+step python-packages "" install_python_packages "${PYTHON_PACKAGES[@]}"
+step fzf "" install_fzf
+# fzf's installer edits the fish config, which the home folder copy then takes over
+step home-folder "fzf" cp -r $SCRIPT_DIR/home_folder/. $HOME/
+
+wait_for_steps
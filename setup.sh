@@ -29,75 +29,7 @@ if [[ $EUID -ne 0 ]]; then
    exit 1
 fi
 
-echo -e "${GREEN}Updating $PACKAGE_MANAGER repositories...${NC}"
-$PACKAGE_MANAGER update -y > /dev/null
-
-echo -e "${GREEN}Installing apt-utils...${NC}"
-$PACKAGE_MANAGER install apt-utils -y > /dev/null 2>&1
-
-echo -e "${GREEN}Installing coreutils...${NC}"
-$PACKAGE_MANAGER install coreutils -y > /dev/null 2>&1
-
-echo -e "${GREEN}Installing yum-utils...${NC}"
-$PACKAGE_MANAGER install yum-utils -y > /dev/null 2>&1
-
-echo -e "${GREEN}Installing dialog...${NC}"
-$PACKAGE_MANAGER install dialog -y > /dev/null 2>&1
-
-echo -en "${GREEN}Installing fish shell...${NC}"
-$PACKAGE_MANAGER install fish -y > /dev/null 2>&1
-
-if ! grep -q "^/usr/bin/fish$" /etc/shells; then
-    echo "/usr/bin/fish" | sudo tee -a /etc/shells
-fi
-
-chsh -s /usr/bin/fish $ORIGINAL_USER > /dev/null 2>&1
-if id "ec2-user" &>/dev/null; then
-    chsh -s /usr/bin/fish "ec2-user" > /dev/null 2>&1
-elif id "ubuntu" &>/dev/null; then
-    chsh -s /usr/bin/fish "ubuntu" > /dev/null 2>&1
-fi
-
-echo -e " ${GREEN}Fish shell is now installed and set as the default shell for $ORIGINAL_USER.${NC}"
-
-UTILITIES=("python3" "python3-pip" "curl" "unzip" "golang" "vim" "tmux" "bat" "jq")
-for utility in "${UTILITIES[@]}"; do
-    echo -e "${GREEN}Installing $utility...${NC}"
-    $PACKAGE_MANAGER install $utility -y > /dev/null 2>&1
-done
-
-# Due to bat being installed as batcat in Ubuntu
-if [[ -e /usr/bin/batcat ]]; then mkdir -p ~/.local/bin && ln -s /usr/bin/batcat /usr/local/bin/bat; fi
-
-# Install after utils - because it needs curl
-echo -e "${GREEN}Installing oh my fish...${NC}"
-curl https://raw.githubusercontent.com/oh-my-fish/oh-my-fish/master/bin/install > omf-install 2>/dev/null
-fish omf-install --path=~/.local/share/omf --config=~/.config/omf --noninteractive > /dev/null
-rm omf-install
-
-echo -e "${GREEN}Installing AWS CLI...${NC}"
-curl "https://awscli.amazonaws.com/awscli-exe-linux-x86_64.zip" -o "awscliv2.zip" > /dev/null 2>&1
-unzip awscliv2.zip > /dev/null
-./aws/install > /dev/null
-rm -rf aws*
-
-echo -e "${GREEN}Installing kubectl...${NC}"
-curl -LO "https://storage.googleapis.com/kubernetes-release/release/$(curl -s https://storage.googleapis.com/kubernetes-release/release/stable.txt)/bin/linux/amd64/kubectl" > /dev/null 2>&1
-chmod +x ./kubectl
-mv ./kubectl /usr/local/bin/kubectl
-
-echo -e "${GREEN}Installing eksctl...${NC}"
-ARCH=amd64
-PLATFORM=$(uname -s)_$ARCH
-curl -sLO "https://github.com/eksctl-io/eksctl/releases/latest/download/eksctl_$PLATFORM.tar.gz" > /dev/null 2>&1
-tar -xzf eksctl_$PLATFORM.tar.gz -C /tmp > /dev/null && rm eksctl_$PLATFORM.tar.gz
-
-mv /tmp/eksctl /usr/local/bin
-
-echo -e "${GREEN}Installing aws-iam-authenticator...${NC}"
-curl -Lo aws-iam-authenticator https://github.com/kubernetes-sigs/aws-iam-authenticator/releases/download/v0.5.9/aws-iam-authenticator_0.5.9_linux_amd64 > /dev/null 2>&1
-chmod +x ./aws-iam-authenticator
-mv ./aws-iam-authenticator /usr/local/bin/
+source "$SCRIPT_DIR/provisioning.sh"
 
 # Use SUDO_USER if available, otherwise default to current user.
 ORIGINAL_USER=${SUDO_USER:-$(id -un)}
@@ -121,6 +53,112 @@ else
     OVERRIDE_FLAG=""
 fi
 
+export DEBIAN_FRONTEND=noninteractive
+
+if [ "$PACKAGE_MANAGER" == "apt-get" ]; then
+    PACKAGES=("apt-utils")
+else
+    PACKAGES=("yum-utils")
+fi
+UTILITIES=("python3" "python3-pip" "curl" "unzip" "golang" "vim" "tmux" "bat" "jq")
+PACKAGES+=("coreutils" "dialog" "fish" "${UTILITIES[@]}")
+
+case "$(uname -m)" in
+    aarch64|arm64) ARCH=arm64 ;;
+    *) ARCH=amd64 ;;
+esac
+
+function install_packages() {
+    # One transaction instead of one package manager run per package
+    if $PACKAGE_MANAGER install -y "$@"; then
+        return 0
+    fi
+
+    # A single package missing from this distro's repositories fails the whole batch
+    echo "Batched install failed, installing the packages one by one"
+    for package in "$@"; do
+        $PACKAGE_MANAGER install -y "$package" || echo "Could not install $package"
+    done
+}
+
+function set_up_fish() {
+    if ! grep -q "^/usr/bin/fish$" /etc/shells; then
+        echo "/usr/bin/fish" | tee -a /etc/shells
+    fi
+    chsh -s /usr/bin/fish $ORIGINAL_USER
+}
+
+function link_bat() {
+    # Due to bat being installed as batcat in Ubuntu
+    if [[ -e /usr/bin/batcat ]]; then ln -sf /usr/bin/batcat /usr/local/bin/bat; fi
+}
+
+function install_oh_my_fish() {
+    local work_dir
+    work_dir=$(mktemp -d)
+    curl -fsSL https://raw.githubusercontent.com/oh-my-fish/oh-my-fish/master/bin/install -o "$work_dir/omf-install" && \
+        fish "$work_dir/omf-install" --path=~/.local/share/omf --config=~/.config/omf --noninteractive
+    local status=$?
+    rm -rf "$work_dir"
+    return $status
+}
+
+function download_aws_cli() {
+    fetch "https://awscli.amazonaws.com/awscli-exe-linux-$(uname -m).zip" "$DOWNLOADS_DIR/awscliv2.zip"
+}
+
+function install_aws_cli() {
+    unzip -q -o "$DOWNLOADS_DIR/awscliv2.zip" -d "$DOWNLOADS_DIR" && "$DOWNLOADS_DIR/aws/install" --update
+}
+
+function install_kubectl() {
+    local version
+    version=$(curl -fsSL https://storage.googleapis.com/kubernetes-release/release/stable.txt) || return 1
+    local url="https://storage.googleapis.com/kubernetes-release/release/$version/bin/linux/$ARCH/kubectl"
+    fetch "$url" "$DOWNLOADS_DIR/kubectl" "$url.sha256" && \
+        install -m 755 "$DOWNLOADS_DIR/kubectl" /usr/local/bin/kubectl
+}
+
+function install_eksctl() {
+    local platform
+    platform=$(uname -s)_$ARCH
+    fetch "https://github.com/eksctl-io/eksctl/releases/latest/download/eksctl_$platform.tar.gz" \
+        "$DOWNLOADS_DIR/eksctl.tar.gz" \
+        "https://github.com/eksctl-io/eksctl/releases/latest/download/eksctl_checksums.txt" && \
+        tar -xzf "$DOWNLOADS_DIR/eksctl.tar.gz" -C "$DOWNLOADS_DIR" && \
+        install -m 755 "$DOWNLOADS_DIR/eksctl" /usr/local/bin/eksctl
+}
+
+function install_aws_iam_authenticator() {
+    local release="https://github.com/kubernetes-sigs/aws-iam-authenticator/releases/download/v0.5.9"
+    fetch "$release/aws-iam-authenticator_0.5.9_linux_$ARCH" "$DOWNLOADS_DIR/aws-iam-authenticator" \
+        "$release/authenticator_0.5.9_checksums.txt" && \
+        install -m 755 "$DOWNLOADS_DIR/aws-iam-authenticator" /usr/local/bin/aws-iam-authenticator
+}
+
+DOWNLOADS_DIR=$(mktemp -d)
+
+# Downloads don't need the packages (curl ships with the distros' images), so they
+# overlap with the package manager; only the steps that need a package wait for it
+step update "" $PACKAGE_MANAGER update -y
+step packages "update" install_packages "${PACKAGES[@]}"
+step fish-shell "packages" set_up_fish
+step bat "packages" link_bat
+step oh-my-fish "packages" install_oh_my_fish
+step aws-cli-download "" download_aws_cli
+step aws-cli "packages aws-cli-download" install_aws_cli
+step kubectl "" install_kubectl
+step eksctl "" install_eksctl
+step aws-iam-authenticator "" install_aws_iam_authenticator
+
+wait_for_steps
+STEPS_STATUS=$?
+rm -rf "$DOWNLOADS_DIR"
+
+if [ $STEPS_STATUS -ne 0 ]; then
+    echo -e "${RED}Some steps failed, see above.${NC}"
+fi
+
 echo -e "${GREEN}Running secondary setup script...${NC}"
 if [ -n "$OVERRIDE_FLAG" ]; then
     echo -e "${RED}Running secondary setup script with override flag...${NC}"